@@ -0,0 +1,232 @@
+"""
+Benchmarks ingestion, persistence and search of Memory on synthetic data.
+
+Embeddings come from a stub embedder that looks up precomputed clustered vectors, so the
+benchmark runs offline and measures vectordb itself rather than an embedding model. Results are
+printed (or written) as JSON for regression tracking:
+
+    python benchmarks/benchmark.py --sizes 1000,10000,100000 --backends flat,hnsw,ivf \
+        --output results.json
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+from typing import Any, Dict, List
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vectordb import Memory  # pylint: disable = wrong-import-position
+from vectordb.embedding import BaseEmbedder  # pylint: disable = wrong-import-position
+
+
+class StubEmbedder(BaseEmbedder):
+    """
+    Embeds the synthetic texts "doc <i>" as row i of a precomputed matrix.
+    """
+
+    model_name = "stub"
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def embed_text(self, chunks: List[str]) -> List[List[float]]:
+        return self.vectors[[int(chunk[4:]) for chunk in chunks]].tolist()
+
+
+def make_dataset(size: int, dim: int, queries: int, seed: int, spare: int = 0):
+    """
+    Returns clustered corpus vectors, followed by spare vectors from the same clusters, and
+    queries drawn near corpus vectors.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, size // 100), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=size + spare)] + 0.3 * rng.normal(size=(size + spare, dim)).astype(np.float32)
+    query_vectors = vectors[rng.integers(size, size=queries)] + 0.1 * rng.normal(size=(queries, dim)).astype(np.float32)
+    return vectors.astype(np.float32), query_vectors.astype(np.float32)
+
+
+def ground_truth(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """
+    Returns the exact k nearest neighbours of every query, computed in blocks.
+    """
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    truth = []
+    for start in range(0, len(queries), 64):
+        block = queries[start : start + 64]
+        distances = norms[None, :] - 2 * block @ vectors.T
+        top = np.argpartition(distances, min(k, len(vectors)) - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(distances, top, axis=1), axis=1)
+        truth.append(np.take_along_axis(top, order, axis=1))
+    return np.concatenate(truth)
+
+
+def percentiles(seconds: List[float]) -> Dict[str, float]:
+    """Returns the p50 and p99 of a list of durations, in milliseconds."""
+    return {
+        "p50_ms": float(np.percentile(seconds, 50) * 1e3),
+        "p99_ms": float(np.percentile(seconds, 99) * 1e3),
+    }
+
+
+def result_ids(results: List[Dict[str, Any]]) -> List[int]:
+    """Returns the corpus row of every search result."""
+    return [int(result["chunk"][4:]) for result in results]
+
+
+def bench_concurrency(memory: Memory, queries: np.ndarray, k: int, readers: int, seconds: float, ids: range) -> Dict[str, Any]:
+    """
+    Runs searches on reader threads while the main thread keeps saving the texts with the given
+    ids, and reports the search latency seen by readers and the save throughput.
+    """
+    stop = threading.Event()
+    latencies = [[] for _ in range(readers)]
+    errors = []
+
+    def reader(slot: int):
+        rng = np.random.default_rng(slot)
+        while not stop.is_set():
+            query = queries[rng.integers(len(queries))]
+            start = time.perf_counter()
+            try:
+                memory.search_by_vector(query, top_n=k)
+            except Exception as error:  # pylint: disable = broad-except
+                errors.append(repr(error))
+                return
+            latencies[slot].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=reader, args=(slot,)) for slot in range(readers)]
+    for thread in threads:
+        thread.start()
+
+    saved, next_id = 0, ids.start
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds and next_id + 100 <= ids.stop:
+        texts = [f"doc {i}" for i in range(next_id, next_id + 100)]
+        memory.save(texts)
+        saved += len(texts)
+        next_id += len(texts)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    all_latencies = [latency for slot in latencies for latency in slot]
+    return {
+        "readers": readers,
+        "searches": len(all_latencies),
+        "errors": errors[:5],
+        "saved_chunks_per_second": saved / elapsed,
+        **(percentiles(all_latencies) if all_latencies else {}),
+    }
+
+
+def bench(size: int, backend: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Benchmarks one corpus size with one index backend.
+    """
+    spare = 100000 if args.concurrency else 0
+    vectors, queries = make_dataset(size, args.dim, args.queries, args.seed, spare)
+    corpus = vectors[:size]
+    truth = ground_truth(corpus, queries, args.k)
+    embedder = StubEmbedder(vectors)
+    result = {"size": size, "backend": backend, "dim": args.dim, "k": args.k}
+
+    with tempfile.TemporaryDirectory() as directory:
+        memory_dir = os.path.join(directory, "memory")
+        options = {"embeddings": embedder, "chunking_strategy": {"mode": "paragraph"}, "index": backend}
+
+        memory = Memory(memory_dir, **options)
+        start = time.perf_counter()
+        for batch in range(0, size, args.batch_size):
+            memory.save([f"doc {i}" for i in range(batch, min(batch + args.batch_size, size))])
+        seconds = time.perf_counter() - start
+        result["save"] = {"seconds": seconds, "chunks_per_second": size / seconds}
+
+        start = time.perf_counter()
+        memory.compact()
+        result["snapshot_seconds"] = time.perf_counter() - start
+        memory.close()
+
+        start = time.perf_counter()
+        memory = Memory(memory_dir, **options)
+        result["load_seconds"] = time.perf_counter() - start
+        start = time.perf_counter()
+        memory.sync_index()
+        result["index_build_seconds"] = time.perf_counter() - start
+
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = memory.search_by_vector(query, top_n=args.k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(set(result_ids(found)) & set(expected.tolist()))
+        result["query"] = percentiles(latencies)
+        result["recall_at_k"] = hits / truth.size
+
+        start = time.perf_counter()
+        memory.search_by_vector(queries, top_n=args.k)
+        result["batch_queries_per_second"] = len(queries) / (time.perf_counter() - start)
+
+        if args.concurrency:
+            result["concurrency"] = bench_concurrency(memory, queries, args.k, args.concurrency, args.concurrency_seconds, range(size, size + spare))
+        memory.close()
+    return result
+
+
+def environment() -> Dict[str, Any]:
+    """Returns the versions and hardware the benchmark ran on."""
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+    for module in ("faiss", "mrpt"):
+        try:
+            info[module] = getattr(__import__(module), "__version__", "installed")
+        except ImportError:
+            info[module] = None
+    return info
+
+
+def main():
+    """Runs the benchmarks selected on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma separated corpus sizes")
+    parser.add_argument("--backends", default="auto,flat,hnsw,ivf,sq8,ivfpq", help="comma separated index backends")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension")
+    parser.add_argument("--k", type=int, default=10, help="number of results per query")
+    parser.add_argument("--queries", type=int, default=200, help="number of queries")
+    parser.add_argument("--batch-size", type=int, default=1000, help="texts per save call")
+    parser.add_argument("--concurrency", type=int, default=0, help="reader threads searching while saving (0 to skip)")
+    parser.add_argument("--concurrency-seconds", type=float, default=2.0, help="duration of the concurrent run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        for backend in args.backends.split(","):
+            results.append(bench(size, backend, args))
+            print(f"{backend:>8} {size:>9}: recall@{args.k} {results[-1]['recall_at_k']:.3f}, p50 {results[-1]['query']['p50_ms']:.2f} ms", file=sys.stderr)
+
+    report = {"environment": environment(), "config": vars(args), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file_handler:
+            json.dump(report, file_handler, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
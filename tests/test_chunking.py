@@ -0,0 +1,73 @@
+"""
+Tests of token-aware chunking.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import re
+
+import numpy as np
+
+from vectordb import Memory
+from vectordb.chunking import Chunker
+from vectordb.embedding import BaseEmbedder
+
+
+class PairTokenizer:
+    """A tokenizer with the interface of Hugging Face tokenizers that splits every word into pieces of two characters."""
+
+    model_max_length = 10
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False, verbose=True):
+        offsets = [(start, min(start + 2, word.end())) for word in re.finditer(r"\S+", text) for start in range(word.start(), word.end(), 2)]
+        return {"offset_mapping": offsets}
+
+    @staticmethod
+    def num_special_tokens_to_add():
+        """Returns the number of special tokens the model adds to a sequence."""
+        return 2
+
+
+class RandomEmbedder(BaseEmbedder):
+    """Embeds every text as a random vector seeded by the text."""
+
+    def embed_text(self, chunks):
+        return [np.random.default_rng(abs(hash(chunk)) % 2**32).normal(size=8).astype(np.float32) for chunk in chunks]
+
+
+def test_word_windows_overlap():
+    """Without a tokenizer, windows hold window_size words and overlap by overlap words."""
+    chunker = Chunker({"mode": "tokens", "window_size": 5, "overlap": 2, "sentences": False})
+    text = " ".join(f"w{i}" for i in range(12))
+    assert chunker(text) == ["w0 w1 w2 w3 w4", "w3 w4 w5 w6 w7", "w6 w7 w8 w9 w10", "w9 w10 w11"]
+    assert chunker("  short \n text ") == ["short text"]
+    assert chunker(" \n ") == []
+
+
+def test_windows_end_at_sentence_boundaries():
+    """Windows end at the last sentence boundary that fits, and sentences longer than a window are split."""
+    chunker = Chunker({"mode": "tokens", "window_size": 7, "overlap": 2})
+    assert chunker("One two three. Four five six. Seven eight nine. Ten eleven twelve.") == ["One two three. Four five six.", "Seven eight nine. Ten eleven twelve."]
+    chunker = Chunker({"mode": "tokens", "window_size": 4, "overlap": 1})
+    assert chunker("a b c d e f g h i j. Short one.") == ["a b c d", "d e f g", "g h i j.", "Short one."]
+
+
+def test_windows_are_measured_in_tokenizer_tokens():
+    """With a tokenizer, no window is longer than the model's limit less its special tokens, and windows are cut from the text."""
+    tokenizer = PairTokenizer()
+    chunker = Chunker({"mode": "tokens", "tokenizer": tokenizer, "overlap": 2, "sentences": False})
+    text = " ".join(f"word{i}" for i in range(40))
+    chunks = chunker(text)
+    assert chunker.window_size == 8
+    assert len(chunks) > 1
+    assert all(len(tokenizer(chunk)["offset_mapping"]) <= 8 for chunk in chunks)
+    assert all(chunk in text for chunk in chunks)
+    assert chunks[0].startswith("word0") and chunks[-1].endswith("word39")
+
+
+def test_memory_saves_token_chunks():
+    """A memory with the tokens mode saves every window as a chunk of the text."""
+    memory = Memory(chunking_strategy={"mode": "tokens", "window_size": 5, "overlap": 0, "sentences": False}, embeddings=RandomEmbedder())
+    memory.save(" ".join(f"w{i}" for i in range(12)))
+    chunks = sorted(result["chunk"] for result in memory.search("query", top_n=10))
+    assert chunks == sorted(["w0 w1 w2 w3 w4", "w5 w6 w7 w8 w9", "w10 w11"])
@@ -0,0 +1,185 @@
+"""
+Tests of searches running concurrently with updates.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import threading
+
+import numpy as np
+import pytest
+
+from vectordb import Memory
+from vectordb.embedding import BaseEmbedder
+
+
+class RandomEmbedder(BaseEmbedder):
+    """Embeds every text as a random vector seeded by the text."""
+
+    def embed_text(self, chunks):
+        """Returns one random vector per chunk."""
+        return [np.random.default_rng(abs(hash(chunk)) % 2**32).normal(size=16).astype(np.float32) for chunk in chunks]
+
+
+@pytest.mark.parametrize("index", ["flat", "hnsw", "ivf"])
+def test_searches_during_saves_return_top_n(index):
+    """Searches from many threads return top_n saved results while another thread saves."""
+    memory = Memory(embeddings=RandomEmbedder(), index=index)
+    memory.save([f"doc {i}" for i in range(300)], [{"group": i % 3} for i in range(300)])
+    saved = {f"doc {i}" for i in range(300)}
+    stop = threading.Event()
+    errors = []
+
+    def search(seed):
+        rng = np.random.default_rng(seed)
+        while not stop.is_set():
+            group = int(rng.integers(3))
+            try:
+                results = memory.search(f"doc {rng.integers(1000)}", top_n=5, filter={"group": group} if seed % 2 else None)
+                assert len(results) == 5, results
+                assert all(result["chunk"] in saved for result in results)
+                assert not seed % 2 or all(result["metadata"]["group"] == group for result in results)
+            except Exception as error:  # pylint: disable = broad-exception-caught
+                errors.append(error)
+                return
+
+    threads = [threading.Thread(target=search, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for step in range(30):
+            texts = [f"doc {300 + 10 * step + i}" for i in range(10)]
+            saved.update(texts)
+            memory.save(texts, [{"group": i % 3} for i in range(10)])
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert not errors, errors[0]
+    assert len(memory.search("doc 0", top_n=1000)) == 600
+
+
+@pytest.mark.parametrize("index", ["flat", "hnsw", "ivf"])
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_searches_during_updates_return_top_n(tmp_path, index, on_disk):
+    """Searches return top_n live results while documents are saved, deleted, upserted and compacted."""
+    memory = Memory(str(tmp_path / "memory") if on_disk else None, embeddings=RandomEmbedder(), index=index, save_index=on_disk)
+    memory.save([f"doc {i}" for i in range(300)], [{"group": i % 3} for i in range(300)])
+    stop = threading.Event()
+    deleted = set()
+    errors = []
+
+    def search(seed):
+        rng = np.random.default_rng(seed)
+        while not stop.is_set():
+            group = int(rng.integers(3))
+            dead = set(deleted)
+            try:
+                results = memory.search(f"doc {rng.integers(1000)}", top_n=5, filter={"group": group} if seed % 2 else None)
+                assert len(results) == 5, results
+                assert all(result["chunk"] not in dead for result in results)
+                assert not seed % 2 or all(result["metadata"]["group"] == group for result in results)
+            except Exception as error:  # pylint: disable = broad-exception-caught
+                errors.append(error)
+                return
+
+    threads = [threading.Thread(target=search, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for step in range(15):
+            ids = memory.save([f"doc {300 + 10 * step + i}" for i in range(10)], [{"group": i % 3} for i in range(10)])
+            memory.delete(ids[:4])
+            deleted.update(f"doc {300 + 10 * step + i}" for i in range(4))
+            memory.upsert("upserted", f"upserted {step}", {"group": 1})
+            deleted.add(f"upserted {step - 1}")
+            if step % 5 == 4:
+                memory.compact()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    memory.close()
+    assert not errors, errors[0]
+
+
+def test_reload_during_searches(tmp_path):
+    """Searches on a read-only memory return top_n results while it reloads new snapshots."""
+    path = str(tmp_path / "memory")
+    writer = Memory(path, embeddings=RandomEmbedder(), index="hnsw", save_index=True)
+    writer.save([f"doc {i}" for i in range(300)], [{"group": i % 3} for i in range(300)])
+    writer.compact()
+    reader = Memory(path, embeddings=RandomEmbedder(), index="hnsw", read_only=True)
+    stop = threading.Event()
+    errors = []
+
+    def search(seed):
+        rng = np.random.default_rng(seed)
+        while not stop.is_set():
+            try:
+                results = reader.search(f"doc {rng.integers(1000)}", top_n=5, filter={"group": 1} if seed % 2 else None)
+                assert len(results) == 5, results
+            except Exception as error:  # pylint: disable = broad-exception-caught
+                errors.append(error)
+                return
+
+    threads = [threading.Thread(target=search, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for step in range(5):
+            ids = writer.save([f"doc {300 + 10 * step + i}" for i in range(10)], [{"group": i % 3} for i in range(10)])
+            writer.delete(ids[:4])
+            writer.compact()
+            assert reader.reload()
+            assert len(reader.search("doc 0", top_n=1000)) == 300 + 6 * (step + 1)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    writer.close()
+    reader.close()
+    assert not errors, errors[0]
+
+
+def keyword_text(i):
+    """Returns a text with "alpha" in every fifth text, and enough other words to make purges slow."""
+    return f"doc {i} {'alpha' if i % 5 == 0 else 'beta'} " + " ".join(f"word{(i + j) % 500}" for j in range(50))
+
+
+@pytest.mark.parametrize("mode", ["keyword", "hybrid"])
+def test_keyword_searches_during_purges(mode):
+    """Keyword and hybrid searches return live chunks with the query term while deletes purge the BM25 index."""
+    memory = Memory(chunking_strategy={"mode": "paragraph"}, embeddings=RandomEmbedder(), bm25=True)
+    memory.save([keyword_text(i) for i in range(2000)])
+    stop = threading.Event()
+    deleted = set()
+    errors = []
+
+    def search():
+        while not stop.is_set():
+            dead = set(deleted)
+            try:
+                results = memory.search("alpha", top_n=5, mode=mode)
+                assert len(results) == 5, results
+                assert all(result["chunk"] not in dead for result in results)
+                assert mode == "hybrid" or all("alpha" in result["chunk"] for result in results), results
+            except Exception as error:  # pylint: disable = broad-exception-caught
+                errors.append(error)
+                return
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for step in range(30):
+            texts = [keyword_text(2000 + 200 * step + i) for i in range(200)]
+            ids = memory.save(texts)
+            # deleting most of every batch purges the memory every few steps
+            memory.delete(ids[:150])
+            deleted.update(texts[:150])
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert not errors, errors[0]
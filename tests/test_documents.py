@@ -0,0 +1,114 @@
+"""
+Tests of document ids, deletion and upsert.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import numpy as np
+import pytest
+
+from vectordb import Memory
+from vectordb.embedding import BaseEmbedder
+
+
+class RandomEmbedder(BaseEmbedder):
+    """Embeds every text as a random vector seeded by the text."""
+
+    def embed_text(self, chunks):
+        return [np.random.default_rng(abs(hash(chunk)) % 2**32).normal(size=16).astype(np.float32) for chunk in chunks]
+
+
+def saved_chunks(memory):
+    """Returns the chunks a search over the whole memory finds."""
+    return sorted(result["chunk"] for result in memory.search("query", top_n=1000))
+
+
+def test_integer_ids_of_numbered_texts_are_rejected():
+    """An integer id already given to a numbered text cannot be saved again."""
+    memory = Memory(embeddings=RandomEmbedder())
+    assert memory.save(["a"]) == [0]
+    with pytest.raises(ValueError):
+        memory.save(["b"], ids=[0])
+    assert saved_chunks(memory) == ["a"]
+
+
+def test_numbered_texts_skip_integer_ids(tmp_path):
+    """Texts saved without ids are not numbered with an integer id given to upsert, also after reopening."""
+    path = str(tmp_path / "memory")
+    memory = Memory(path, embeddings=RandomEmbedder())
+    memory.save(["a"])
+    memory.upsert(5, "c")
+    assert memory.save(["d", "e", "f", "g", "h"]) == [6, 7, 8, 9, 10]
+    memory.delete(5)
+    assert saved_chunks(memory) == ["a", "d", "e", "f", "g", "h"]
+    memory.close()
+
+    memory = Memory(path, embeddings=RandomEmbedder())
+    assert memory.save(["i"]) == [11]
+    memory.delete([0, 6])
+    assert saved_chunks(memory) == ["e", "f", "g", "h", "i"]
+    memory.close()
+
+
+def test_numbers_refer_to_numbered_texts_only():
+    """A number is not a document id of a text saved with an id, even when it is that text's position."""
+    memory = Memory(embeddings=RandomEmbedder())
+    memory.save(["x"], ids=["x"])
+    assert memory.save(["a"]) == [1]
+    with pytest.raises(KeyError):
+        memory.delete(0)
+    memory.upsert(1, "b")
+    memory.delete("x")
+    assert saved_chunks(memory) == ["b"]
+
+
+def test_deleted_documents_are_not_found():
+    """Deleting a document hides all of its chunks from searches right away, before compaction."""
+    memory = Memory(embeddings=RandomEmbedder(), chunking_strategy={"mode": "paragraph"})
+    memory.save(["a1\n\na2\n\na3", "b1\n\nb2"] + [f"c{i}" for i in range(10)], [{"doc": "a"}, {"doc": "b"}], ids=["a", "b"] + [f"c{i}" for i in range(10)])
+    memory.delete("a")
+    assert saved_chunks(memory) == sorted(["b1", "b2"] + [f"c{i}" for i in range(10)])
+    assert memory.search("query", top_n=10, filter={"doc": "a"}) == []
+    assert len(memory.store) == 15
+    with pytest.raises(KeyError):
+        memory.delete("missing")
+
+
+def test_upsert_replaces_or_inserts_a_document():
+    """Upserting an existing id replaces its text and metadata; upserting a new id saves it."""
+    memory = Memory(embeddings=RandomEmbedder())
+    memory.save(["old"], [{"version": 1}], ids=["doc"])
+    memory.upsert("doc", "new", {"version": 2})
+    memory.upsert("other", "other")
+    results = memory.search("query", top_n=10)
+    assert sorted((result["chunk"], result["metadata"]) for result in results) == [("new", {"version": 2}), ("other", {})]
+
+
+def test_compaction_reclaims_deleted_chunks(tmp_path):
+    """Compaction removes deleted chunks and their metadata, and document ids keep working after it."""
+    path = str(tmp_path / "memory")
+    memory = Memory(path, embeddings=RandomEmbedder())
+    memory.save([f"text {i}" for i in range(20)], [{"i": i} for i in range(20)], ids=[f"doc {i}" for i in range(20)])
+    memory.delete(["doc 0", "doc 1"])
+    assert len(memory.store) == 20
+    memory.compact()
+    assert len(memory.store) == 18 and len(memory.metadata_memory) == 18
+    memory.delete("doc 2")
+    memory.upsert("doc 3", "text 3 again")
+    memory.close()
+
+    memory = Memory(path, embeddings=RandomEmbedder())
+    assert saved_chunks(memory) == sorted([f"text {i}" for i in range(4, 20)] + ["text 3 again"])
+    assert [result["metadata"] for result in memory.search("query", top_n=10, filter={"i": 5})] == [{"i": 5}]
+    memory.close()
+
+
+def test_deleting_many_documents_compacts_the_memory():
+    """Once more than a quarter of the chunks are deleted, deleting compacts the memory."""
+    memory = Memory(embeddings=RandomEmbedder())
+    ids = memory.save([f"text {i}" for i in range(20)])
+    memory.delete(ids[:5])
+    assert len(memory.store) == 20
+    memory.delete(ids[5])
+    assert len(memory.store) == 14 and memory.deleted_count == 0
+    assert saved_chunks(memory) == sorted(f"text {i}" for i in range(6, 20))
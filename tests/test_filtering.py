@@ -0,0 +1,72 @@
+"""
+Tests of metadata-filtered search.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import numpy as np
+import pytest
+
+from vectordb import Memory
+from vectordb.embedding import BaseEmbedder
+from vectordb.filtering import MetadataIndex
+
+
+class RandomEmbedder(BaseEmbedder):
+    """Embeds every text as a random vector seeded by the text."""
+
+    def embed_text(self, chunks):
+        return [np.random.default_rng(abs(hash(chunk)) % 2**32).normal(size=32).astype(np.float32) for chunk in chunks]
+
+
+@pytest.mark.parametrize("index", ["flat", "hnsw", "ivf", "ivfpq", "sq8"])
+def test_selective_filter_returns_top_n(index):
+    """Approximate indexes return top_n matches for filters matching few chunks."""
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(10000, 32)).astype(np.float32)
+    metadata = [{"tag": "rare" if i % 200 == 0 else "common"} for i in range(len(vectors))]
+    memory = Memory(embeddings=RandomEmbedder(), index=index)
+    memory.save_embeddings([str(i) for i in range(len(vectors))], vectors, metadata)
+
+    queries = rng.normal(size=(20, 32)).astype(np.float32)
+    for results in memory.search_by_vector(queries, 10, filter={"tag": "rare"}):
+        assert len(results) == 10
+        assert all(result["metadata"]["tag"] == "rare" for result in results)
+
+
+def test_in_and_range_conditions_are_combined():
+    """All operators of a condition must hold."""
+    index = MetadataIndex()
+    index.add([{"a": 1}, {"a": 2}, {"a": 15}, {"a": 20}, {"b": 3}])
+    assert index.match({"a": {"$in": [1, 2], "$gte": 10}}).tolist() == [False] * 5
+    assert index.match({"a": {"$in": [1, 15], "$gte": 10}}).tolist() == [False, False, True, False, False]
+    assert index.match({"a": {"$gt": 1, "$lt": 20}}).tolist() == [False, True, True, False, False]
+    assert index.match({"missing": {"$gte": 0}}).tolist() == [False] * 5
+    assert "missing" not in index.numeric
+
+
+def test_metadata_is_indexed_without_the_write_lock(tmp_path, monkeypatch):
+    """The first filtered search, purges and reloads index all metadata while searches can still run."""
+    path = str(tmp_path / "memory")
+    memory = Memory(path, embeddings=RandomEmbedder())
+    ids = memory.save([f"text {i}" for i in range(1000)], [{"group": i % 4} for i in range(1000)])
+    memory.compact()
+    reader = Memory(path, embeddings=RandomEmbedder(), read_only=True)
+    reader.search("text", filter={"group": 1})
+    writers = []
+    add = MetadataIndex.add
+
+    def recording_add(index, metadata):
+        writers.append((len(metadata), memory.lock.writer, reader.lock.writer))
+        add(index, metadata)
+
+    monkeypatch.setattr(MetadataIndex, "add", recording_add)
+    assert len(memory.search("text", top_n=1000, filter={"group": 1})) == 250
+    memory.delete(ids[:300])
+    assert len(memory.search("text", top_n=1000, filter={"group": 1})) == 175
+    assert reader.reload()
+    assert len(reader.search("text", top_n=1000, filter={"group": 1})) == 175
+    assert [count for count, _, _ in writers] == [1000, 700, 700]
+    assert all(writer is None for _, *lock_writers in writers for writer in lock_writers)
+    memory.close()
+    reader.close()
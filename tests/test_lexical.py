@@ -0,0 +1,107 @@
+"""
+Tests of the BM25 index and of keyword and hybrid search.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import numpy as np
+import pytest
+
+from vectordb import Memory
+from vectordb.embedding import BaseEmbedder
+from vectordb.lexical import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+class RandomEmbedder(BaseEmbedder):
+    """Embeds every text as a random vector seeded by the text."""
+
+    def embed_text(self, chunks):
+        return [np.random.default_rng(abs(hash(chunk)) % 2**32).normal(size=16).astype(np.float32) for chunk in chunks]
+
+
+CHUNKS = [
+    "the pump model SKU-42b is out of stock",
+    "the pump is quiet",
+    "a quiet quiet fan",
+    "nothing relevant here",
+    "order SKU-17 today",
+]
+
+
+def test_tokenize_splits_words():
+    """Tokens are lowercase runs of word characters."""
+    assert tokenize("Pump SKU-42b, in stock!") == ["pump", "sku", "42b", "in", "stock"]
+
+
+def test_bm25_ranks_chunks_with_query_terms():
+    """Chunks are ranked by BM25 score, rarer terms weigh more, and chunks without query terms are not returned."""
+    index = BM25Index()
+    index.add(CHUNKS)
+    indices, scores = index.search("42b pump")
+    assert indices.tolist() == [0, 1]
+    assert scores[0] > scores[1] > 0
+    assert index.search("quiet")[0].tolist() == [2, 1]
+    assert index.search("missing")[0].tolist() == []
+    assert index.search("pump", mask=np.array([False, True, True, True, True]))[0].tolist() == [1]
+    assert index.search("pump quiet", k=1)[0].tolist() == [1]
+
+
+def test_bm25_round_trips_and_takes_rows():
+    """An index restored from to_dict, merged or renumbered by take scores chunks like the original."""
+    index = BM25Index()
+    index.add(CHUNKS[:3])
+    columns = index.to_dict()
+    index.add(CHUNKS[3:])
+    expected = index.scores("pump quiet sku")
+
+    restored = BM25Index.from_dict(columns)
+    restored.add(CHUNKS[3:])
+    assert np.allclose(restored.scores("pump quiet sku"), expected)
+    restored.merge()
+    assert not restored.tail
+    assert np.allclose(restored.scores("pump quiet sku"), expected)
+
+    taken = index.take(np.array([1, 2, 4]))
+    assert taken.count == 3
+    assert taken.search("pump")[0].tolist() == [0]
+    assert taken.search("sku")[0].tolist() == [2]
+    # take leaves the original index as it was
+    assert np.allclose(index.scores("pump quiet sku"), expected)
+
+
+def test_reciprocal_rank_fusion_favours_chunks_in_both_rankings():
+    """A chunk ranked by both lists outranks chunks ranked first by only one of them."""
+    indices, scores = reciprocal_rank_fusion([np.array([1, 2, 3]), np.array([4, 2, 5])])
+    assert indices[0] == 2
+    assert set(indices.tolist()) == {1, 2, 3, 4, 5}
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_keyword_and_hybrid_search(tmp_path):
+    """Keyword search finds exact terms that random embeddings miss, hybrid search includes them, and both respect filters and deletes after reopening."""
+    path = str(tmp_path / "memory")
+    memory = Memory(path, embeddings=RandomEmbedder(), bm25=True)
+    texts = [f"filler text number {i}" for i in range(50)] + CHUNKS
+    ids = memory.save(texts, [{"kind": "filler"}] * 50 + [{"kind": "product"}] * len(CHUNKS))
+    memory.compact()
+    memory.close()
+
+    memory = Memory(path, embeddings=RandomEmbedder(), bm25=True)
+    results = memory.search("SKU-42b", top_n=3, mode="keyword")
+    assert results[0]["chunk"] == CHUNKS[0]
+    assert all("score" in result and "distance" not in result for result in results)
+    hybrid = memory.search("SKU-42b", top_n=10, mode="hybrid")
+    assert CHUNKS[0] in [result["chunk"] for result in hybrid]
+    assert [result["chunk"] for result in memory.search("number 7", top_n=5, mode="keyword", filter={"kind": "product"})] == []
+
+    memory.delete(ids[50])
+    assert CHUNKS[0] not in [result["chunk"] for result in memory.search("SKU-42b", top_n=3, mode="keyword")]
+    memory.close()
+
+
+def test_keyword_search_requires_bm25():
+    """Keyword modes raise ValueError on a memory without a BM25 index."""
+    memory = Memory(embeddings=RandomEmbedder())
+    memory.save(CHUNKS)
+    with pytest.raises(ValueError):
+        memory.search("pump", mode="keyword")
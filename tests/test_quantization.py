@@ -0,0 +1,74 @@
+"""
+Tests of compressed embedding storage and exact re-ranking.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import numpy as np
+import pytest
+
+from vectordb import Memory
+from vectordb.embedding import BaseEmbedder
+from vectordb.store import VectorStore
+from vectordb.vector_search import IVFPQIndex, PQIndex
+
+
+class RandomEmbedder(BaseEmbedder):
+    """Embeds every text as a random vector seeded by the text."""
+
+    def embed_text(self, chunks):
+        return [np.random.default_rng(abs(hash(chunk)) % 2**32).normal(size=32).astype(np.float32) for chunk in chunks]
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float16", 1e-2), ("int8", 2e-2)])
+def test_store_decodes_compressed_embeddings(dtype, tolerance):
+    """Compressed stores keep their storage type and return float32 vectors close to the saved ones."""
+    vectors = np.random.default_rng(0).normal(size=(100, 32)).astype(np.float32)
+    store = VectorStore(dtype)
+    store.append([str(i) for i in range(100)], vectors, np.arange(100), np.arange(100))
+    assert store.embeddings.data.dtype == np.dtype(dtype)
+    decoded = store.vectors()
+    assert decoded.dtype == np.float32
+    assert np.max(np.abs(decoded - vectors) / np.abs(vectors).max(axis=1, keepdims=True)) < tolerance
+    assert np.allclose(store.vectors(np.array([5, 7])), decoded[[5, 7]])
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8", "pq"])
+def test_quantized_memory_finds_saved_vectors(tmp_path, quantization):
+    """A quantized memory, with a trained index, returns a saved vector as the nearest to itself, also after reopening it."""
+    vectors = np.random.default_rng(0).normal(size=(3000, 32)).astype(np.float32)
+    path = str(tmp_path / "memory")
+    # a small IVF-PQ index in place of the default one, so it is trained on fewer vectors
+    index = IVFPQIndex(nlist=16, m=8, nbits=6) if quantization == "pq" else "auto"
+    memory = Memory(path, embeddings=RandomEmbedder(), index=index, quantization=quantization, rerank=4)
+    memory.save_embeddings([str(i) for i in range(len(vectors))], vectors)
+    memory.compact()
+    memory.close()
+
+    memory = Memory(path, embeddings=RandomEmbedder(), index=index, quantization=quantization, rerank=4)
+    assert memory.store.dtype == ("float16" if quantization == "float16" else "int8")
+    for results, i in zip(memory.search_by_vector(vectors[:50], top_n=3), range(50)):
+        assert results[0]["chunk"] == str(i)
+    memory.close()
+
+
+def test_rerank_orders_candidates_by_exact_distance():
+    """Re-ranked results are ordered by their exact distance to the stored vectors, with better recall than the trained PQ index alone."""
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(3000, 32)).astype(np.float32)
+    queries = rng.normal(size=(50, 32)).astype(np.float32)
+    truth = np.argsort(((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2), axis=1)[:, :10]
+
+    recalls = {}
+    for rerank in (None, 10):
+        memory = Memory(embeddings=RandomEmbedder(), index=PQIndex(m=8, nbits=6), rerank=rerank)
+        memory.save_embeddings([str(i) for i in range(len(vectors))], vectors)
+        results = memory.search_by_vector(queries, top_n=10)
+        found = [[int(result["chunk"]) for result in row] for row in results]
+        recalls[rerank] = np.mean([len(set(row) & set(expected)) / 10 for row, expected in zip(found, truth.tolist())])
+        if rerank:
+            for row, query in zip(found, queries):
+                distances = ((vectors[row] - query) ** 2).sum(axis=1)
+                assert np.all(np.diff(distances) >= -1e-4)
+    assert recalls[10] > recalls[None]
+    assert recalls[10] >= 0.9
@@ -0,0 +1,33 @@
+"""
+Tests of Memory searches.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import numpy as np
+import pytest
+
+from vectordb import Memory
+from vectordb.embedding import BaseEmbedder
+
+
+class TextEmbedder(BaseEmbedder):
+    """Embeds the chunks "<text>#<n>" of a text close to a random vector seeded by the text."""
+
+    def embed_text(self, chunks):
+        return [
+            np.random.default_rng(abs(hash(chunk.split("#")[0])) % 2**32).normal(size=8)
+            + 0.01 * np.random.default_rng(abs(hash(chunk)) % 2**32).normal(size=8)
+            for chunk in chunks
+        ]
+
+
+@pytest.mark.parametrize("batch_results", ["flatten", "diverse"])
+@pytest.mark.parametrize("diversity", [None, 0.5])
+def test_unique_search_of_query_list_returns_top_n_texts(batch_results, diversity):
+    """A unique search with a list of queries returns top_n distinct texts when texts have many chunks."""
+    memory = Memory(embeddings=TextEmbedder(), chunking_strategy={"mode": "paragraph"})
+    memory.save(["\n\n".join(f"text {i}#{j}" for j in range(6)) for i in range(100)])
+    results = memory.search(["text 1", "text 2"], top_n=10, unique=True, batch_results=batch_results, diversity=diversity)
+    assert len(results) == 10
+    assert len({result["chunk"].split("#")[0] for result in results}) == 10
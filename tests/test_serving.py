@@ -0,0 +1,72 @@
+"""
+Tests of the asyncio front end.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import asyncio
+import threading
+
+import numpy as np
+
+from vectordb import Memory
+from vectordb.embedding import BaseEmbedder
+from vectordb.serving import AsyncMemory
+
+
+class RandomEmbedder(BaseEmbedder):
+    """Embeds every text as a random vector seeded by the text."""
+
+    def embed_text(self, chunks):
+        return [np.random.default_rng(abs(hash(chunk)) % 2**32).normal(size=8).astype(np.float32) for chunk in chunks]
+
+
+def test_invalid_request_fails_alone():
+    """A request with an invalid filter does not fail the requests batched with it."""
+    memory = Memory(embeddings=RandomEmbedder(), index="flat")
+    memory.save([f"text {i}" for i in range(50)], [{"a": i} for i in range(50)])
+
+    async def search_all():
+        async_memory = AsyncMemory(memory)
+        return await asyncio.gather(
+            async_memory.search("first", 3),
+            async_memory.search("second", 3, filter={"a": {"$bogus": 1}}),
+            async_memory.search("third", 3, filter={"a": {"$gte": 10}}),
+            return_exceptions=True,
+        )
+
+    first, second, third = asyncio.run(search_all())
+    assert len(first) == 3
+    assert isinstance(second, ValueError)
+    assert len(third) == 3 and all(result["metadata"]["a"] >= 10 for result in third)
+
+
+def test_searches_are_not_queued_behind_saves():
+    """Searches are answered while a save is still embedding its texts."""
+    embedding = threading.Event()
+    release = threading.Event()
+
+    class SlowEmbedder(RandomEmbedder):
+        """Blocks on texts starting with "slow" until released."""
+
+        def embed_text(self, chunks):
+            if chunks[0].startswith("slow"):
+                embedding.set()
+                release.wait(10)
+            return super().embed_text(chunks)
+
+    memory = Memory(embeddings=SlowEmbedder(), index="flat")
+    memory.save([f"text {i}" for i in range(50)])
+
+    async def save_and_search():
+        async_memory = AsyncMemory(memory)
+        save = asyncio.ensure_future(async_memory.save("slow text"))
+        await asyncio.get_running_loop().run_in_executor(None, embedding.wait, 10)
+        results = await asyncio.wait_for(async_memory.search("query", 3), 5)
+        assert not save.done()
+        release.set()
+        await save
+        return results
+
+    assert len(asyncio.run(save_and_search())) == 3
+    assert len(memory.search("slow text", top_n=100)) == 51
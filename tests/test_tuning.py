@@ -0,0 +1,52 @@
+"""
+Tests of index tuning and of the rebuilds that train or tune an index.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import numpy as np
+import pytest
+
+from vectordb import Memory
+from vectordb.tuning import TunedIndex
+from vectordb.vector_search import MRPTIndex
+
+
+def test_tuned_index_is_tuned_again_when_it_grows():
+    """A tuned index is tuned again once it holds four times the vectors it was tuned on."""
+    rng = np.random.default_rng(0)
+    index = TunedIndex(["ivf"], 0.9, min_size=1000)
+    index.add(rng.normal(size=(1000, 16)).astype(np.float32))
+    assert index.config["size"] == 1000
+    assert not index.rebuild_due(3999) and index.rebuild_due(4000)
+    index.add(rng.normal(size=(3000, 16)).astype(np.float32))
+    assert index.config["size"] == 4000
+    assert len(index) == 4000
+
+
+def test_training_rebuilds_the_index():
+    """Chunks that would train the index are indexed in a new, trained index."""
+    rng = np.random.default_rng(0)
+    memory = Memory(index="ivf")
+    memory.save_embeddings([f"chunk {i}" for i in range(1000)], rng.normal(size=(1000, 16)))
+    memory.search_by_vector(rng.normal(size=16))
+    untrained = memory.index
+    assert not untrained.trained
+    memory.save_embeddings([f"chunk {i}" for i in range(1000, 5000)], rng.normal(size=(4000, 16)))
+    assert len(memory.search_by_vector(rng.normal(size=16), top_n=10)) == 10
+    assert memory.index is not untrained and memory.index.trained
+    assert len(memory.index) == memory.indexed_count == 5000
+
+
+def test_autotuned_mrpt_index_is_built_once_for_any_k():
+    """Searches for different numbers of neighbours reuse the autotuned MRPT index."""
+    pytest.importorskip("mrpt")
+    rng = np.random.default_rng(0)
+    index = MRPTIndex(target_recall=0.9, k=50)
+    index.add(rng.normal(size=(2000, 16)).astype(np.float32))
+    index.search(rng.normal(size=(1, 16)).astype(np.float32), 10)
+    built = index.index
+    for k in (5, 20, 50, 80):
+        indices, _ = index.search(rng.normal(size=(3, 16)).astype(np.float32), k)
+        assert indices.shape == (3, k)
+        assert index.index is built
@@ -0,0 +1,88 @@
+"""
+Tests of the write-ahead log and of recovering memory directories from it.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import glob
+import os
+
+import numpy as np
+
+from vectordb import Memory
+from vectordb.embedding import BaseEmbedder
+from vectordb.wal import HEADER, WriteAheadLog
+
+
+class RandomEmbedder(BaseEmbedder):
+    """Embeds every text as a random vector seeded by the text."""
+
+    def embed_text(self, chunks):
+        return [np.random.default_rng(abs(hash(chunk)) % 2**32).normal(size=8).astype(np.float32) for chunk in chunks]
+
+
+def saved_chunks(memory):
+    """Returns the chunks a search over the whole memory finds."""
+    return sorted(result["chunk"] for result in memory.search("query", top_n=1000))
+
+
+def test_replay_cuts_off_a_torn_tail(tmp_path):
+    """Records after the last intact one are dropped and truncated, and appends continue after it."""
+    path = str(tmp_path / "wal.log")
+    log = WriteAheadLog(path, fsync="always")
+    for i in range(3):
+        log.append({"op": "save", "i": i})
+    log.close()
+    intact = os.path.getsize(path)
+    with open(path, "ab") as file_handler:
+        file_handler.write(HEADER.pack(100, 0) + b"torn")
+
+    log = WriteAheadLog(path)
+    assert [record["i"] for record in log.replay()] == [0, 1, 2]
+    assert os.path.getsize(path) == intact
+    log.append({"op": "save", "i": 3})
+    log.close()
+    assert [record["i"] for record in WriteAheadLog(path).replay()] == [0, 1, 2, 3]
+
+
+def test_replay_drops_a_corrupt_record(tmp_path):
+    """A record whose checksum does not match ends the replay."""
+    path = str(tmp_path / "wal.log")
+    log = WriteAheadLog(path)
+    for i in range(3):
+        log.append({"op": "save", "i": i})
+    log.close()
+    with open(path, "r+b") as file_handler:
+        file_handler.seek(-1, os.SEEK_END)
+        last = file_handler.read(1)
+        file_handler.seek(-1, os.SEEK_END)
+        file_handler.write(bytes([last[0] ^ 0xFF]))
+    assert [record["i"] for record in WriteAheadLog(path).replay()] == [0, 1]
+
+
+def test_memory_directory_replays_logged_updates(tmp_path):
+    """Saves and deletes logged since the last snapshot are applied when the directory is reopened, also after a crash tore the log."""
+    path = str(tmp_path / "memory")
+    memory = Memory(path, embeddings=RandomEmbedder())
+    memory.save([f"text {i}" for i in range(10)])
+    memory.compact()
+    memory.save(["text 10", "text 11"])
+    memory.delete(3)
+    memory.close()
+    (log_path,) = glob.glob(os.path.join(path, "wal-*.log"))
+    assert os.path.getsize(log_path) > 0
+
+    expected = sorted(f"text {i}" for i in range(12) if i != 3)
+    memory = Memory(path, embeddings=RandomEmbedder())
+    assert saved_chunks(memory) == expected
+    memory.close()
+
+    with open(log_path, "ab") as file_handler:
+        file_handler.write(HEADER.pack(1 << 20, 0) + b"partial record")
+    memory = Memory(path, embeddings=RandomEmbedder())
+    assert saved_chunks(memory) == expected
+    memory.save(["text 12"])
+    memory.close()
+    memory = Memory(path, embeddings=RandomEmbedder())
+    assert saved_chunks(memory) == sorted(expected + ["text 12"])
+    memory.close()
@@ -1,3 +1,4 @@
 # pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
 
 from .memory import Memory
+from .serving import AsyncMemory
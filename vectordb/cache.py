@@ -0,0 +1,159 @@
+"""
+This module provides the CachedEmbedder class, which caches embeddings by model and chunk text.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+from collections import OrderedDict
+from typing import Dict, List
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from .embedding import BaseEmbedder
+from .metrics import Metrics
+
+
+class CachedEmbedder(BaseEmbedder):
+    """
+    Wraps an embedder with an in-memory LRU cache and an optional on-disk content-addressed store,
+    so repeated chunks and queries skip the model entirely.
+    """
+
+    def __init__(
+        self,
+        embedder: BaseEmbedder,
+        max_size: int = 100000,
+        cache_dir: str = None,
+        model_name: str = None,
+        metrics: Metrics = None,
+    ):
+        """
+        Initializes the cache.
+
+        :param embedder: the BaseEmbedder used for chunks that are not cached.
+        :param max_size: the maximum number of embeddings kept in memory. (default: 100000)
+        :param cache_dir: a directory in which embeddings are also stored on disk. (default: None)
+        :param model_name: the name used in cache keys (default: the embedder's model_name, or its class name).
+        :param metrics: a Metrics instance counting embedding_cache_hits and embedding_cache_misses. (default: None)
+        """
+        self.embedder = embedder
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.model_name = model_name or getattr(embedder, "model_name", type(embedder).__name__)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def key(self, chunk: str) -> str:
+        """
+        Returns the content address of a chunk embedded with this model.
+
+        :param chunk: the chunk text.
+        :return: a hex digest of the model name and the chunk text.
+        """
+        return hashlib.sha256(f"{self.model_name}\0{chunk}".encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        """Returns the path of the on-disk entry for a key."""
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def get(self, key: str) -> np.ndarray:
+        """
+        Looks up an embedding in memory, then on disk.
+
+        :param key: a key produced by key().
+        :return: the cached embedding, or None.
+        """
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+
+        if self.cache_dir is not None and os.path.exists(self.path(key)):
+            embedding = np.load(self.path(key))
+            self.put(key, embedding, persist=False)
+            with self.lock:
+                self.disk_hits += 1
+            return embedding
+        return None
+
+    def put(self, key: str, embedding: np.ndarray, persist: bool = True):
+        """
+        Adds an embedding to the cache.
+
+        :param key: a key produced by key().
+        :param embedding: the embedding.
+        :param persist: whether to also write the embedding to the on-disk store.
+        """
+        with self.lock:
+            self.entries[key] = embedding
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        if persist and self.cache_dir is not None:
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file_handler:
+                np.save(file_handler, embedding)
+            os.replace(tmp_path, path)
+
+    def embed_text(self, chunks: List[str]) -> List[List[float]]:
+        """
+        Converts a list of text chunks into their corresponding embeddings, embedding only the
+        chunks that are not cached.
+
+        :param chunks: a list of strings containing the text chunks to be embedded.
+        :return: a list of embeddings, where each embedding is represented as a list of floats.
+        """
+        keys = [self.key(chunk) for chunk in chunks]
+        embeddings = [self.get(key) for key in keys]
+
+        # embed every distinct missing chunk once
+        missing = {}
+        for chunk, key, embedding in zip(chunks, keys, embeddings):
+            if embedding is None and key not in missing:
+                missing[key] = chunk
+        self.metrics.increment("embedding_cache_hits", len(chunks) - len(missing))
+        if missing:
+            self.metrics.increment("embedding_cache_misses", len(missing))
+            with self.lock:
+                self.misses += len(missing)
+            computed = np.array(self.embedder.embed_text(list(missing.values())), dtype=np.float32)
+            for key, embedding in zip(missing, computed):
+                self.put(key, embedding)
+            computed = dict(zip(missing, computed))
+            embeddings = [computed[key] if embedding is None else embedding for key, embedding in zip(keys, embeddings)]
+
+        return np.array(embeddings, dtype=np.float32).reshape(len(chunks), -1).tolist()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the cache counters.
+
+        :return: a dictionary with the number of memory hits, disk hits, misses and cached entries.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self.entries),
+            }
+
+    def clear(self):
+        """
+        Empties the in-memory cache and resets the counters. The on-disk store is kept.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
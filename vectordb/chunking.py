@@ -1,7 +1,13 @@
 # pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
 
-from typing import List
-import re
+from typing import Any, List, Tuple
+
+import numpy as np
+
+
+# a sentence ends with one of these characters, optionally followed by a closing character, then a space
+SENTENCE_END = np.array([ord(char) for char in ".!?"], dtype=np.uint32)
+SENTENCE_CLOSE = np.array([ord(char) for char in "\"')]\u201d\u2019"], dtype=np.uint32)
 
 
 class Chunker:
@@ -13,15 +19,23 @@ class Chunker:
         """
         Initializes the Chunker with a specified strategy.
 
-        :param strategy: a dictionary containing the chunking mode (paragraph or sliding_window)
-                         and optional window_size and overlap values for sliding_window mode.
+        :param strategy: a dictionary containing the chunking mode (paragraph, sliding_window or tokens)
+                         and optional window_size and overlap values for sliding_window and tokens modes.
+                         The tokens mode also takes a tokenizer (a Hugging Face tokenizer or model
+                         name, default: words) and sentences (whether windows end at sentence
+                         boundaries, default: True).
         """
         self.strategy = strategy["mode"]
-        if self.strategy not in {"paragraph", "sliding_window"}:
+        if self.strategy not in {"paragraph", "sliding_window", "tokens"}:
             raise ValueError(f"Invalid chunking strategy: {self.strategy}")
 
-        self.window_size = strategy.get("window_size", 240)
+        self.tokenizer = strategy.get("tokenizer")
+        self.sentences = strategy.get("sentences", True)
+        self.loaded_tokenizer = None
+        self.window_size = strategy.get("window_size", None if self.strategy == "tokens" else 240)
         self.overlap = strategy.get("overlap", 8)
+        if self.strategy == "tokens" and self.window_size is not None and not 0 <= self.overlap < self.window_size:
+            raise ValueError("Overlap must be smaller than the window size")
 
     @staticmethod
     def clean_text(text: str) -> str:
@@ -31,17 +45,117 @@ class Chunker:
         :param text: a string containing the text to be cleaned.
         :return: a cleaned version of the input text.
         """
-        # Remove extra whitespaces
-        text = re.sub(r"\s+", " ", text).strip()
-
-        return text
+        # Remove extra whitespaces (str.split splits on the same characters as the \s regex class, faster)
+        return " ".join(text.split())
 
     def __call__(self, text: str) -> List[str]:
         if self.strategy == "paragraph":
             return self.paragraph_chunking(text)
+        if self.strategy == "tokens":
+            return self.token_chunking(text)
 
         return self.sliding_window_chunking(text)
 
+    def __getstate__(self):
+        # a tokenizer given by name is loaded again by every chunking process
+        state = dict(self.__dict__)
+        if isinstance(self.tokenizer, str):
+            state["loaded_tokenizer"] = None
+        return state
+
+    def get_tokenizer(self) -> Any:
+        """
+        Returns the tokenizer of the tokens mode, loading it by name on first use, or None for words.
+        """
+        if isinstance(self.tokenizer, str):
+            if self.loaded_tokenizer is None:
+                from transformers import AutoTokenizer  # pylint: disable = import-outside-toplevel
+
+                self.loaded_tokenizer = AutoTokenizer.from_pretrained(self.tokenizer)
+            return self.loaded_tokenizer
+        return self.tokenizer
+
+    def default_window_size(self) -> int:
+        """
+        Returns the longest window the tokenizer's model embeds without truncation: its maximum
+        length less the special tokens it adds. Windows are 240 words without a tokenizer.
+        """
+        tokenizer = self.get_tokenizer()
+        max_length = getattr(tokenizer, "model_max_length", None)
+        if tokenizer is None or max_length is None or max_length > 100000:  # unset limits are huge sentinels
+            return 240
+        return max_length - tokenizer.num_special_tokens_to_add()
+
+    def token_offsets(self, text: str, spaces: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the start and end character offsets of every token of a cleaned text.
+
+        :param text: a text whose whitespace has been collapsed by clean_text.
+        :param spaces: the character offsets of the spaces in the text.
+        :return: a tuple (starts, ends) of int64 arrays.
+        """
+        tokenizer = self.get_tokenizer()
+        if tokenizer is None:
+            # words are separated by single spaces
+            return np.r_[0, spaces + 1].astype(np.int64), np.r_[spaces, len(text)].astype(np.int64)
+        offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)["offset_mapping"]
+        offsets = np.array(offsets, dtype=np.int64).reshape(-1, 2)
+        # tokens without a span of their own (e.g. some byte-level pieces) are dropped
+        offsets = offsets[offsets[:, 1] > offsets[:, 0]]
+        return offsets[:, 0], offsets[:, 1]
+
+    def token_chunking(self, text: str) -> List[str]:
+        """
+        Splits the input text into windows of at most window_size tokens, consecutive windows
+        sharing up to overlap tokens. With sentences, windows end at the last sentence boundary
+        that fits and the overlap is made of whole sentences; sentences longer than a window are
+        split. Windows are cut from the text by character offsets.
+
+        :param text: a string containing the text to be chunked.
+        :return: a list of chunks generated from the input text.
+        """
+        if self.window_size is None:
+            # the tokenizer is only loaded once there is text to chunk
+            self.window_size = self.default_window_size()
+        text = self.clean_text(text)
+        if not text:
+            return []
+        # one code point per element, so array positions are string offsets
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        spaces = np.flatnonzero(codes == ord(" "))
+        starts, ends = self.token_offsets(text, spaces)
+        if len(starts) <= self.window_size:
+            return [text]
+
+        # token positions at which sentences start
+        boundaries = np.zeros(0, dtype=np.int64)
+        if self.sentences and len(spaces):
+            before = codes[spaces - 1]
+            closed = np.isin(before, SENTENCE_CLOSE) & np.isin(codes[np.maximum(spaces - 2, 0)], SENTENCE_END)
+            sentence_starts = spaces[np.isin(before, SENTENCE_END) | closed] + 1
+            boundaries = np.searchsorted(starts, sentence_starts)
+            if len(boundaries):
+                boundaries = boundaries[np.r_[True, boundaries[1:] != boundaries[:-1]]]
+
+        chunks, start, count = [], 0, len(starts)
+        while True:
+            end = min(start + self.window_size, count)
+            if end < count and len(boundaries):
+                # the last sentence start inside the window, if it leaves the window non-empty
+                last = boundaries[np.searchsorted(boundaries, end, side="right") - 1] if boundaries[0] <= end else start
+                if last > start:
+                    end = int(last)
+            chunks.append(text[starts[start] : ends[end - 1]])
+            if end >= count:
+                return chunks
+            next_start = end - self.overlap
+            if len(boundaries):
+                # overlap by the sentences that start within the last overlap tokens, if any
+                first = np.searchsorted(boundaries, max(next_start, start + 1))
+                if first < len(boundaries) and boundaries[first] <= end:
+                    next_start = int(boundaries[first])
+            start = max(next_start, start + 1)
+
     def paragraph_chunking(self, text: str) -> List[str]:
         """
         Splits the input text into paragraphs.
@@ -0,0 +1,24 @@
+"""
+This module converts a legacy pickle memory file into the memory-mapped directory format:
+
+    python -m vectordb.convert memory.pkl memory_dir
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+import sys
+
+from .storage import convert_pickle
+
+
+def main():
+    """
+    Converts the pickle file given as the first argument into the directory given as the second.
+    """
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python -m vectordb.convert <memory.pkl> <memory_dir>")
+    convert_pickle(sys.argv[1], sys.argv[2])
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,11 @@ This module provides classes for generating text embeddings using various pre-tr
 
 from abc import ABC, abstractmethod
 from typing import List
+import logging
+import threading
 
-import tensorflow_hub as hub
-from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
 
 
 class BaseEmbedder(ABC):
@@ -23,36 +25,71 @@ class Embedder(BaseEmbedder):
     """
     This class provides a way to generate embeddings for given text chunks using a specified
     pre-trained model.
+
+    The model, and the framework it runs on, is loaded on the first call to embed_text (or load),
+    so creating an Embedder is cheap.
     """
 
-    def __init__(self, model_name: str = "normal"):
+    def __init__(self, model_name: str = "normal", num_threads: int = None):
         """
         Initializes the Embedder with a specified model.
 
         :param model_name: a string containing the name of the pre-trained model to be used
         for embeddings.
+        :param num_threads: the number of CPU threads used by the model (default: the framework default).
         """
-        self.sbert = True
-        print("Initiliazing embeddings: ", model_name)
-        if model_name == "fast":
-            self.model = hub.load(
-                "https://tfhub.dev/google/universal-sentence-encoder/4"
-            )
-            self.sbert = False
-        elif model_name == "multilingual":
-            self.model = hub.load("universal-sentence-encoder-multilingual-large/3")
-            self.sbert = False
-        else:
-            # if model_name == "normal":
-            #    model_name = "sentence-transformers/all-MiniLM-L6-v2"
-            if model_name == "normal":
-                model_name = "BAAI/bge-small-en-v1.5"
-            elif model_name == "best":
-                model_name = "BAAI/bge-base-en-v1.5"
+        self.sbert = model_name not in ("fast", "multilingual")
+        # if model_name == "normal":
+        #    model_name = "sentence-transformers/all-MiniLM-L6-v2"
+        if model_name == "normal":
+            model_name = "BAAI/bge-small-en-v1.5"
+        elif model_name == "best":
+            model_name = "BAAI/bge-base-en-v1.5"
+        self.model_name = model_name
+        self.num_threads = num_threads
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the model, if it has not been loaded yet.
+        """
+        with self.lock:
+            if self.model is not None:
+                return
+            logger.info("Loading embedding model %s", self.model_name)
+            # pylint: disable = import-outside-toplevel
+            # thread counts are set before loading, as TensorFlow rejects them once its runtime is initialized
+            if self.num_threads is not None:
+                if self.sbert:
+                    import torch
+
+                    torch.set_num_threads(self.num_threads)
+                else:
+                    import tensorflow as tf
+
+                    try:
+                        tf.config.threading.set_intra_op_parallelism_threads(self.num_threads)
+                    except RuntimeError:
+                        logger.warning("TensorFlow is already initialized, num_threads=%s is ignored", self.num_threads)
+
+            if self.model_name == "fast":
+                import tensorflow_hub as hub
+
+                model = hub.load(
+                    "https://tfhub.dev/google/universal-sentence-encoder/4"
+                )
+            elif self.model_name == "multilingual":
+                import tensorflow_hub as hub
+
+                model = hub.load("universal-sentence-encoder-multilingual-large/3")
+            else:
+                from sentence_transformers import SentenceTransformer
 
-            self.model = SentenceTransformer(model_name)
+                model = SentenceTransformer(self.model_name)
 
-        print("OK.")
+            self.model = model
+            logger.info("Loaded embedding model %s", self.model_name)
 
     def embed_text(self, chunks: List[str]) -> List[List[float]]:
         """
@@ -61,6 +98,8 @@ class Embedder(BaseEmbedder):
         :param chunks: a list of strings containing the text chunks to be embedded.
         :return: a list of embeddings, where each embedding is represented as a list of floats.
         """
+        if self.model is None:
+            self.load()
         if self.sbert:
             embeddings = self.model.encode(chunks).tolist()
         else:
@@ -0,0 +1,149 @@
+"""
+This module provides the MetadataIndex class, an inverted index over metadata used to restrict
+searches to chunks whose metadata matches a filter.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+from collections import defaultdict
+from numbers import Number
+from typing import Any, Dict, List
+
+import numpy as np
+
+from .store import GrowableArray
+
+
+RANGE_OPERATORS = {
+    "$gt": np.greater,
+    "$gte": np.greater_equal,
+    "$lt": np.less,
+    "$lte": np.less_equal,
+}
+
+
+def check_filter(metadata_filter: Any):
+    """
+    Raises ValueError unless metadata_filter is None or a valid filter (see MetadataIndex).
+    """
+    if metadata_filter is None:
+        return
+    if not isinstance(metadata_filter, dict):
+        raise ValueError(f"A filter must be a dictionary, got {metadata_filter!r}")
+    for condition in metadata_filter.values():
+        if not isinstance(condition, dict):
+            continue
+        for op, value in condition.items():
+            if op == "$in":
+                if not isinstance(value, (list, tuple, set, frozenset)):
+                    raise ValueError(f"$in takes a list of values, got {value!r}")
+            elif op not in RANGE_OPERATORS:
+                raise ValueError(f"Invalid filter operator: {op}")
+            elif not MetadataIndex.is_numeric(value):
+                raise ValueError(f"{op} takes a number, got {value!r}")
+
+
+class MetadataIndex:
+    """
+    An inverted index from metadata keys and values to metadata entries.
+
+    Filters are dictionaries whose conditions must all hold:
+
+        {"source": "docs"}                       equality (or membership, for list values)
+        {"lang": ["en", "de"]}                   any of the listed values
+        {"year": {"$gte": 2020, "$lt": 2023}}    numeric range ($gt, $gte, $lt, $lte)
+        {"lang": {"$in": ["en", "de"]}}          any of the listed values
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Removes all entries."""
+        self.postings = defaultdict(lambda: defaultdict(list))
+        self.numeric = defaultdict(lambda: (GrowableArray(np.float64, ()), GrowableArray(np.int64, ())))
+        self.count = 0
+
+    @staticmethod
+    def is_numeric(value: Any) -> bool:
+        """Returns True for numbers that support range queries (booleans excluded)."""
+        return isinstance(value, Number) and not isinstance(value, bool)
+
+    def add(self, metadata: List[dict]):
+        """
+        Indexes metadata entries, numbered after the entries added so far.
+
+        :param metadata: a list of metadata dictionaries.
+        """
+        numeric = defaultdict(lambda: ([], []))
+        for entry_id, entry in enumerate(metadata, self.count):
+            for key, value in (entry or {}).items():
+                values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+                for item in values:
+                    try:
+                        self.postings[key][item].append(entry_id)
+                    except TypeError:  # unhashable values are not indexed
+                        continue
+                    if self.is_numeric(item):
+                        numeric[key][0].append(item)
+                        numeric[key][1].append(entry_id)
+        for key, (values, ids) in numeric.items():
+            self.numeric[key][0].append(np.array(values, dtype=np.float64))
+            self.numeric[key][1].append(np.array(ids, dtype=np.int64))
+        self.count += len(metadata)
+
+    def sync(self, metadata: List[dict]):
+        """
+        Indexes the entries of a metadata list that were appended since the last call.
+
+        :param metadata: the full list of metadata entries.
+        """
+        if self.count < len(metadata):
+            self.add(metadata[self.count :])
+
+    def match_condition(self, key: str, condition: Any) -> np.ndarray:
+        """
+        Returns the boolean mask of entries matching a single key condition.
+        """
+        mask = np.zeros(self.count, dtype=bool)
+        if isinstance(condition, dict):
+            ranges = {op: value for op, value in condition.items() if op != "$in"}
+            if not condition:
+                return mask
+            # every operator must hold
+            if "$in" in condition:
+                mask = self.match_condition(key, list(condition["$in"]))
+            else:
+                mask[:] = True
+            if ranges:
+                in_range = np.zeros(self.count, dtype=bool)
+                # get, as searches only hold the read lock and must not add keys
+                numeric = self.numeric.get(key)
+                if numeric is not None:
+                    values, ids = numeric[0].data, numeric[1].data
+                    selected = np.ones(len(values), dtype=bool)
+                    for op, value in ranges.items():
+                        selected &= RANGE_OPERATORS[op](values, value)
+                    in_range[ids[selected]] = True
+                mask &= in_range
+            return mask
+
+        postings = self.postings.get(key, {})
+        for value in condition if isinstance(condition, (list, tuple, set, frozenset)) else [condition]:
+            ids = postings.get(value)
+            if ids:
+                mask[ids] = True
+        return mask
+
+    def match(self, metadata_filter: Dict[str, Any]) -> np.ndarray:
+        """
+        Returns the boolean mask of metadata entries matching a filter.
+
+        :param metadata_filter: a filter dictionary (see the class docstring).
+        :return: a boolean array with one entry per indexed metadata entry.
+        """
+        check_filter(metadata_filter)
+        mask = np.ones(self.count, dtype=bool)
+        for key, condition in metadata_filter.items():
+            mask &= self.match_condition(key, condition)
+        return mask
@@ -0,0 +1,225 @@
+"""
+This module provides the BM25Index class, an inverted index over chunk text used for keyword and
+hybrid search, and reciprocal rank fusion of ranked result lists.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Tuple
+import re
+
+import numpy as np
+
+from .store import GrowableArray
+
+
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into lowercase word tokens, so "SKU-42b" yields "sku" and "42b".
+    """
+    return TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    A BM25 inverted index over chunks, numbered in the order they are added.
+
+    Postings loaded from a snapshot are kept in compressed sparse row arrays (one slice of
+    document ids and term frequencies per term, which may be memory-mapped); postings added since
+    are appended to small per-term arrays, and both are merged by merge.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """
+        :param k1: the term frequency saturation parameter. (default: 1.2)
+        :param b: the document length normalization parameter. (default: 0.75)
+        """
+        self.k1 = k1
+        self.b = b
+        self.clear()
+
+    @property
+    def count(self) -> int:
+        """The number of indexed chunks."""
+        return len(self.lengths.data)
+
+    def clear(self):
+        """Removes all chunks."""
+        self.vocabulary = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.docs = np.zeros(0, dtype=np.int64)
+        self.tfs = np.zeros(0, dtype=np.int32)
+        self.tail = defaultdict(lambda: (GrowableArray(np.int64, (), 8), GrowableArray(np.int32, (), 8)))
+        self.lengths = GrowableArray(np.int32, ())
+        self.total_length = 0
+
+    def add(self, chunks: List[str]):
+        """
+        Indexes chunks, numbered after the chunks added so far.
+
+        :param chunks: a list of chunk strings.
+        """
+        term_ids, docs, tfs, lengths = [], [], [], []
+        for doc, chunk in enumerate(chunks, self.count):
+            counts = Counter(tokenize(chunk))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                docs.append(doc)
+                tfs.append(tf)
+        self.lengths.append(np.array(lengths, dtype=np.int32))
+        self.total_length += sum(lengths)
+        if not term_ids:
+            return
+
+        # group the new postings by term, keeping document order within every term
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, docs, tfs = term_ids[order], np.array(docs, dtype=np.int64)[order], np.array(tfs, dtype=np.int32)[order]
+        starts = np.flatnonzero(np.r_[True, term_ids[1:] != term_ids[:-1]])
+        for term_id, start, end in zip(term_ids[starts].tolist(), starts.tolist(), np.r_[starts[1:], len(term_ids)].tolist()):
+            tail_docs, tail_tfs = self.tail[term_id]
+            tail_docs.append(docs[start:end])
+            tail_tfs.append(tfs[start:end])
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the ascending document ids of a term and the term frequency in each.
+        """
+        docs, tfs = self.docs[0:0], self.tfs[0:0]
+        if term_id + 1 < len(self.offsets):
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, tfs = self.docs[start:end], self.tfs[start:end]
+        if term_id in self.tail:
+            tail_docs, tail_tfs = self.tail[term_id]
+            docs, tfs = np.concatenate([docs, tail_docs.data]), np.concatenate([tfs, tail_tfs.data])
+        return docs, tfs
+
+    def scores(self, query: str, count: int = None) -> np.ndarray:
+        """
+        Returns the BM25 score of the first count chunks for a query.
+
+        :param query: the query text.
+        :param count: the number of chunks scored. (default: all indexed chunks)
+        """
+        count = self.count if count is None else min(count, self.count)
+        scores = np.zeros(count, dtype=np.float32)
+        if count == 0:
+            return scores
+        lengths = self.lengths.data[:count]
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(self.total_length / self.count, 1e-9))
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            docs, tfs = self.postings(term_id)
+            end = np.searchsorted(docs, count)
+            docs, tfs = docs[:end], tfs[:end]
+            idf = np.log(1 + (self.count - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+        return scores
+
+    def search(self, query: str, k: int = None, mask: np.ndarray = None, count: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the chunks with the highest BM25 scores for a query. Chunks without any query term
+        are never returned.
+
+        :param query: the query text.
+        :param k: the maximum number of chunks returned. (default: every matching chunk)
+        :param mask: an optional boolean array restricting the search to the chunks marked True.
+        :param count: only the first count chunks are searched. (default: the length of mask, or all chunks)
+        :return: a tuple (indices, scores) of 1D arrays ordered by decreasing score.
+        """
+        if count is None and mask is not None:
+            count = len(mask)
+        scores = self.scores(query, count)
+        if mask is not None:
+            scores[~mask[: len(scores)]] = 0
+        found = np.flatnonzero(scores > 0)
+        if k is not None and k < len(found):
+            found = found[np.argpartition(-scores[found], k - 1)[:k]]
+        found = found[np.argsort(-scores[found], kind="stable")]
+        return found, scores[found]
+
+    def take(self, rows: np.ndarray) -> "BM25Index":
+        """
+        Returns a new index holding the given chunks, renumbered in the given ascending order.
+
+        :param rows: an ascending array of chunk positions.
+        """
+        columns = self.to_dict()
+        renumber = np.full(self.count, -1, dtype=np.int64)
+        renumber[rows] = np.arange(len(rows))
+        terms = np.repeat(np.arange(len(columns["terms"])), np.diff(columns["offsets"]))
+        docs = renumber[columns["docs"]]
+        kept = docs != -1
+        terms, docs = terms[kept], docs[kept]
+        index = BM25Index(self.k1, self.b)
+        index.vocabulary = dict(self.vocabulary)
+        index.offsets = np.searchsorted(terms, np.arange(len(columns["terms"]) + 1)).astype(np.int64)
+        index.docs, index.tfs = docs, columns["tfs"][kept]
+        index.lengths = GrowableArray.from_array(np.asarray(columns["lengths"])[rows])
+        index.total_length = int(index.lengths.data.sum())
+        return index
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the index as a dictionary of "terms" (a list) and "offsets", "docs", "tfs" and
+        "lengths" arrays, with the postings added since the last merge merged into new arrays.
+        The index itself is not changed, so searches can run meanwhile.
+        """
+        offsets, docs, tfs = self.offsets, self.docs, self.tfs
+        if self.tail:
+            base_terms = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+            tail_terms = np.concatenate([np.full(len(tail_docs.data), term_id) for term_id, (tail_docs, _) in self.tail.items()])
+            terms = np.concatenate([base_terms, tail_terms])
+            # base postings precede tail postings, so a stable sort keeps documents ascending
+            order = np.argsort(terms, kind="stable")
+            docs = np.concatenate([self.docs] + [tail_docs.data for tail_docs, _ in self.tail.values()])[order]
+            tfs = np.concatenate([self.tfs] + [tail_tfs.data for _, tail_tfs in self.tail.values()])[order]
+            offsets = np.searchsorted(terms[order], np.arange(len(self.vocabulary) + 1)).astype(np.int64)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        return {"terms": terms, "offsets": offsets, "docs": docs, "tfs": tfs, "lengths": self.lengths.data}
+
+    def merge(self) -> Dict[str, Any]:
+        """
+        Merges the postings added since the last merge into the arrays and returns to_dict. This
+        replaces the arrays searches read, so no search may run meanwhile.
+        """
+        columns = self.to_dict()
+        self.offsets, self.docs, self.tfs = columns["offsets"], columns["docs"], columns["tfs"]
+        self.tail.clear()
+        return columns
+
+    @classmethod
+    def from_dict(cls, columns: Dict[str, Any], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        """
+        Builds an index from the dictionary returned by to_dict, without copying its arrays.
+        """
+        index = cls(k1, b)
+        index.vocabulary = {term: term_id for term_id, term in enumerate(columns["terms"])}
+        index.offsets, index.docs, index.tfs = columns["offsets"], columns["docs"], columns["tfs"]
+        index.lengths = GrowableArray.from_array(columns["lengths"])
+        index.total_length = int(np.sum(columns["lengths"], dtype=np.int64))
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuses ranked lists of chunk indices: every chunk scores the sum of 1 / (k + rank) over the
+    lists it appears in, with ranks starting at 1.
+
+    :param rankings: a list of 1D arrays of chunk indices, best first.
+    :param k: the rank offset damping the weight of the top ranks. (default: 60)
+    :return: a tuple (indices, scores) ordered by decreasing fused score.
+    """
+    indices = np.concatenate(rankings).astype(np.int64)
+    weights = np.concatenate([1.0 / (k + np.arange(1, len(ranking) + 1)) for ranking in rankings])
+    fused, inverse = np.unique(indices, return_inverse=True)
+    scores = np.bincount(inverse.ravel(), weights=weights, minlength=len(fused))
+    order = np.argsort(-scores, kind="stable")
+    return fused[order], scores[order].astype(np.float32)
@@ -0,0 +1,66 @@
+"""
+This module provides the ReadWriteLock class used by Memory to let many threads search while
+another thread saves.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+from contextlib import contextmanager
+from typing import Iterator
+import threading
+
+
+class ReadWriteLock:
+    """
+    A lock that is held either by any number of readers or by one writer.
+
+    Waiting writers take precedence over new readers, so a steady stream of searches cannot
+    starve ingestion. The writer may re-acquire the lock, for reading or writing, while it holds
+    it; readers must not nest read sections.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None
+        self.depth = 0
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """Holds the lock for reading for the duration of a with block."""
+        if self.writer == threading.get_ident():
+            yield
+            return
+        with self.condition:
+            while self.writer is not None or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if self.readers == 0:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """Holds the lock exclusively for the duration of a with block."""
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer != me:
+                self.waiting_writers += 1
+                while self.writer is not None or self.readers:
+                    self.condition.wait()
+                self.waiting_writers -= 1
+                self.writer = me
+            self.depth += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.writer = None
+                    self.condition.notify_all()
@@ -3,21 +3,53 @@ This module provides the Memory class that represents a memory storage system
 for text and associated metadata, with functionality for saving, searching, and
 managing memory entries.
 """
-# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals, too-many-lines
 
-from typing import List, Dict, Any, Union
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Tuple, Union
+import copy
+import functools
 import itertools
+import threading
+import time
+
+import numpy as np
 
 from .chunking import Chunker
+from .cache import CachedEmbedder
 from .embedding import BaseEmbedder, Embedder
-from .vector_search import VectorSearch
+from .filtering import MetadataIndex
+from .lexical import BM25Index, reciprocal_rank_fusion
+from .locking import ReadWriteLock
+from .metrics import Metrics
+from .vector_search import BaseIndex, RerankIndex, SegmentedIndex, VectorSearch, create_index
 from .storage import Storage
+from .store import GrowableArray, VectorStore
+from .tuning import TunedIndex, tunable_backends
+
+
+# quantization mode: (embedding storage type, index backend used with index="auto")
+QUANTIZATION = {
+    "float16": ("float16", "fp16"),
+    "int8": ("int8", "sq8"),
+    "pq": ("int8", "ivfpq"),
+}
+
+# deleting documents compacts the memory once this fraction of its chunks is tombstoned
+TOMBSTONE_RATIO = 0.25
 
 
 class Memory:
     """
     Memory class represents a memory storage system for text and associated metadata.
     It provides functionality for saving, searching, and managing memory entries.
+
+    A Memory can be shared between threads. Searches run concurrently under a read lock; saves
+    chunk and embed without holding the lock and only take it exclusively to append the result.
+    Updates are serialized by a separate lock, so they write to disk, and indexes are rebuilt,
+    while searches go on; the read lock is only held exclusively to swap the result in.
     """
 
     def __init__(
@@ -25,53 +57,233 @@ class Memory:
         memory_file: str = None,
         chunking_strategy: dict = None,
         embeddings: Union[BaseEmbedder, str] = "normal",
+        index: Union[BaseIndex, str] = "auto",
+        fsync: str = "batch",
+        embedding_cache: dict = None,
+        quantization: str = None,
+        rerank: int = None,
+        segment_size: int = None,
+        search_workers: int = None,
+        target_recall: float = None,
+        metrics: Metrics = None,
+        bm25: bool = False,
+        read_only: bool = False,
+        save_index: bool = False,
     ):
         """
         Initializes the Memory class.
 
-        :param memory_file: a string containing the path to the memory file. (default: None)
+        :param memory_file: a string containing the path to the memory file, or to a memory directory for the memory-mapped format. Without segment_size, the first save after opening a memory directory copies all embeddings into RAM. (default: None)
         :param chunking_strategy: a dictionary containing the chunking mode (default: {"mode": "sliding_window"}).
         :param embedding_model: a string containing the name of the pre-trained model to be used for embeddings (default: "sentence-transformers/all-MiniLM-L6-v2").
+        :param index: a BaseIndex instance or the name of the index backend: "auto", "flat", "ivf", "hnsw", "mrpt", "fp16", "sq8", "pq" or "ivfpq" (default: "auto").
+        :param fsync: when to fsync the write-ahead log of a memory directory: "always", "batch" or "close" (default: "batch").
+        :param embedding_cache: a dictionary of CachedEmbedder options (max_size, cache_dir) to cache embeddings by chunk text and model (default: None).
+        :param quantization: compresses stored embeddings and, with index="auto", the index: "float16", "int8" or "pq" (default: None).
+        :param rerank: when set, the index fetches rerank * top_n candidates which are re-ranked by exact distance to the stored embeddings (default: None).
+        :param segment_size: when set, embeddings and the index are split into segments of this many chunks, which are searched in parallel; full segments are sealed and memory-mapped, and saves only copy the newest segment into RAM (default: None).
+        :param search_workers: the number of threads searching segments in parallel (default: the number of CPUs).
+        :param target_recall: when set, the index backend ("auto" tries hnsw, ivf and mrpt) and its search parameters are tuned on the stored embeddings for this recall@10, and the fastest configuration reaching it is used and saved with the memory (default: None).
+        :param metrics: a Metrics instance receiving per-stage timings and counters, e.g. a vectordb.metrics.MetricsCollector (default: None, metrics are discarded).
+        :param bm25: whether to maintain a BM25 keyword index over the chunks, saved with the memory, for searches with mode="keyword" or "hybrid" (default: False).
+        :param read_only: whether to serve the latest snapshot of a memory directory without writing to it. The snapshot files, and a saved index, are memory-mapped, so processes opening the same directory share one copy; call reload to switch to a newer snapshot (default: False).
+        :param save_index: whether compaction also writes the vector index into the snapshot of a memory directory, so it is loaded rather than rebuilt when the memory is opened (default: False).
         """
+        if quantization is not None and quantization not in QUANTIZATION:
+            raise ValueError(f"Invalid quantization: {quantization}")
+        dtype = QUANTIZATION[quantization][0] if quantization is not None else "float32"
+        if quantization is not None and index == "auto" and target_recall is None:
+            index = QUANTIZATION[quantization][1]
+        if target_recall is not None and not isinstance(index, str):
+            raise TypeError("target_recall requires the name of an index backend")
+        backends = tunable_backends(index) if target_recall is not None else None
+
         self.memory_file = memory_file
+        self.storage = None
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.read_only = read_only
+        self.save_index = save_index
+        self.dtype = dtype if quantization is not None else None
+        self.segment_size = segment_size
+        self.search_workers = search_workers
+        self.rerank = rerank
+        self.backends = backends
+        self.target_recall = target_recall
+        # identifies the kind of index saved with the memory
+        self.index_backend = {
+            "index": index if isinstance(index, str) else type(index).__name__,
+            "dtype": self.dtype,
+            "segment_size": segment_size,
+            "target_recall": target_recall,
+        }
+        self.lexical = BM25Index() if bm25 else None
+        if read_only and (memory_file is None or not Storage(memory_file).is_directory):
+            raise ValueError("read_only requires a memory directory")
+        load = []
+        if memory_file is not None:
+            self.storage = Storage(memory_file, fsync=fsync, read_only=read_only)
+            load = self.storage.load_from_disk()
+        self._set_state(self._load_state(load), load[0].get("log", []) if load else [])
 
-        if memory_file is None:
-            self.memory = []
-            self.metadata_memory = []
+        if isinstance(embeddings, str):
+            self.embedder = Embedder(embeddings)
+        elif isinstance(embeddings, BaseEmbedder):
+            self.embedder = embeddings
         else:
-            load = Storage(memory_file).load_from_disk()
-            self.memory = [] if len(load) != 1 else load[0]["memory"]
-            self.metadata_memory = [] if len(load) != 1 else load[0]["metadata"]
+            raise TypeError("Embeddings must be an Embedder instance or string")
 
         if chunking_strategy is None:
             chunking_strategy = {"mode": "sliding_window"}
+        if chunking_strategy["mode"] == "tokens" and "tokenizer" not in chunking_strategy and getattr(self.embedder, "sbert", False):
+            # windows are measured in tokens of the sentence-transformers model that embeds them
+            chunking_strategy = {**chunking_strategy, "tokenizer": self.embedder.model_name}
         self.chunker = Chunker(chunking_strategy)
 
-        self.metadata_index_counter = 0
-        self.text_index_counter = 0
+        if embedding_cache is not None:
+            self.embedder = CachedEmbedder(self.embedder, metrics=self.metrics, **embedding_cache)
 
-        if isinstance(embeddings, str):
-            self.embedder = Embedder(embeddings)
-        elif isinstance(embeddings, BaseEmbedder):
-            self.embedder = embeddings
+        self.vector_search = VectorSearch()
+
+        # the index is populated lazily, so opening a memory file does not read every embedding
+        if segment_size is not None and not isinstance(index, str):
+            raise TypeError("segment_size requires the name of an index backend")
+        # rebuilt indexes are new instances, so an index instance is copied while it is empty
+        self.index_template = index if isinstance(index, str) else copy.deepcopy(index)
+        if not isinstance(index, str):
+            self.index_template.reset()
+        self.index = self._create_index(self.index_config, None if isinstance(index, str) else index)
+        self.indexed_count = 0
+        self.metadata_index = MetadataIndex()
+        self.lock = ReadWriteLock()
+        # serializes updates, which hold the read-write lock exclusively only to apply them
+        self.update_lock = threading.RLock()
+        # serializes index builds
+        self.index_lock = threading.Lock()
+
+    def _create_index(self, index_config: Dict[str, Any], index: BaseIndex = None) -> BaseIndex:
+        """
+        Creates an empty index with the options the memory was created with.
+
+        :param index_config: the dictionary a tuned index keeps its configuration in.
+        :param index: the index instance to use, by default a copy of the one given to __init__.
+        """
+        if self.target_recall is not None:
+            make_index = functools.partial(TunedIndex, self.backends, self.target_recall, index_config)
+        elif isinstance(self.index_template, str):
+            make_index = functools.partial(create_index, self.index_template)
         else:
-            raise TypeError("Embeddings must be an Embedder instance or string")
+            make_index = functools.partial(copy.deepcopy, self.index_template)
+        if self.segment_size is not None:
+            index = SegmentedIndex(make_index, self.segment_size, self.search_workers)
+        elif index is None:
+            index = make_index()
+        if self.rerank:
+            index = RerankIndex(index, self._stored_vectors, self.rerank)
+        return index
 
-        self.vector_search = VectorSearch()
+    def _stored_vectors(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Returns the stored embeddings at the given positions, as float32.
+        """
+        return self.store.vectors(rows)
+
+    def _set_state(self, state: Dict[str, Any], log: List[Dict[str, Any]] = ()):
+        """
+        Sets the stored state returned by _load_state, then replays the updates logged after the
+        snapshot it was loaded from.
+        """
+        self.store = state["store"]
+        self.metadata_memory = state["metadata_memory"]
+        self.metadata_index_counter = state["metadata_index_counter"]
+        self.text_index_counter = state["text_index_counter"]
+        self.documents = state["documents"]
+        self.tombstones = state["tombstones"]
+        self.deleted_count = state["deleted_count"]
+        self.index_config = state["index_config"]
+        self.saved_index = state["saved_index"]
+        self.lexical = state["lexical"]
+        for record in log:
+            self._apply(record)
+
+    def _load_state(self, load: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Builds the stored state from the data loaded from the memory file, in new objects, without
+        replaying logged updates.
+
+        :param load: the list returned by Storage.load_from_disk.
+        :return: a dictionary of attribute values.
+        """
+        state = {
+            "store": VectorStore(self.dtype or "float32", self.segment_size),
+            "metadata_memory": [],
+            "metadata_index_counter": 0,
+            "text_index_counter": 0,
+            "documents": {},
+            "tombstones": np.zeros(0, dtype=bool),
+            "deleted_count": 0,
+            "index_config": {},
+            "saved_index": None,
+            "lexical": BM25Index() if self.lexical is not None else None,
+        }
+        if len(load) != 1:
+            return state
+
+        memory = load[0]["memory"]
+        if isinstance(memory, list):
+            store = VectorStore.from_entries(memory)
+        else:
+            store = VectorStore.from_dict(memory)
+        state["store"] = store = store.astype(self.dtype or store.dtype, self.segment_size)
+        state["metadata_memory"] = load[0]["metadata"]
+        state["metadata_index_counter"] = len(state["metadata_memory"])
+        documents = load[0].get("documents", {})
+        state["documents"] = dict(documents.get("ids", {}))
+        # text indices of deleted documents are never reused
+        state["text_index_counter"] = max(
+            int(store.text_index.data.max()) + 1 if len(store) else 0, documents.get("text_count", 0)
+        )
+        # a configuration tuned for another target or backend is tuned again
+        index_config = load[0].get("index") or {}
+        if index_config.get("target_recall") == self.target_recall and index_config.get("backend") in (self.backends or []) + ["flat"]:
+            state["index_config"] = dict(index_config)
+        # an index saved with other index options is rebuilt
+        saved_index = load[0].get("vector_index")
+        if saved_index is not None and saved_index["backend"] == self.index_backend:
+            state["saved_index"] = saved_index
+        if state["lexical"] is not None:
+            lexical = load[0].get("lexical")
+            if lexical is not None and len(lexical["lengths"]) == len(store):
+                state["lexical"] = BM25Index.from_dict(lexical)
+            else:
+                state["lexical"].add(list(store.chunks))
+        return state
+
+    def _check_writable(self):
+        """
+        Raises ValueError if the memory is read-only.
+        """
+        if self.read_only:
+            raise ValueError("The memory is read-only, updates are made by the process that opened it for writing")
 
     def save(
         self,
         texts,
         metadata: Union[List, List[dict], None] = None,
         memory_file: str = None,
-    ):
+        workers: int = None,
+        ids: List = None,
+    ) -> List:
         """
         Saves the given texts and metadata to memory.
 
         :param texts: a string or a list of strings containing the texts to be saved.
         :param metadata: a dictionary or a list of dictionaries containing the metadata associated with the texts.
         :param memory_file: a string containing the path to the memory file. (default: None)
+        :param workers: the number of processes used to chunk the texts. (default: None, chunk in this thread)
+        :param ids: a list with a unique, hashable document id for every text. Integer ids must not be numbers already given to texts; numbering continues after them. (default: None, the texts are numbered)
+        :return: the document ids of the saved texts, as accepted by delete and upsert.
         """
+        self._check_writable()
 
         if not isinstance(texts, list):
             texts = [texts]
@@ -84,125 +296,962 @@ class Memory:
         # Extend metadata to be the same length as texts, if it's shorter.
         metadata += [{}] * (len(texts) - len(metadata))
 
-        for meta in metadata:
-            self.metadata_memory.append(meta)
+        if memory_file is None:
+            memory_file = self.memory_file
+
+        with self.metrics.timer("chunk"):
+            if workers:
+                with ProcessPoolExecutor(workers) as pool:
+                    text_chunks = list(pool.map(self.chunker, texts, chunksize=max(1, len(texts) // (4 * workers))))
+            else:
+                text_chunks = [self.chunker(text) for text in texts]
+        embeddings = self._embed_chunks(list(itertools.chain.from_iterable(text_chunks)))
+        with self.update_lock:
+            with self.lock.write():
+                self._check_ids(ids, len(texts))
+                first = self.text_index_counter
+                record = self._save_record(text_chunks, metadata, embeddings, ids)
+                self._apply(record)
+            self._persist(record, memory_file)
+        return list(ids) if ids is not None else list(range(first, first + len(texts)))
+
+    def save_embeddings(
+        self,
+        chunks: List[str],
+        vectors: np.ndarray,
+        metadata: Union[List[dict], None] = None,
+        memory_file: str = None,
+        ids: List = None,
+    ) -> List:
+        """
+        Saves chunks with embeddings computed elsewhere, without calling the embedder. Every chunk
+        is saved as a separate text.
+
+        :param chunks: a list of chunk strings.
+        :param vectors: a 2D floating point array with one embedding per chunk. Only the embedding model is skipped: the vectors are copied into the store, in its embedding dtype (quantized, with quantization).
+        :param metadata: a list of dictionaries containing the metadata associated with the chunks.
+        :param memory_file: a string containing the path to the memory file. (default: None)
+        :param ids: a list with a unique, hashable document id for every chunk. (default: None, the chunks are numbered)
+        :return: the document ids of the saved chunks.
+        """
+        self._check_writable()
+        vectors = self._check_vectors(vectors)
+        if len(vectors) != len(chunks):
+            raise ValueError(f"Expected one vector per chunk, got {len(vectors)} vectors for {len(chunks)} chunks")
+
+        metadata = list(metadata or [])
+        metadata += [{}] * (len(chunks) - len(metadata))
+        if memory_file is None:
+            memory_file = self.memory_file
+
+        with self.update_lock:
+            with self.lock.write():
+                self._check_ids(ids, len(chunks))
+                first = self.text_index_counter
+                record = self._save_record([[chunk] for chunk in chunks], metadata, vectors if len(vectors) else None, ids)
+                self._apply(record)
+            self._persist(record, memory_file)
+        return list(ids) if ids is not None else list(range(first, first + len(chunks)))
 
-        meta_index_start = (
-            self.metadata_index_counter
-        )  # Starting index for this save operation
-        self.metadata_index_counter += len(
-            metadata
-        )  # Update the counter for future save operations
+    def _check_ids(self, ids: List, count: int):
+        """
+        Raises ValueError unless ids is None or holds count new, distinct document ids. Integer
+        ids share their namespace with numbered texts, so numbers already given out are rejected.
+        """
+        if ids is None:
+            return
+        if len(ids) != count:
+            raise ValueError("Expected one id per text")
+        if len(set(ids)) != len(ids) or any(doc_id in self.documents for doc_id in ids):
+            raise ValueError("Document ids must be unique, use upsert to replace a document")
+        if any(isinstance(doc_id, (int, np.integer)) and doc_id < self.text_index_counter for doc_id in ids):
+            raise ValueError("Integer document ids must not be the number of a saved text, use upsert to replace a document")
+
+    def _check_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Validates embeddings passed in by the caller against the store.
+
+        :param vectors: a 1D or 2D floating point array.
+        :return: the embeddings as a 2D C-contiguous float32 array, which is the input array itself when it already is one.
+        """
+        vectors = np.asarray(vectors)
+        if not np.issubdtype(vectors.dtype, np.floating):
+            raise TypeError(f"Expected floating point vectors, got {vectors.dtype}")
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if vectors.ndim != 2:
+            raise ValueError(f"Expected a 1D or 2D array of vectors, got {vectors.ndim} dimensions")
+        if self.store.dim and vectors.shape[1] != self.store.dim:
+            raise ValueError(f"Expected vectors of dimension {self.store.dim}, got {vectors.shape[1]}")
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def delete(self, text_ids, memory_file: str = None):
+        """
+        Deletes documents from memory. Their chunks are tombstoned, so they are skipped by searches
+        right away, and are removed from the store and the index by the next compaction.
+
+        :param text_ids: a document id or a list of document ids, as returned by save.
+        :param memory_file: a string containing the path to the memory file. (default: None)
+        """
+        self._check_writable()
+        if not isinstance(text_ids, list):
+            text_ids = [text_ids]
+        if memory_file is None:
+            memory_file = self.memory_file
+
+        with self.update_lock:
+            with self.lock.write():
+                record = self._delete_record(text_ids)
+                self._apply(record)
+            self._persist(record, memory_file)
+            if self.deleted_count > TOMBSTONE_RATIO * len(self.store):
+                self.compact(memory_file)
 
+    def upsert(self, text_id, text: str, metadata: dict = None, memory_file: str = None):
+        """
+        Saves a text under a document id, replacing the document previously saved under it.
+
+        :param text_id: the document id.
+        :param text: the text to be saved.
+        :param metadata: a dictionary containing the metadata associated with the text.
+        :param memory_file: a string containing the path to the memory file. (default: None)
+        """
+        self._check_writable()
+        if memory_file is None:
+            memory_file = self.memory_file
+
+        # embed before tombstoning, so a failing embedder leaves the old document in place
+        text_chunks = [self.chunker(text)]
+        embeddings = self._embed_chunks(text_chunks[0])
+        # searches see either the old or the new document, never both or neither
+        with self.update_lock:
+            records = []
+            with self.lock.write():
+                if self._resolve(text_id, missing_ok=True) is not None:
+                    records.append(self._delete_record([text_id]))
+                    self._apply(records[-1])
+                records.append(self._save_record(text_chunks, [metadata or {}], embeddings, [text_id]))
+                self._apply(records[-1])
+            for record in records:
+                self._persist(record, memory_file)
+
+    def save_stream(
+        self,
+        items: Iterable[Union[str, Tuple[str, dict]]],
+        batch_size: int = 256,
+        callback: Callable[[Dict[str, Any]], None] = None,
+        memory_file: str = None,
+        workers: int = None,
+    ) -> Dict[str, Any]:
+        """
+        Saves a stream of texts with bounded memory: texts are chunked as they are consumed, and
+        embedded and appended in micro-batches of about batch_size chunks.
+
+        :param items: an iterable of texts or (text, metadata) tuples.
+        :param batch_size: the number of chunks embedded per batch. (default: 256)
+        :param callback: called after every batch with a dictionary of progress counters ("texts", "chunks", "seconds", "chunks_per_second").
+        :param memory_file: a string containing the path to the memory file. (default: None)
+        :param workers: the number of chunking processes. When set, chunking runs in a process pool and every batch is embedded in a background thread while the next one is being chunked. (default: None)
+        :return: the final progress counters.
+        """
+        self._check_writable()
         if memory_file is None:
             memory_file = self.memory_file
+        # a memory directory logs every batch; other memory files are written once at the end
+        log_batches = memory_file == self.memory_file and self.storage is not None and self.storage.is_directory
 
-        text_chunks = [self.chunker(text) for text in texts]
+        progress = {"texts": 0, "chunks": 0, "seconds": 0.0, "chunks_per_second": 0.0}
+        start = time.perf_counter()
+
+        def finish(text_chunks, metadata, embeddings):
+            # batches are finished in order, so text and metadata indices follow the input order
+            with self.update_lock:
+                with self.lock.write():
+                    record = self._save_record(text_chunks, metadata, embeddings)
+                    self._apply(record)
+                if log_batches:
+                    self._persist(record, memory_file)
+
+            progress["texts"] += len(text_chunks)
+            progress["chunks"] += len(record["chunks"])
+            progress["seconds"] = time.perf_counter() - start
+            progress["chunks_per_second"] = progress["chunks"] / max(progress["seconds"], 1e-9)
+            if callback is not None:
+                callback(dict(progress))
+
+        with ExitStack() as stack:
+            chunk_pool = embed_pool = None
+            if workers:
+                chunk_pool = stack.enter_context(ProcessPoolExecutor(workers))
+                embed_pool = stack.enter_context(ThreadPoolExecutor(1))
+
+            in_flight = None
+            for text_chunks, metadata in self._chunk_batches(items, batch_size, chunk_pool, 4 * (workers or 1)):
+                flatten_chunks = list(itertools.chain.from_iterable(text_chunks))
+                if embed_pool is None:
+                    finish(text_chunks, metadata, self._embed_chunks(flatten_chunks, batch_size))
+                    continue
+                future = embed_pool.submit(self._embed_chunks, flatten_chunks, batch_size)
+                if in_flight is not None:
+                    finish(in_flight[0], in_flight[1], in_flight[2].result())
+                in_flight = (text_chunks, metadata, future)
+
+            if in_flight is not None:
+                finish(in_flight[0], in_flight[1], in_flight[2].result())
+
+        if memory_file is not None and not log_batches:
+            with self.update_lock:
+                self._persist(None, memory_file)
+
+        return progress
+
+    def _chunk_batches(
+        self,
+        items: Iterable[Union[str, Tuple[str, dict]]],
+        batch_size: int,
+        pool: ProcessPoolExecutor = None,
+        window: int = 1,
+    ) -> Iterator[Tuple[List[List[str]], List[dict]]]:
+        """
+        Chunks a stream of texts and groups consecutive texts into batches of about batch_size chunks.
+
+        :param items: an iterable of texts or (text, metadata) tuples.
+        :param batch_size: the number of chunks per batch.
+        :param pool: a process pool to chunk in, or None to chunk in this thread.
+        :param window: the maximum number of texts submitted to the pool ahead of the batch being built.
+        :return: an iterator of (chunks of every text, metadata of every text) tuples.
+        """
+        def chunked():
+            submitted = deque()
+            for item in items:
+                text, meta = item if isinstance(item, tuple) else (item, None)
+                meta = {} if meta is None else meta
+                if pool is None:
+                    yield self.chunker(text), meta
+                    continue
+                submitted.append((pool.submit(self.chunker, text), meta))
+                if len(submitted) >= window:
+                    future, meta = submitted.popleft()
+                    yield future.result(), meta
+            while submitted:
+                future, meta = submitted.popleft()
+                yield future.result(), meta
+
+        text_chunks, metadata, pending = [], [], 0
+        for chunks, meta in chunked():
+            text_chunks.append(chunks)
+            metadata.append(meta)
+            pending += len(chunks)
+            if pending >= batch_size:
+                yield text_chunks, metadata
+                text_chunks, metadata, pending = [], [], 0
+        if text_chunks:
+            yield text_chunks, metadata
+
+    def _embed_chunks(self, chunks: List[str], batch_size: int = None) -> np.ndarray:
+        """
+        Embeds chunks into a 2D float32 array.
+
+        :param chunks: a list of chunk strings.
+        :param batch_size: the maximum number of chunks per embedding call. (default: all at once)
+        :return: the embeddings, or None if there are no chunks.
+        """
+        if not chunks:
+            return None
+        batch_size = batch_size or len(chunks)
+        with self.metrics.timer("embed"):
+            embeddings = np.concatenate([
+                np.array(
+                    self.embedder.embed_text(chunks[start : start + batch_size]), dtype=np.float32
+                ).reshape(len(chunks[start : start + batch_size]), -1)
+                for start in range(0, len(chunks), batch_size)
+            ])
+        self.metrics.increment("chunks_embedded", len(chunks))
+        return embeddings
+
+    def _save_record(self, text_chunks: List[List[str]], metadata: List[dict], embeddings: np.ndarray, ids: List = None) -> Dict[str, Any]:
+        """
+        Builds the update record that saves the chunks of consecutive texts.
+
+        :param text_chunks: a list with the chunks of every text.
+        :param metadata: a list with the metadata of every text (may be longer than text_chunks).
+        :param embeddings: the embeddings of all chunks, in order.
+        :param ids: the document id of every text, or None for numbered texts.
+        """
         chunks_size = [len(chunks) for chunks in text_chunks]
 
-        flatten_chunks = list(itertools.chain.from_iterable(text_chunks))
-
-        embeddings = self.embedder.embed_text(flatten_chunks)
-
-        text_index_start = (
-            self.text_index_counter
-        )  # Starting index for this save operation
-        self.text_index_counter += len(texts)
-
-        # accumulated size is end_index of each chunk
-        for size, end_index, chunks, meta_index, text_index in zip(
-            chunks_size,
-            itertools.accumulate(chunks_size),
-            text_chunks,
-            range(meta_index_start, self.metadata_index_counter),
-            range(text_index_start, self.text_index_counter),
-        ):
-            start_index = end_index - size
-            chunks_embedding = embeddings[start_index:end_index]
-
-            for chunk, embedding in zip(chunks, chunks_embedding):
-                entry = {
-                    "chunk": chunk,
-                    "embedding": embedding,
-                    "metadata_index": meta_index,
-                    "text_index": text_index,
-                }
-                self.memory.append(entry)
+        # every chunk points back to the text and metadata it was cut from
+        text_indices = np.arange(self.text_index_counter, self.text_index_counter + len(text_chunks))
+        meta_indices = np.arange(self.metadata_index_counter, self.metadata_index_counter + len(text_chunks))
+        self.metrics.increment("texts_saved", len(text_chunks))
+        return {
+            "op": "save",
+            "chunks": list(itertools.chain.from_iterable(text_chunks)),
+            "embeddings": embeddings,
+            "text_index": np.repeat(text_indices, chunks_size),
+            "metadata_index": np.repeat(meta_indices, chunks_size),
+            "metadata": list(metadata),
+            "text_count": len(text_chunks),
+            "ids": None if ids is None else list(ids),
+        }
 
-        if memory_file is not None:
-            Storage(memory_file).save_to_disk([{"memory": self.memory, "metadata" :self.metadata_memory}])
+    def _resolve(self, text_id, missing_ok: bool = False) -> int:
+        """
+        Returns the text index of a document id: an id given to save, or the number of a text
+        saved without one.
+        """
+        if text_id in self.documents:
+            return self.documents[text_id]
+        # the text indices of texts saved with an id are not their number
+        if isinstance(text_id, (int, np.integer)) and 0 <= text_id < self.text_index_counter and text_id not in self.documents.values():
+            return int(text_id)
+        if missing_ok:
+            return None
+        raise KeyError(f"Unknown document id: {text_id!r}")
+
+    def _delete_record(self, text_ids: List) -> Dict[str, Any]:
+        """
+        Builds the update record that deletes documents.
+        """
+        text_index = np.array([self._resolve(text_id) for text_id in text_ids], dtype=np.int64)
+        return {
+            "op": "delete",
+            "ids": [text_id for text_id in text_ids if text_id in self.documents],
+            "text_index": text_index,
+        }
+
+    def _apply(self, record: Dict[str, Any]):
+        """
+        Applies an update record produced by save or delete, either live or when replaying the log.
+        """
+        if record.get("op") == "delete":
+            for text_id in record["ids"]:
+                self.documents.pop(text_id, None)
+            tombstones = self._tombstones()
+            tombstones |= np.isin(self.store.text_index.data, record["text_index"])
+            self.deleted_count = int(tombstones.sum())
+            return
+
+        with self.metrics.timer("append"):
+            if record.get("ids") is not None:
+                first = self.text_index_counter
+                self.documents.update((text_id, first + i) for i, text_id in enumerate(record["ids"]))
+            self.metadata_memory.extend(record["metadata"])
+            self.metadata_index_counter += len(record["metadata"])
+            self.text_index_counter += record["text_count"]
+            # numbered texts never take an integer document id
+            numbers = [int(text_id) for text_id in record.get("ids") or () if isinstance(text_id, (int, np.integer))]
+            self.text_index_counter = max([self.text_index_counter] + [number + 1 for number in numbers])
+            if record["chunks"]:
+                self.store.append(
+                    record["chunks"],
+                    record["embeddings"],
+                    record["text_index"],
+                    record["metadata_index"],
+                )
+                if self.lexical is not None:
+                    self.lexical.add(record["chunks"])
+
+    def _persist(self, record: Dict[str, Any], memory_file: str):
+        """
+        Persists an update record. Memory directories append it to their write-ahead log, any
+        other memory file is rewritten in full (as it is when record is None). Called with the
+        update lock held, and the read-write lock released.
+        """
+        if memory_file is None:
+            return
+        with self.metrics.timer("persist"):
+            if memory_file == self.memory_file:
+                # the first snapshot of a directory also records how its embeddings are stored
+                if record is not None and self.storage.is_directory and self.storage.generation:
+                    self.storage.append_to_log(record)
+                    if self.storage.should_compact():
+                        self.compact()
+                else:
+                    self.compact()
+            else:
+                self.compact(memory_file)
 
     def search(
-        self, query: str, top_n: int = 5, unique: bool = False, batch_results: str = "flatten"
+        self,
+        query: str,
+        top_n: int = 5,
+        unique: bool = False,
+        batch_results: str = "flatten",
+        filter: dict = None,  # pylint: disable = redefined-builtin
+        diversity: float = None,
+        mode: str = "vector",
     ) -> List[Dict[str, Any]]:
         """
         Searches for the most similar chunks to the given query in memory.
 
         :param query: a string containing the query text.
         :param top_n: the number of most similar chunks to return. (default: 5)
-        :param unique: chunks are filtered out to unique texts (default: False)
+        :param unique: return the best chunk of top_n distinct texts, searching deeper when the nearest chunks share texts (default: False)
         :param batch_results: if input is list of queries, results can use "flatten" or "diverse" algorithm
+        :param filter: only chunks whose metadata matches this filter are searched, e.g. {"source": "docs", "year": {"$gte": 2020}} (default: None)
+        :param diversity: when set, results are re-ranked by maximal marginal relevance, from 0 (relevance only) to 1 (novelty only) (default: None)
+        :param mode: "vector" searches embeddings, "keyword" the BM25 index and "hybrid" both, fusing their rankings by reciprocal rank fusion. Keyword and hybrid results carry a "score" instead of a "distance", and require bm25=True. (default: "vector")
         :return: a list of dictionaries containing the top_n most similar chunks and their associated metadata.
         """
+        self._check_diversity(diversity)
+        self._check_mode(mode)
+        if isinstance(query, list) and mode != "vector":
+            raise ValueError(f"mode={mode!r} takes a single query, use search_batch for several")
+        if not isinstance(query, list):
+            return self.search_batch([query], top_n, unique, filter, diversity, mode)[0]
 
-        if isinstance(query, list):
+        with self.metrics.timer("query_embed"):
             query_embedding = self.embedder.embed_text(query)
-        else:
-            query_embedding = self.embedder.embed_text([query])[0]
 
-        embeddings = [entry["embedding"] for entry in self.memory]
-        if len(embeddings) == 0:
+        with self._searching(metadata=bool(filter)):
+            mask = self._search_mask(filter)
+            if self.indexed_count == 0 or (mask is not None and not mask.any()):
+                return []
+            self._count_search(len(query), mask)
+            with self.metrics.timer("index_search"):
+                fetch = self._candidate_count(top_n, diversity)
+                if unique:
+                    # the best fetch texts of every query include the best fetch texts of the batch
+                    queries = np.array(query_embedding, dtype=np.float32).reshape(len(query), -1)
+                    rows = self._search_rows(queries, fetch, True, mask)
+                    indices = np.full((len(rows), fetch), -1, dtype=np.int64)
+                    distances = np.full((len(rows), fetch), np.inf, dtype=np.float32)
+                    for row, (row_indices, row_distances) in enumerate(rows):
+                        indices[row, : len(row_indices)], distances[row, : len(row_indices)] = row_indices, row_distances
+                    indices, distances = self.vector_search.get_unique_k_elements(indices, distances, indices.size, batch_results == "diverse")
+                    first = self.vector_search.first_occurrences(self.store.text_index.data[indices])[:fetch]
+                    indices, distances = indices[first], distances[first]
+                else:
+                    indices, distances = self.vector_search.search_arrays(self.index, query_embedding, fetch, batch_results, mask)
+            with self.metrics.timer("results"):
+                if diversity is not None:
+                    order = self.vector_search.mmr(np.asarray(query_embedding), self.store.vectors(indices), top_n, diversity)
+                    indices, distances = indices[order], distances[order]
+                return self._results(indices, distances, False)
+
+    def search_batch(
+        self,
+        queries: List[str],
+        top_n: int = 5,
+        unique: bool = False,
+        filter: dict = None,  # pylint: disable = redefined-builtin
+        diversity: float = None,
+        mode: str = "vector",
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Searches for the most similar chunks to every query, with one embedding call and one index call for the whole batch.
+
+        :param queries: a list of query texts.
+        :param top_n: the number of most similar chunks to return per query. (default: 5)
+        :param unique: chunks are filtered out to unique texts (default: False)
+        :param filter: only chunks whose metadata matches this filter are searched (default: None)
+        :param diversity: re-ranks the results of every query by maximal marginal relevance, see search (default: None)
+        :param mode: "vector", "keyword" or "hybrid", see search (default: "vector")
+        :return: a list with, for every query, a list of dictionaries as returned by search.
+        """
+        self._check_diversity(diversity)
+        self._check_mode(mode)
+        if len(queries) == 0:
             return []
+        if len(self.store) == 0:
+            return [[] for _ in queries]
+
+        query_embeddings = None
+        # keyword searches only need embeddings to re-rank by diversity
+        if mode != "keyword" or diversity is not None:
+            with self.metrics.timer("query_embed"):
+                query_embeddings = np.array(self.embedder.embed_text(queries), dtype=np.float32).reshape(len(queries), -1)
+        return self._search_embeddings(query_embeddings, top_n, unique, filter, diversity, queries, mode)
+
+    def search_by_vector(
+        self, vectors: np.ndarray, top_n: int = 5, unique: bool = False, filter: dict = None, diversity: float = None  # pylint: disable = redefined-builtin
+    ) -> Union[List[Dict[str, Any]], List[List[Dict[str, Any]]]]:
+        """
+        Searches for the most similar chunks to query embeddings computed elsewhere, without calling the embedder.
+
+        :param vectors: a 1D query embedding, or a 2D array with one query embedding per row. float32 C-contiguous arrays are used without copying.
+        :param top_n: the number of most similar chunks to return per query. (default: 5)
+        :param unique: chunks are filtered out to unique texts (default: False)
+        :param filter: only chunks whose metadata matches this filter are searched (default: None)
+        :param diversity: re-ranks the results of every query by maximal marginal relevance, see search (default: None)
+        :return: for a 1D query, a list of dictionaries as returned by search; for a 2D array, one such list per row.
+        """
+        self._check_diversity(diversity)
+        single = np.ndim(vectors) == 1
+        query_embeddings = self._check_vectors(vectors)
+        results = self._search_embeddings(query_embeddings, top_n, unique, filter, diversity)
+        return results[0] if single else results
 
-        indices = self.vector_search.search_vectors(query_embedding, embeddings, top_n, batch_results)
+    def _search_embeddings(
+        self,
+        query_embeddings: np.ndarray,
+        top_n: int,
+        unique: bool,
+        metadata_filter: dict,
+        diversity: float = None,
+        queries: List[str] = None,
+        mode: str = "vector",
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Searches for the most similar chunks to every row of a 2D float32 array of query embeddings,
+        or with mode="keyword" or "hybrid", to every query text (see search).
+        """
+        count = len(queries) if query_embeddings is None else len(query_embeddings)
+        with self._searching(metadata=bool(metadata_filter)):
+            mask = self._search_mask(metadata_filter)
+            if self.indexed_count == 0 or (mask is not None and not mask.any()):
+                return [[] for _ in range(count)]
+            self._count_search(count, mask)
+            candidates = self._candidate_count(top_n, diversity)
+            if mode != "keyword":
+                with self.metrics.timer("index_search"):
+                    rows = self._search_rows(query_embeddings, candidates, unique, mask)
+            if mode != "vector":
+                with self.metrics.timer("keyword_search"):
+                    keyword_rows = [self._keyword_rows(query, candidates, unique, mask) for query in queries]
+                rows = keyword_rows if mode == "keyword" else [
+                    self._fuse(vector_row, keyword_row, candidates, unique) for vector_row, keyword_row in zip(rows, keyword_rows)
+                ]
+            with self.metrics.timer("results"):
+                if diversity is not None:
+                    for i, (query, (indices, distances)) in enumerate(zip(query_embeddings, rows)):
+                        order = self.vector_search.mmr(query[None, :], self.store.vectors(indices), top_n, diversity)
+                        rows[i] = (indices[order], distances[order])
+                key = "distance" if mode == "vector" else "score"
+                return [self._results(indices[:top_n], values[:top_n], False, key) for indices, values in rows]
+
+    def _keyword_rows(self, query: str, count: int, unique: bool, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the BM25 index for the count best chunks, or with unique, the best chunk of the
+        count best texts, among the indexed chunks.
+        """
+        indices, scores = self.lexical.search(query, None if unique else count, mask, self.indexed_count)
+        if unique:
+            first = self.vector_search.first_occurrences(self.store.text_index.data[indices])[:count]
+            indices, scores = indices[first], scores[first]
+        return indices, scores
+
+    def _fuse(self, vector_row: Tuple[np.ndarray, np.ndarray], keyword_row: Tuple[np.ndarray, np.ndarray], count: int, unique: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Fuses the vector and keyword results of a query by reciprocal rank fusion.
+        """
+        indices, scores = reciprocal_rank_fusion([vector_row[0], keyword_row[0]])
+        if unique:
+            # the two rankings may have picked different chunks of the same text
+            first = self.vector_search.first_occurrences(self.store.text_index.data[indices])
+            indices, scores = indices[first], scores[first]
+        return indices[:count], scores[:count]
+
+    def _search_rows(self, query_embeddings: np.ndarray, count: int, unique: bool, mask: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Searches the index for the nearest count chunks to every query, or with unique, for the
+        nearest chunk of count distinct texts. The unique search fetches several chunks per
+        wanted text and doubles the depth for the queries that still lack texts, until they have
+        enough or the index has no more chunks to return.
+
+        :return: a list with the (indices, distances) arrays of every query, ordered by distance.
+        """
+        live = self.indexed_count if mask is None else int(np.count_nonzero(mask))
+        depth = count
         if unique:
-            unique_indices = []
-            seen_text_indices = set()  # Change the variable name
-            for i in indices:
-                text_index = self.memory[i[0]][
-                    "text_index"
-                ]  # Use text_index instead of metadata_index
-                if (
-                    text_index not in seen_text_indices
-                ):  # Use seen_text_indices instead of seen_meta_indices
-                    unique_indices.append(i)
-                    seen_text_indices.add(
-                        text_index
-                    )  # Use seen_text_indices instead of seen_meta_indices
-            indices = unique_indices
-
-        results = [
+            # start from the average number of chunks per text
+            depth *= max(1, -(-len(self.store) // max(1, self.text_index_counter)))
+        depth = max(1, min(depth, live))
+
+        rows = [None] * len(query_embeddings)
+        pending = np.arange(len(query_embeddings))
+        while len(pending):
+            indices, distances = self.index.search(query_embeddings[pending], depth, mask)
+            short = []
+            for query, row_indices, row_distances in zip(pending.tolist(), indices, distances):
+                found = row_indices != -1
+                exhausted = not found.all()
+                row_indices, row_distances = row_indices[found], row_distances[found]
+                if unique:
+                    first = self.vector_search.first_occurrences(self.store.text_index.data[row_indices])
+                    row_indices, row_distances = row_indices[first], row_distances[first]
+                    if len(first) < count and not exhausted and depth < live:
+                        short.append(query)
+                rows[query] = (row_indices[:count], row_distances[:count])
+            pending = np.array(short, dtype=np.int64)
+            depth = min(2 * depth, live)
+        return rows
+
+    @staticmethod
+    def _candidate_count(top_n: int, diversity: float) -> int:
+        """
+        Returns the number of candidates searched for: top_n, or a larger pool to re-rank by diversity.
+        """
+        return top_n if diversity is None else max(4 * top_n, 20)
+
+    def _check_mode(self, mode: str):
+        """
+        Raises ValueError for unknown search modes, and for keyword modes without a BM25 index.
+        """
+        if mode not in ("vector", "keyword", "hybrid"):
+            raise ValueError(f"Invalid search mode: {mode}")
+        if mode != "vector" and self.lexical is None:
+            raise ValueError(f"mode={mode!r} requires a memory created with bm25=True")
+
+    @staticmethod
+    def _check_diversity(diversity: float):
+        """
+        Raises ValueError unless diversity is None or between 0 and 1.
+        """
+        if diversity is not None and not 0 <= diversity <= 1:
+            raise ValueError(f"diversity must be between 0 and 1, got {diversity}")
+
+    def _count_search(self, queries: int, mask: np.ndarray):
+        """
+        Counts searched queries and the indexed vectors they were searched against.
+        """
+        self.metrics.increment("queries", queries)
+        self.metrics.increment("vectors_searched", queries * (self.indexed_count if mask is None else int(np.count_nonzero(mask))))
+
+    def _search_mask(self, metadata_filter: dict) -> np.ndarray:
+        """
+        Returns the boolean mask of live indexed chunks whose metadata matches a filter, or None if
+        every chunk can be returned. Only reads state, so it is safe under the read lock.
+        """
+        mask = None
+        if metadata_filter:
+            mask = self.metadata_index.match(metadata_filter)[self.store.metadata_index.data[: self.indexed_count]]
+        if self.deleted_count:
+            tombstones = self.tombstones[: self.indexed_count]
+            live = np.ones(self.indexed_count, dtype=bool)
+            live[: len(tombstones)] = ~tombstones
+            mask = live if mask is None else mask & live
+        return mask
+
+    def _tombstones(self) -> np.ndarray:
+        """
+        Returns the boolean mask of deleted chunks, grown to the size of the store.
+        """
+        if len(self.tombstones) < len(self.store):
+            self.tombstones = np.concatenate(
+                [self.tombstones, np.zeros(len(self.store) - len(self.tombstones), dtype=bool)]
+            )
+        return self.tombstones
+
+    def _results(self, indices: np.ndarray, distances: np.ndarray, unique: bool, key: str = "distance") -> List[Dict[str, Any]]:
+        """
+        Builds search results from chunk indices and distances (or, with key="score", scores) ordered by relevance.
+        """
+        if unique:
+            # keep the best chunk of every text
+            first = self.vector_search.first_occurrences(self.store.text_index.data[indices])
+            indices, distances = indices[first], distances[first]
+
+        metadata_index = self.store.metadata_index.data[indices]
+        return [
             {
-                "chunk": self.memory[i[0]]["chunk"],
-                "metadata": self.metadata_memory[self.memory[i[0]]["metadata_index"]],
-                "distance": i[1],
+                "chunk": self.store.chunks[i],
+                "metadata": self.metadata_memory[meta_index],
+                key: distance,
             }
-            for i in indices
+            for i, meta_index, distance in zip(indices.tolist(), metadata_index.tolist(), distances.tolist())
         ]
 
-        return results
+    @contextmanager
+    def _searching(self, metadata: bool = False) -> Iterator[None]:
+        """
+        Holds the read lock for a search, with the index synced first. The index is synced again if
+        it was emptied before the read lock was taken.
+
+        :param metadata: whether the search needs the metadata index, see sync_index.
+        """
+        while True:
+            self.sync_index(metadata)
+            with self.lock.read():
+                if self.indexed_count or len(self.store) == 0:
+                    yield
+                    return
+
+    def sync_index(self, metadata: bool = False):
+        """
+        Adds chunks saved since the last search to the index. An empty index, or an index that
+        the new chunks would train or tune, is built anew (or loaded) without holding the lock,
+        and searches keep using the previous index until it is ready.
+
+        :param metadata: whether to also index the metadata used by filters. Once metadata has been indexed, it is kept in step with the index.
+        """
+        metadata = metadata or self.metadata_index.count > 0
+        if self.indexed_count == len(self.store) and (not metadata or self.metadata_index.count == len(self.metadata_memory)):
+            return
+        with self.index_lock:
+            store, index_config = self.store, self.index_config
+            previous_config = dict(index_config)
+            index, count = None, 0
+            # training or tuning an index builds a new one, as it would block searches for long
+            if (self.indexed_count == 0 and len(store)) or self.index.rebuild_due(len(store)):
+                index_config = dict(index_config)
+                with self.metrics.timer("index_sync"):
+                    index, count = self._build_index(store, index_config, self.saved_index)
+            # so does indexing every metadata entry for the first filtered search
+            metadata_memory, metadata_index = self.metadata_memory, None
+            if metadata and self.metadata_index.count == 0 and metadata_memory:
+                metadata_index = self._build_metadata_index(metadata_memory)
+            with self.lock.write():
+                if index is not None and self.store is store:
+                    self._swap_index(index, count, index_config)
+                    self.metrics.increment("vectors_indexed", count)
+                elif index is not None:
+                    # a purge or reload replaced the store meanwhile, and indexed it
+                    index.close()
+                if metadata_index is not None and self.metadata_memory is metadata_memory and self.metadata_index.count == 0:
+                    self.metadata_index = metadata_index
+                # chunks are appended after their metadata, so every indexed chunk has indexed metadata
+                # (checked again, as a filtered search may have started indexing metadata meanwhile)
+                if metadata or self.metadata_index.count > 0:
+                    self.metadata_index.sync(self.metadata_memory)
+                if self.indexed_count < len(self.store):
+                    with self.metrics.timer("index_sync"):
+                        self.index.add(self.store.vectors(slice(self.indexed_count, None)))
+                    self.metrics.increment("vectors_indexed", len(self.store) - self.indexed_count)
+                    self.indexed_count = len(self.store)
+                index_config = self.index_config
+        if index_config != previous_config and self.storage is not None and not self.read_only:
+            with self.update_lock:
+                self.storage.save_index_config(index_config)
+
+    def _swap_index(self, index: BaseIndex, count: int, index_config: Dict[str, Any]):
+        """
+        Replaces the index by one built with _build_index. Called with the write lock held.
+        """
+        previous, self.index = self.index, index
+        previous.close()
+        self.indexed_count = count
+        self.index_config = index_config
+        self.saved_index = None
+
+    def _build_metadata_index(self, metadata_memory: List[dict]) -> MetadataIndex:
+        """
+        Indexes metadata in a new metadata index, without holding the write lock. Entries appended
+        meanwhile are indexed once the new index has replaced the current one.
+
+        :param metadata_memory: the metadata list to index.
+        """
+        with self.lock.read():
+            entries = metadata_memory[:]
+        metadata_index = MetadataIndex()
+        metadata_index.add(entries)
+        return metadata_index
+
+    def _replace_metadata_index(self, metadata_index: MetadataIndex):
+        """
+        Replaces the metadata index, after the metadata was replaced, by an index of the new
+        metadata built with _build_metadata_index, or by an empty one if filtered searches have
+        not indexed metadata. Called with the write lock held.
+        """
+        metadata = self.metadata_index.count > 0
+        self.metadata_index = metadata_index
+        if metadata:
+            # a filtered search may have started indexing the previous metadata meanwhile
+            self.metadata_index.sync(self.metadata_memory)
+
+    def _build_index(self, store: VectorStore, index_config: Dict[str, Any], saved_index: Dict[str, Any] = None) -> Tuple[BaseIndex, int]:
+        """
+        Builds a new index over the chunks of a store, without holding the write lock.
+
+        :param store: the store to index.
+        :param index_config: the dictionary the new index keeps a tuned configuration in.
+        :param saved_index: the index saved with the snapshot, which is loaded when it matches. (default: None)
+        :return: the index and the number of chunks in it.
+        """
+        index = self._create_index(index_config)
+        with self.lock.read():
+            count = len(store)
+        start = 0 if saved_index is None else self._load_index(index, saved_index, count)
+        if start < count:
+            with self.lock.read():
+                vectors = store.vectors(slice(start, count))
+            index.add(vectors)
+        return index, count
+
+    def _load_index(self, index: BaseIndex, saved: Dict[str, Any], count: int) -> int:
+        """
+        Loads the index saved with the snapshot the memory was opened from.
+
+        :param index: the empty index to load into.
+        :param saved: the "vector_index" entry of the snapshot.
+        :param count: the number of chunks the index is built for.
+        :return: the number of vectors in the loaded index, 0 if it could not be loaded.
+        """
+        if saved["count"] > count:
+            return 0
+        # vectors cannot be added to a mapped index, so only a reader with nothing to add maps it
+        mmap = self.read_only and saved["count"] == count
+        try:
+            loaded = index.load(saved["path"], mmap) and len(index) == saved["count"]
+        except (OSError, RuntimeError):
+            loaded = False
+        if not loaded:
+            index.reset()
+            return 0
+        return saved["count"]
 
     def clear(self):
         """
         Clears the memory.
         """
-        self.memory = []
-        self.metadata_memory = []
-        self.metadata_index_counter = 0
-        self.text_index_counter = 0
+        self._check_writable()
+        with self.update_lock:
+            with self.lock.write():
+                # a new store, so an index being built for the old one is not swapped in
+                self.store = VectorStore(self.store.dtype, self.segment_size)
+                self.metadata_memory = []
+                self.metadata_index_counter = 0
+                self.text_index_counter = 0
+                self.documents = {}
+                self.tombstones = np.zeros(0, dtype=bool)
+                self.deleted_count = 0
+                if self.lexical is not None:
+                    self.lexical.clear()
+                self.index.reset()
+                self.indexed_count = 0
+                self.saved_index = None
+                self.metadata_index.clear()
+
+            if self.memory_file is not None:
+                self.compact()
+
+    def purge(self):
+        """
+        Removes the chunks of deleted documents, and the metadata only they referred to, from the
+        store. The indexes over the remaining chunks and metadata are built before they replace the
+        current ones, so searches running meanwhile use the current store and indexes.
+        """
+        with self.update_lock:
+            if not self.deleted_count:
+                return
+            tombstones = self._tombstones()
+            metadata_index = self.store.metadata_index.data
+            keep_metadata = np.ones(len(self.metadata_memory), dtype=bool)
+            keep_metadata[metadata_index[tombstones]] = False
+            keep_metadata[metadata_index[~tombstones]] = True
+            renumber = np.cumsum(keep_metadata) - 1
+
+            store = self.store.take(np.flatnonzero(~tombstones))
+            store.metadata_index = GrowableArray.from_array(renumber[store.metadata_index.data])
+            lexical = self.lexical.take(np.flatnonzero(~tombstones)) if self.lexical is not None else None
+            metadata_memory = list(itertools.compress(self.metadata_memory, keep_metadata))
+            index_config = dict(self.index_config)
+            with self.metrics.timer("index_sync"):
+                index, count = self._build_index(store, index_config)
+            metadata_index = self._build_metadata_index(metadata_memory) if self.metadata_index.count > 0 else MetadataIndex()
+
+            with self.lock.write():
+                self.store = store
+                self.lexical = lexical
+                self.metadata_memory = metadata_memory
+                self.metadata_index_counter = len(metadata_memory)
+                self.tombstones = np.zeros(0, dtype=bool)
+                self.deleted_count = 0
+                self._swap_index(index, count, index_config)
+                self._replace_metadata_index(metadata_index)
+
+    def compact(self, memory_file: str = None):
+        """
+        Purges deleted documents and writes the whole memory as a new snapshot of the memory file,
+        which also empties the write-ahead log of a memory directory. Searches go on while the
+        snapshot is written.
+
+        :param memory_file: a string containing the path to the memory file. (default: None)
+        """
+        if memory_file is None or memory_file == self.memory_file:
+            self._check_writable()
+        with self.update_lock:
+            self.purge()
+            if memory_file is not None and memory_file != self.memory_file:
+                with self.lock.write():
+                    snapshot = self._snapshot()
+                Storage(memory_file).save_to_disk(snapshot)
+            elif self.storage is not None:
+                save_index = self.save_index and self.storage.is_directory
+                if save_index:
+                    self.sync_index()
+                # the saved index must not change while it is written
+                with self.index_lock if save_index else nullcontext():
+                    with self.lock.write():
+                        snapshot = self._snapshot()
+                        if save_index:
+                            snapshot[0]["vector_index"] = {"index": self.index, "count": self.indexed_count, "backend": self.index_backend}
+                    sealed = self.storage.save_to_disk(snapshot)
+                # sealed segments are now served from the snapshot rather than from RAM
+                if sealed:
+                    with self.lock.write():
+                        self.store.embeddings.sealed[: len(sealed)] = sealed
+
+    def reload(self) -> bool:
+        """
+        Switches a read-only memory to the latest snapshot of its memory directory, which a
+        writer publishes when it compacts. The new snapshot is memory-mapped, and its index is
+        loaded (or, when it was not saved, built) and its metadata indexed before they replace the
+        current ones, so searches running meanwhile see the previous snapshot.
+
+        :return: whether a newer snapshot was loaded.
+        """
+        if not self.read_only:
+            raise ValueError("reload requires a read-only memory")
+        with self.update_lock:
+            current = self.storage.read_current()
+            if current is None or current["generation"] == self.storage.generation:
+                return False
+            state = self._load_state(self.storage.load_from_disk())
+            with self.metrics.timer("index_sync"):
+                index, count = self._build_index(state["store"], state["index_config"], state["saved_index"])
+            metadata_index = self._build_metadata_index(state["metadata_memory"]) if self.metadata_index.count > 0 else MetadataIndex()
+            with self.lock.write():
+                self._set_state(state)
+                self._swap_index(index, count, state["index_config"])
+                self._replace_metadata_index(metadata_index)
+        return True
+
+    def _snapshot(self) -> List[Dict[str, Any]]:
+        """
+        Returns the data written to a memory file.
+        """
+        snapshot = {
+            "memory": self.store.to_dict(),
+            "metadata": self.metadata_memory,
+            "documents": {"ids": self.documents, "text_count": self.text_index_counter},
+            "index": dict(self.index_config),
+        }
+        if self.lexical is not None:
+            snapshot["lexical"] = self.lexical.merge()
+        return [snapshot]
+
+    def close(self):
+        """
+        Syncs and closes the write-ahead log of the memory file, and stops the threads searching
+        index segments.
+        """
+        with self.update_lock, self.lock.write():
+            if self.storage is not None:
+                self.storage.close()
+            self.index.close()
+
+    def __enter__(self):
+        return self
 
-        if self.memory_file is not None:
-            Storage(self.memory_file).save_to_disk([{"memory": self.memory, "metadata" :self.metadata_memory}])
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def dump(self):
         """
         Prints the contents of the memory.
         """
-        for entry in self.memory:
-            print("Chunk:", entry["chunk"])
-            print("Embedding Length:", len(entry["embedding"]))
-            print("Metadata:", self.metadata_memory[entry["metadata_index"]])
-            print("-" * 40)
+        with self.lock.read():
+            deleted = np.zeros(len(self.store), dtype=bool)
+            deleted[: len(self.tombstones)] = self.tombstones
+            for chunk, metadata_index, is_deleted in zip(self.store.chunks, self.store.metadata_index.data, deleted):
+                if is_deleted:
+                    continue
+                print("Chunk:", chunk)
+                print("Embedding Length:", self.store.dim)
+                print("Metadata:", self.metadata_memory[metadata_index])
+                print("-" * 40)
 
-        print("Total entries: ", len(self.memory))
-        print("Total metadata: ", len(self.metadata_memory))
+            print("Total entries: ", len(self.store) - self.deleted_count)
+            print("Total metadata: ", len(self.metadata_memory))
@@ -0,0 +1,206 @@
+"""
+This module provides the metrics interface used by Memory to report per-stage timings and
+counters, an in-process collector with a Prometheus text exporter, and an OpenTelemetry adapter.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator
+import threading
+import time
+
+
+# upper bounds, in seconds, of the stage duration histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """
+    Receives the timings and counters reported by Memory, and discards them.
+
+    Subclasses override increment and observe. Memory reports these stages:
+
+        chunk, embed, append, persist      save: chunking, embed_text, adding to the store, writing to disk
+        query_embed, index_sync,           search: embed_text, adding new chunks to the index,
+        index_search, keyword_search,      searching the vector index and the BM25 index,
+        results                            building the result dictionaries
+
+    and these counters: texts_saved, chunks_embedded, vectors_indexed, queries, vectors_searched
+    (live indexed vectors matching the filter, summed over queries), and embedding_cache_hits and
+    embedding_cache_misses for cached embedders.
+    """
+
+    def increment(self, name: str, value: float = 1):
+        """
+        Adds to a counter.
+
+        :param name: the counter name.
+        :param value: the amount added. (default: 1)
+        """
+
+    def observe(self, stage: str, seconds: float):
+        """
+        Records the duration of a stage.
+
+        :param stage: the stage name.
+        :param seconds: the duration in seconds.
+        """
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Records the duration of a with block as a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+
+class MetricsCollector(Metrics):
+    """
+    Keeps counters and stage duration histograms in memory, for inspection or export.
+    """
+
+    def __init__(self, prefix: str = "vectordb"):
+        """
+        :param prefix: the prefix of exported metric names. (default: "vectordb")
+        """
+        self.prefix = prefix
+        self.counters = {}
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = {"count": 0, "seconds": 0.0, "buckets": [0] * (len(BUCKETS) + 1)}
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["buckets"][bisect_left(BUCKETS, seconds)] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns a copy of the collected metrics.
+
+        :return: a dictionary with "counters" (name: value) and "stages" (name: count, total seconds and mean milliseconds).
+        """
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "stages": {
+                    stage: {"count": stats["count"], "seconds": stats["seconds"], "mean_ms": stats["seconds"] * 1e3 / stats["count"]}
+                    for stage, stats in self.stages.items()
+                },
+            }
+
+    def prometheus(self) -> str:
+        """
+        Returns the collected metrics in the Prometheus text exposition format: a counter per
+        counter name and a histogram of stage durations labelled by stage.
+        """
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines += [f"# TYPE {self.prefix}_{name}_total counter", f"{self.prefix}_{name}_total {value}"]
+            if self.stages:
+                histogram = f"{self.prefix}_stage_seconds"
+                lines.append(f"# TYPE {histogram} histogram")
+            for stage, stats in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), stats["buckets"]):
+                    cumulative += count
+                    lines.append(f'{histogram}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{histogram}_sum{{stage="{stage}"}} {stats["seconds"]}')
+                lines.append(f'{histogram}_count{{stage="{stage}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Clears all counters and stages."""
+        with self.lock:
+            self.counters = {}
+            self.stages = {}
+
+
+class PrometheusExporter:
+    """
+    Serves the metrics of a MetricsCollector over HTTP, in the Prometheus text format, from a
+    background thread. Any path returns the metrics, so the exporter can be scraped at /metrics.
+    """
+
+    def __init__(self, collector: MetricsCollector, port: int = 9464, host: str = "127.0.0.1"):
+        """
+        Starts serving.
+
+        :param collector: the collector to export.
+        :param port: the port to listen on, 0 for any free port. (default: 9464)
+        :param host: the address to listen on. (default: "127.0.0.1")
+        """
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answers every GET with the current metrics."""
+
+            def do_GET(self):  # pylint: disable = invalid-name
+                """Sends the metrics in the Prometheus text format."""
+                body = collector.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable = redefined-builtin
+                """Keeps scrapes out of stderr."""
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        """The URL the metrics are served at."""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def close(self):
+        """Stops serving."""
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class OpenTelemetryMetrics(Metrics):
+    """
+    Reports metrics to an OpenTelemetry meter, e.g. opentelemetry.metrics.get_meter("vectordb"):
+    counters as counters and stage durations as a histogram with a "stage" attribute. Any object
+    with create_counter(name) and create_histogram(name, unit) methods can stand in for the meter.
+    """
+
+    def __init__(self, meter: Any, prefix: str = "vectordb"):
+        """
+        :param meter: an OpenTelemetry Meter.
+        :param prefix: the prefix of metric names. (default: "vectordb")
+        """
+        self.meter = meter
+        self.prefix = prefix
+        self.counters = {}
+        self.histogram = meter.create_histogram(f"{prefix}.stage.duration", unit="s")
+        self.lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1):
+        counter = self.counters.get(name)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.get(name) or self.meter.create_counter(f"{self.prefix}.{name}")
+                self.counters[name] = counter
+        counter.add(value)
+
+    def observe(self, stage: str, seconds: float):
+        self.histogram.record(seconds, {"stage": stage})
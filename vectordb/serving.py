@@ -0,0 +1,146 @@
+"""
+This module provides the AsyncMemory class, an asyncio front end to Memory that coalesces
+concurrent searches into batched embedding and index calls.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple, Union
+import asyncio
+
+import numpy as np
+
+from .filtering import check_filter
+from .memory import Memory
+
+
+class AsyncMemory:
+    """
+    Wraps a Memory for use from asyncio code.
+
+    Searches awaited concurrently are queued for up to max_wait seconds (or until max_batch_size
+    are queued), then answered with a single embed_text call and one index search per distinct
+    (unique, filter, diversity) combination, on a worker thread. Saves run on a thread of their own,
+    so a long save, which chunks and embeds its texts, does not hold up the searches queued behind it.
+    """
+
+    def __init__(self, memory: Memory, max_batch_size: int = 64, max_wait: float = 0.005):
+        """
+        Initializes the wrapper.
+
+        :param memory: the Memory to serve.
+        :param max_batch_size: the maximum number of queries embedded and searched together. (default: 64)
+        :param max_wait: the maximum number of seconds a query waits for others to join its batch. (default: 0.005)
+        """
+        self.memory = memory
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(1)
+        self.save_executor = ThreadPoolExecutor(1)
+        self.pending = []
+        self.timer = None
+
+    async def search(
+        self, query: str, top_n: int = 5, unique: bool = False, filter: dict = None, diversity: float = None  # pylint: disable = redefined-builtin
+    ) -> List[Dict[str, Any]]:
+        """
+        Searches for the most similar chunks to the given query, batched with concurrent searches.
+
+        :param query: a string containing the query text.
+        :param top_n: the number of most similar chunks to return. (default: 5)
+        :param unique: chunks are filtered out to unique texts (default: False)
+        :param filter: only chunks whose metadata matches this filter are searched (default: None)
+        :param diversity: re-ranks the results by maximal marginal relevance, see Memory.search (default: None)
+        :return: a list of dictionaries as returned by Memory.search.
+        """
+        if diversity is not None and not 0 <= diversity <= 1:
+            raise ValueError(f"diversity must be between 0 and 1, got {diversity}")
+        # an invalid request fails on its own rather than failing the batch it would join
+        check_filter(filter)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((query, top_n, unique, filter, diversity, future))
+        if len(self.pending) >= self.max_batch_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    async def save(self, *args, **kwargs) -> List:
+        """
+        Saves texts to memory on the save thread. Takes the arguments of Memory.save.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.save_executor, lambda: self.memory.save(*args, **kwargs))
+
+    def _flush(self):
+        """
+        Hands the queued searches to the worker thread as one batch.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        def fan_out(done: asyncio.Future):
+            error = done.exception()
+            results = None if error is not None else done.result()
+            for i, (*_, future) in enumerate(batch):
+                if future.done():  # cancelled by the caller
+                    continue
+                result = error if error is not None else results[i]
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+        asyncio.get_running_loop().run_in_executor(self.executor, self._search_batch, batch).add_done_callback(fan_out)
+
+    def _search_batch(self, batch: List[Tuple]) -> List[Union[List[Dict[str, Any]], Exception]]:
+        """
+        Answers a batch of queued searches with one embedding call. A search group that fails
+        yields its exception as the result of each of its queries.
+        """
+        queries = [query for query, *_ in batch]
+        with self.memory.metrics.timer("query_embed"):
+            embeddings = np.array(self.memory.embedder.embed_text(queries), dtype=np.float32).reshape(len(queries), -1)
+
+        # queries that share search options are searched together, with the largest top_n among them
+        groups = defaultdict(list)
+        for i, (_, top_n, unique, metadata_filter, diversity, _) in enumerate(batch):
+            # diversified results depend on top_n, so those queries are only grouped with equal top_n
+            groups[(unique, repr(metadata_filter), diversity, top_n if diversity is not None else None)].append(i)
+
+        results = [None] * len(batch)
+        for rows in groups.values():
+            _, _, unique, metadata_filter, diversity, _ = batch[rows[0]]
+            top_n = max(batch[i][1] for i in rows)
+            try:
+                group_results = self.memory.search_by_vector(embeddings[rows], top_n, unique, metadata_filter, diversity)
+            except Exception as error:  # pylint: disable = broad-exception-caught
+                for i in rows:
+                    results[i] = error
+                continue
+            for i, result in zip(rows, group_results):
+                results[i] = result[: batch[i][1]]
+        return results
+
+    def close(self):
+        """
+        Waits for running work to finish and closes the wrapped Memory.
+        """
+        self.executor.shutdown(wait=True)
+        self.save_executor.shutdown(wait=True)
+        self.memory.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.pending:
+            self._flush()
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
@@ -5,31 +5,273 @@ This module provides the Storage class for saving and loading data to and from a
 # pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
 
 from typing import List, Dict, Any
+import json
 import pickle
+import shutil
 import os
 
+import numpy as np
+
+from .store import VectorStore
+from .wal import WriteAheadLog, sync_directory
+
+
+FORMAT_VERSION = 1
+COLUMNS = ("embeddings", "embeddings_scale", "text_index", "metadata_index", "chunks_blob", "chunks_offsets")
+LEXICAL_COLUMNS = ("offsets", "docs", "tfs", "lengths")
+
 
 class Storage:
     """
     A class to handle saving and loading data to and from a memory file.
+
+    Two formats are supported. Paths ending in ".pkl" or ".pickle", or naming an existing file,
+    use the legacy format that pickles everything into a single file. Any other path is a
+    directory holding snapshots in which every column is a separate .npy file that is
+    memory-mapped on load, so opening a store does not read it into RAM:
+
+        memory_dir/
+            CURRENT                    json pointer to the live snapshot
+            snapshot-000001/
+                embeddings.npy         float32, float16 or int8 (n, dim) matrix
+                embeddings-000000.npy  or, for a segmented store, one matrix per segment
+                embeddings_scale.npy   float32 per-row scale of int8 embeddings
+                text_index.npy         int64 source text of every chunk
+                metadata_index.npy     int64 metadata entry of every chunk
+                chunks_offsets.npy     int64 (n + 1) offsets into chunks_blob
+                chunks_blob.npy        uint8 UTF-8 chunk text
+                metadata.pkl           list of metadata entries
+                documents.pkl          document ids and the text counter
+                index.json             tuned index configuration, see Storage.save_index_config
+                lexical_*.npy          BM25 postings and chunk lengths, see BM25Index.to_dict
+                lexical_terms.pkl      BM25 vocabulary
+                vectors.index          optional saved index, described by "vector_index" in CURRENT
+            wal-000001.log             updates appended since snapshot-000001
+
+    Updates to a directory store are appended to the write-ahead log of the live snapshot and
+    replayed on load; compaction writes a new snapshot and starts an empty log. Sealed embedding
+    segments that were loaded from an earlier snapshot are hard-linked into the new one instead
+    of being written again.
+
+    A read-only Storage loads the live snapshot without opening its log, so any number of
+    processes can map the same snapshot files while one writer updates and compacts the store.
     """
 
-    def __init__(self, memory_file: str = "long_memory.pkl"):
+    def __init__(
+        self,
+        memory_file: str = "long_memory.pkl",
+        fsync: str = "batch",
+        compact_min_bytes: int = 16 << 20,
+        read_only: bool = False,
+    ):
         """
         Initializes the Storage with a specified memory file.
 
-        :param memory_file: a string containing the path to the memory file.
+        :param memory_file: a string containing the path to the memory file or directory.
+        :param fsync: the fsync policy of the write-ahead log: "always", "batch" or "close" (default: "batch").
+        :param compact_min_bytes: the log size below which compaction is never suggested (default: 16 MB).
+        :param read_only: whether to load snapshots only, without replaying or writing the log (default: False).
         """
         self.memory_file = memory_file
+        self.fsync = fsync
+        self.compact_min_bytes = compact_min_bytes
+        self.read_only = read_only
+        self.log = None
+        self.snapshot_bytes = 0
+        self.generation = 0
+
+    @property
+    def is_directory(self) -> bool:
+        """Returns True if the memory file uses the directory format."""
+        if os.path.isfile(self.memory_file):
+            return False
+        return not self.memory_file.endswith((".pkl", ".pickle"))
+
+    def read_current(self) -> Dict[str, Any]:
+        """
+        Reads the pointer to the live snapshot of a directory store.
+
+        :return: the CURRENT manifest, or None if nothing has been saved yet.
+        """
+        current_file = os.path.join(self.memory_file, "CURRENT")
+        if not os.path.exists(current_file):
+            return None
+        with open(current_file, "r", encoding="utf-8") as file_handler:
+            return json.load(file_handler)
+
+    def open_log(self, generation: int) -> WriteAheadLog:
+        """
+        Opens the write-ahead log belonging to a snapshot generation.
+
+        :param generation: the snapshot generation, 0 if no snapshot has been written yet.
+        :return: the WriteAheadLog for that generation.
+        """
+        if self.log is not None:
+            self.log.close()
+        self.log = WriteAheadLog(
+            os.path.join(self.memory_file, f"wal-{generation:06d}.log"), self.fsync
+        )
+        return self.log
+
+    def append_to_log(self, record: Dict[str, Any]):
+        """
+        Appends an update record to the write-ahead log of the live snapshot.
+
+        :param record: a picklable dictionary describing the update.
+        """
+        if self.log is None:
+            os.makedirs(self.memory_file, exist_ok=True)
+            current = self.read_current()
+            self.open_log(0 if current is None else current["generation"])
+        self.log.append(record)
+
+    def should_compact(self) -> bool:
+        """
+        Returns True once the write-ahead log has outgrown the snapshot. Compacting at that point
+        keeps the total number of bytes written linear in the size of the memory.
+        """
+        return self.log is not None and self.log.size > max(self.compact_min_bytes, self.snapshot_bytes)
+
+    def close(self):
+        """
+        Syncs and closes the write-ahead log.
+        """
+        if self.log is not None:
+            self.log.close()
+            self.log = None
 
-    def save_to_disk(self, data: List[Dict[str, Any]]):
+    def save_to_disk(self, data: List[Dict[str, Any]]) -> List[np.ndarray]:
         """
         Saves a list of dictionaries containing data to the memory file.
 
-        :param data: a list of dictionaries to be saved.
+        :param data: a list of dictionaries to be saved. In the directory format this is a single
+                     dictionary with the "memory" columns (see VectorStore.to_dict), "metadata" and
+                     optionally "documents", "index", "lexical" and "vector_index", a dictionary
+                     with a BaseIndex ("index") of the first "count" vectors and a json "backend"
+                     describing it.
+        :return: the sealed embedding segments of a segmented store, memory-mapped from the new
+                 snapshot (empty for other stores and formats).
         """
-        with open(self.memory_file, "wb") as file_handler:
-            pickle.dump(data, file_handler)
+        if self.read_only:
+            raise ValueError("The memory is read-only")
+        if not self.is_directory:
+            data = [{key: value for key, value in entry.items() if key != "vector_index"} for entry in data]
+            with open(self.memory_file, "wb") as file_handler:
+                pickle.dump(data, file_handler)
+            return []
+
+        os.makedirs(self.memory_file, exist_ok=True)
+        current = self.read_current()
+        generation = 1 if current is None else current["generation"] + 1
+        snapshot = f"snapshot-{generation:06d}"
+        snapshot_dir = os.path.join(self.memory_file, snapshot)
+        if os.path.exists(snapshot_dir):
+            shutil.rmtree(snapshot_dir)
+        os.makedirs(snapshot_dir)
+
+        columns = data[0]["memory"] if data else VectorStore().to_dict()
+        segments = columns["embeddings"] if isinstance(columns["embeddings"], list) else None
+        for name in COLUMNS:
+            if name == "embeddings" and segments is not None:
+                continue
+            self._write_array(os.path.join(snapshot_dir, f"{name}.npy"), columns[name])
+        sealed = []
+        for i, segment in enumerate(segments or []):
+            path = os.path.join(snapshot_dir, f"embeddings-{i:06d}.npy")
+            if len(segment) < columns["segment_size"]:
+                self._write_array(path, segment)
+                continue
+            # a sealed segment mapped from an earlier snapshot is immutable, so it is linked instead of copied
+            source = segment.filename if isinstance(segment, np.memmap) else None
+            try:
+                os.link(source, path)
+            except (OSError, TypeError):
+                self._write_array(path, segment)
+            sealed.append(path)
+        with open(os.path.join(snapshot_dir, "metadata.pkl"), "wb") as file_handler:
+            pickle.dump(data[0]["metadata"] if data else [], file_handler)
+            os.fsync(file_handler.fileno())
+        if data and "documents" in data[0]:
+            with open(os.path.join(snapshot_dir, "documents.pkl"), "wb") as file_handler:
+                pickle.dump(data[0]["documents"], file_handler)
+                os.fsync(file_handler.fileno())
+        if data and data[0].get("index"):
+            self._write_json(os.path.join(snapshot_dir, "index.json"), data[0]["index"])
+        if data and "lexical" in data[0]:
+            for name in LEXICAL_COLUMNS:
+                self._write_array(os.path.join(snapshot_dir, f"lexical_{name}.npy"), data[0]["lexical"][name])
+            with open(os.path.join(snapshot_dir, "lexical_terms.pkl"), "wb") as file_handler:
+                pickle.dump(data[0]["lexical"]["terms"], file_handler)
+                os.fsync(file_handler.fileno())
+        vector_index = data[0].get("vector_index") if data else None
+        if vector_index is not None and not vector_index["index"].save(os.path.join(snapshot_dir, "vectors.index")):
+            vector_index = None
+
+        # publish the snapshot atomically, then drop the ones it replaces
+        sync_directory(snapshot_dir)
+        arrays = [columns[name] for name in COLUMNS if name != "embeddings" or segments is None] + (segments or [])
+        embeddings = segments[0] if segments else columns["embeddings"]
+        manifest = {
+            "format": FORMAT_VERSION,
+            "generation": generation,
+            "snapshot": snapshot,
+            "count": len(columns["text_index"]),
+            "dim": int(embeddings.shape[1]) if isinstance(embeddings, np.ndarray) and embeddings.ndim == 2 else 0,
+            "bytes": sum(int(array.nbytes) for array in arrays),
+        }
+        if segments is not None:
+            manifest["segments"] = len(segments)
+            manifest["segment_size"] = columns["segment_size"]
+        if vector_index is not None:
+            manifest["vector_index"] = {"count": vector_index["count"], "backend": vector_index["backend"]}
+        self._write_json(os.path.join(self.memory_file, "CURRENT"), manifest)
+        self.snapshot_bytes = manifest["bytes"]
+        self.generation = generation
+
+        # the new snapshot contains everything logged so far, so older logs are obsolete
+        self.open_log(generation)
+        for name in os.listdir(self.memory_file):
+            if name.startswith("snapshot-") and name != snapshot:
+                shutil.rmtree(os.path.join(self.memory_file, name), ignore_errors=True)
+            elif name.startswith("wal-") and name != os.path.basename(self.log.path):
+                os.remove(os.path.join(self.memory_file, name))
+        return [np.load(path, mmap_mode="r") for path in sealed]
+
+    def save_index_config(self, config: Dict[str, Any]):
+        """
+        Records a tuned index configuration in the live snapshot of a memory directory, so it
+        survives restarts without a new snapshot. Pickle files store it with the next save. A
+        saved index built with the previous configuration is removed.
+
+        :param config: a configuration as returned by tuning.tune.
+        """
+        current = self.read_current() if self.is_directory else None
+        if current is not None:
+            snapshot_dir = os.path.join(self.memory_file, current["snapshot"])
+            for name in os.listdir(snapshot_dir):
+                if name.startswith("vectors.index"):
+                    os.remove(os.path.join(snapshot_dir, name))
+            self._write_json(os.path.join(snapshot_dir, "index.json"), config)
+
+    @staticmethod
+    def _write_json(path: str, data: Dict[str, Any]):
+        """
+        Writes a json file atomically: to a temporary file that is fsynced, then renamed. The
+        directory is fsynced too, so the rename is durable before anything relies on it.
+        """
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file_handler:
+            json.dump(data, file_handler)
+            file_handler.flush()
+            os.fsync(file_handler.fileno())
+        os.replace(f"{path}.tmp", path)
+        sync_directory(os.path.dirname(os.path.abspath(path)))
+
+    @staticmethod
+    def _write_array(path: str, array: np.ndarray):
+        """Writes an array to a .npy file and fsyncs it."""
+        with open(path, "wb") as file_handler:
+            np.save(file_handler, np.ascontiguousarray(array))
+            os.fsync(file_handler.fileno())
 
     def load_from_disk(self) -> List[Dict[str, Any]]:
         """
@@ -37,8 +279,97 @@ class Storage:
 
         :return: a list of dictionaries containing the data loaded from the memory file.
         """
-        if not os.path.exists(self.memory_file):
+        if not self.is_directory:
+            if not os.path.exists(self.memory_file):
+                return []
+            with open(self.memory_file, "rb") as file_handler:
+                data = pickle.load(file_handler)
+            return data
+
+        if not os.path.isdir(self.memory_file):
             return []
-        with open(self.memory_file, "rb") as file_handler:
-            data = pickle.load(file_handler)
-        return data
+
+        current = self.read_current()
+        if current is not None and current["format"] > FORMAT_VERSION:
+            raise ValueError(f"Unsupported memory format version: {current['format']}")
+        if self.read_only:
+            # a writer may replace the snapshot while it is read, in which case the new one is read
+            while True:
+                if current is None:
+                    return []
+                try:
+                    return [self._load_snapshot(current, [])]
+                except FileNotFoundError:
+                    latest = self.read_current()
+                    if latest is None or latest == current or latest["format"] > FORMAT_VERSION:
+                        raise
+                    current = latest
+
+        # updates that were logged after the snapshot are returned for replay
+        log = self.open_log(0 if current is None else current["generation"]).replay()
+        if current is None:
+            if not log:
+                return []
+            return [{"memory": VectorStore().to_dict(), "metadata": [], "log": log}]
+        return [self._load_snapshot(current, log)]
+
+    def _load_snapshot(self, current: Dict[str, Any], log: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Loads the snapshot a CURRENT manifest points to, memory-mapping its columns.
+
+        :param current: the CURRENT manifest.
+        :param log: the log records returned with the snapshot for replay.
+        """
+        snapshot_dir = os.path.join(self.memory_file, current["snapshot"])
+        columns = {
+            name: np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode="r")
+            for name in COLUMNS
+            if os.path.exists(os.path.join(snapshot_dir, f"{name}.npy"))
+        }
+        if "segments" in current:
+            columns["embeddings"] = [
+                np.load(os.path.join(snapshot_dir, f"embeddings-{i:06d}.npy"), mmap_mode="r")
+                for i in range(current["segments"])
+            ]
+            columns["segment_size"] = current["segment_size"]
+        with open(os.path.join(snapshot_dir, "metadata.pkl"), "rb") as file_handler:
+            metadata = pickle.load(file_handler)
+        load = {"memory": columns, "metadata": metadata, "log": log}
+        if os.path.exists(os.path.join(snapshot_dir, "documents.pkl")):
+            with open(os.path.join(snapshot_dir, "documents.pkl"), "rb") as file_handler:
+                load["documents"] = pickle.load(file_handler)
+        if os.path.exists(os.path.join(snapshot_dir, "index.json")):
+            with open(os.path.join(snapshot_dir, "index.json"), encoding="utf-8") as file_handler:
+                load["index"] = json.load(file_handler)
+        if os.path.exists(os.path.join(snapshot_dir, "lexical_terms.pkl")):
+            with open(os.path.join(snapshot_dir, "lexical_terms.pkl"), "rb") as file_handler:
+                lexical = {"terms": pickle.load(file_handler)}
+            for name in LEXICAL_COLUMNS:
+                lexical[name] = np.load(os.path.join(snapshot_dir, f"lexical_{name}.npy"), mmap_mode="r")
+            load["lexical"] = lexical
+        if "vector_index" in current:
+            load["vector_index"] = {"path": os.path.join(snapshot_dir, "vectors.index"), **current["vector_index"]}
+        self.snapshot_bytes = current.get("bytes", 0)
+        self.generation = current["generation"]
+        return load
+
+
+def convert_pickle(pickle_file: str, memory_dir: str):
+    """
+    Converts a legacy pickle memory file into the memory-mapped directory format.
+
+    :param pickle_file: the path to the existing pickle memory file.
+    :param memory_dir: the path of the directory to be created.
+    """
+    load = Storage(pickle_file).load_from_disk()
+    if len(load) != 1:
+        Storage(memory_dir).save_to_disk([])
+        return
+
+    memory = load[0]["memory"]
+    store = VectorStore.from_entries(memory) if isinstance(memory, list) else VectorStore.from_dict(memory)
+    data = {"memory": store.to_dict(), "metadata": load[0]["metadata"]}
+    for key in ("documents", "index", "lexical"):
+        if key in load[0]:
+            data[key] = load[0][key]
+    Storage(memory_dir).save_to_disk([data])
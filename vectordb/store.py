@@ -0,0 +1,417 @@
+"""
+This module provides the columnar in-memory layout used by Memory: a growable float32 embedding
+matrix, parallel index arrays and a chunk string table.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+from typing import Any, Dict, Iterator, List
+import numpy as np
+
+
+class GrowableArray:
+    """
+    A preallocated NumPy array that grows geometrically along its first axis, so that appends
+    are amortized O(1) and the valid rows are always available as one contiguous view.
+    """
+
+    def __init__(self, dtype=np.float32, row_shape: tuple = None, capacity: int = 1024):
+        """
+        Initializes an empty array.
+
+        :param dtype: the NumPy dtype of the array.
+        :param row_shape: the shape of a single row, or None to infer it from the first append.
+        :param capacity: the initial number of preallocated rows.
+        """
+        self.dtype = np.dtype(dtype)
+        self.row_shape = row_shape
+        self.initial_capacity = capacity
+        self.buffer = None
+        self.size = 0
+
+    @classmethod
+    def from_array(cls, array: np.ndarray) -> "GrowableArray":
+        """
+        Wraps an existing array without copying it. The array is only copied once it has to grow,
+        so read-only or memory-mapped arrays can be wrapped as well.
+
+        :param array: the array holding the initial rows.
+        :return: a GrowableArray over the given rows.
+        """
+        grow = cls(array.dtype, array.shape[1:])
+        grow.buffer = array
+        grow.size = len(array)
+        return grow
+
+    @property
+    def data(self) -> np.ndarray:
+        """Returns a view of the valid rows."""
+        if self.buffer is None:
+            return np.empty((0,) + (self.row_shape or ()), dtype=self.dtype)
+        return self.buffer[: self.size]
+
+    def reserve(self, capacity: int):
+        """
+        Ensures that at least capacity rows fit without reallocating.
+
+        :param capacity: the number of rows to make room for.
+        """
+        if self.buffer is not None and capacity <= len(self.buffer) and self.buffer.flags.writeable:
+            return
+        new_capacity = max(capacity, self.initial_capacity, 2 * (0 if self.buffer is None else len(self.buffer)))
+        buffer = np.empty((new_capacity,) + self.row_shape, dtype=self.dtype)
+        if self.size:
+            buffer[: self.size] = self.buffer[: self.size]
+        self.buffer = buffer
+
+    def append(self, rows: np.ndarray):
+        """
+        Appends rows to the array.
+
+        :param rows: an array whose rows have the same shape as the rows of this array.
+        """
+        rows = np.asarray(rows, dtype=self.dtype)
+        if self.row_shape is None:
+            self.row_shape = rows.shape[1:]
+        elif rows.shape[1:] != self.row_shape:
+            raise ValueError(f"Expected rows of shape {self.row_shape}, got {rows.shape[1:]}")
+        self.reserve(self.size + len(rows))
+        self.buffer[self.size : self.size + len(rows)] = rows
+        self.size += len(rows)
+
+    def clear(self):
+        """Removes all rows, keeping the row shape."""
+        self.buffer = None
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class SegmentedArray:
+    """
+    An array split into sealed segments of segment_size rows and a growable tail. Sealed segments
+    are never modified, so they can be memory-mapped files, and appends only ever touch the tail.
+    """
+
+    def __init__(self, dtype=np.float32, row_shape: tuple = None, segment_size: int = 1 << 17):
+        """
+        Initializes an empty array.
+
+        :param dtype: the NumPy dtype of the array.
+        :param row_shape: the shape of a single row, or None to infer it from the first append.
+        :param segment_size: the number of rows per segment.
+        """
+        self.dtype = np.dtype(dtype)
+        self.segment_size = segment_size
+        self.sealed = []
+        self.tail = GrowableArray(dtype, row_shape)
+
+    @classmethod
+    def from_arrays(cls, arrays: List[np.ndarray], segment_size: int) -> "SegmentedArray":
+        """
+        Wraps existing segments without copying them: every array but the last must hold exactly
+        segment_size rows.
+
+        :param arrays: the segments, in order.
+        :param segment_size: the number of rows per segment.
+        """
+        segmented = cls(arrays[0].dtype, arrays[0].shape[1:], segment_size)
+        segmented.sealed = list(arrays)
+        if len(segmented.sealed[-1]) < segment_size:
+            segmented.tail = GrowableArray.from_array(segmented.sealed.pop())
+        return segmented
+
+    @property
+    def row_shape(self) -> tuple:
+        """Returns the shape of a single row."""
+        return self.tail.row_shape
+
+    @property
+    def segments(self) -> List[np.ndarray]:
+        """Returns the sealed segments followed by the valid rows of the tail."""
+        return self.sealed + ([self.tail.data] if len(self.tail) else [])
+
+    @property
+    def data(self) -> np.ndarray:
+        """Returns all rows as one array, which copies them if there is more than one segment."""
+        segments = self.segments
+        if len(segments) == 1:
+            return segments[0]
+        if not segments:
+            return self.tail.data
+        return np.concatenate(segments)
+
+    def __getitem__(self, rows) -> np.ndarray:
+        """
+        Returns the given rows as one array.
+
+        :param rows: a slice or an array of row positions.
+        """
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(len(self)))
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.empty((len(rows),) + (self.row_shape or ()), dtype=self.dtype)
+        segments = self.segments
+        segment_ids = rows // self.segment_size
+        for segment_id in np.unique(segment_ids):
+            selected = segment_ids == segment_id
+            result[selected] = segments[segment_id][rows[selected] - segment_id * self.segment_size]
+        return result
+
+    def append(self, rows: np.ndarray):
+        """
+        Appends rows, sealing the tail whenever it fills up.
+
+        :param rows: an array whose rows have the same shape as the rows of this array.
+        """
+        rows = np.asarray(rows, dtype=self.dtype)
+        while len(rows):
+            room = self.segment_size - len(self.tail)
+            self.tail.append(rows[:room])
+            rows = rows[room:]
+            if len(self.tail) == self.segment_size:
+                self.sealed.append(np.array(self.tail.data))
+                self.tail.clear()
+
+    def clear(self):
+        """Removes all rows, keeping the row shape."""
+        self.sealed = []
+        self.tail.clear()
+
+    def __len__(self) -> int:
+        return len(self.sealed) * self.segment_size + len(self.tail)
+
+
+class StringTable:
+    """
+    A table of strings stored as one UTF-8 blob plus an array of offsets into it.
+    """
+
+    def __init__(self):
+        self.blob = GrowableArray(np.uint8, (), capacity=1 << 16)
+        self.offsets = GrowableArray(np.int64, ())
+        self.offsets.append(np.zeros(1, dtype=np.int64))
+
+    @classmethod
+    def from_arrays(cls, blob: np.ndarray, offsets: np.ndarray) -> "StringTable":
+        """
+        Creates a table from an existing blob and offsets array (offsets has one more entry than
+        the number of strings), without copying them.
+        """
+        table = cls()
+        table.blob = GrowableArray.from_array(blob)
+        table.offsets = GrowableArray.from_array(offsets)
+        return table
+
+    def append(self, strings: List[str]):
+        """
+        Appends strings to the table.
+
+        :param strings: a list of strings.
+        """
+        encoded = [string.encode("utf-8") for string in strings]
+        lengths = np.fromiter((len(data) for data in encoded), dtype=np.int64, count=len(encoded))
+        self.offsets.append(self.offsets.data[-1] + np.cumsum(lengths))
+        self.blob.append(np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def __getitem__(self, i: int) -> str:
+        offsets = self.offsets.data
+        return self.blob.data[offsets[i] : offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __len__(self) -> int:
+        return self.offsets.data.shape[0] - 1
+
+
+class VectorStore:
+    """
+    Columnar storage for chunks: row i of every column describes the i-th saved chunk.
+
+    Embeddings can be stored compressed as float16, or as int8 with one float32 scale per row
+    (the maximum absolute value of the row maps to 127). vectors() always returns float32.
+
+    With a segment_size, embeddings are kept in a SegmentedArray, so full segments are sealed and
+    can be persisted once and memory-mapped, instead of being rewritten with every snapshot.
+    Without one, embeddings are a single array: appending to a memory-mapped store copies all of
+    them into RAM first (see GrowableArray.from_array).
+    """
+
+    DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+    def __init__(self, dtype: str = "float32", segment_size: int = None):
+        """
+        Initializes an empty store.
+
+        :param dtype: the embedding storage type: "float32", "float16" or "int8". (default: "float32")
+        :param segment_size: the number of embeddings per segment, or None to keep them in one array. (default: None)
+        """
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Invalid embedding dtype: {dtype}")
+        self.dtype = dtype
+        self.segment_size = segment_size
+        self.clear()
+
+    def clear(self):
+        """Removes all chunks."""
+        if self.segment_size is None:
+            self.embeddings = GrowableArray(self.DTYPES[self.dtype])
+        else:
+            self.embeddings = SegmentedArray(self.DTYPES[self.dtype], segment_size=self.segment_size)
+        self.scale = GrowableArray(np.float32, ())
+        self.text_index = GrowableArray(np.int64, ())
+        self.metadata_index = GrowableArray(np.int64, ())
+        self.chunks = StringTable()
+
+    def append_embeddings(self, embeddings: np.ndarray):
+        """Converts float32 embeddings to the storage type and appends them."""
+        if self.dtype != "int8":
+            self.embeddings.append(embeddings.astype(self.DTYPES[self.dtype]))
+            return
+        scale = np.maximum(np.abs(embeddings).max(axis=1), 1e-12).astype(np.float32) / 127
+        self.embeddings.append(np.rint(embeddings / scale[:, None]).astype(np.int8))
+        self.scale.append(scale)
+
+    def vectors(self, rows=slice(None)) -> np.ndarray:
+        """
+        Returns stored embeddings as a contiguous float32 array.
+
+        :param rows: a slice or an array of row positions. (default: all rows)
+        """
+        if self.segment_size is None:
+            vectors = self.embeddings.data[rows].astype(np.float32)
+        else:
+            vectors = self.embeddings[rows].astype(np.float32)
+        if self.dtype == "int8":
+            vectors *= self.scale.data[rows][:, None]
+        return np.ascontiguousarray(vectors)
+
+    @property
+    def dim(self) -> int:
+        """Returns the embedding dimension, or 0 if nothing has been stored yet."""
+        return self.embeddings.row_shape[0] if self.embeddings.row_shape else 0
+
+    def append(
+        self,
+        chunks: List[str],
+        embeddings: np.ndarray,
+        text_index: np.ndarray,
+        metadata_index: np.ndarray,
+    ):
+        """
+        Appends chunks and their embeddings to the store.
+
+        :param chunks: a list of chunk strings.
+        :param embeddings: a 2D float32 array with one embedding per chunk.
+        :param text_index: the index of the source text of every chunk.
+        :param metadata_index: the index of the metadata of every chunk.
+        """
+        self.append_embeddings(np.asarray(embeddings, dtype=np.float32))
+        self.text_index.append(text_index)
+        self.metadata_index.append(metadata_index)
+        self.chunks.append(chunks)
+
+    def take(self, rows: np.ndarray) -> "VectorStore":
+        """
+        Returns a new store holding copies of the given rows, in the given order.
+
+        :param rows: an array of row positions.
+        """
+        store = VectorStore(self.dtype, self.segment_size)
+        if len(rows) == 0:
+            return store
+        store.embeddings.append(self.embeddings[rows] if self.segment_size else self.embeddings.data[rows])
+        if self.dtype == "int8":
+            store.scale.append(self.scale.data[rows])
+        store.text_index.append(self.text_index.data[rows])
+        store.metadata_index.append(self.metadata_index.data[rows])
+
+        # gather the bytes of the selected chunks without decoding them
+        offsets = self.chunks.offsets.data
+        starts, lengths = offsets[rows], offsets[rows + 1] - offsets[rows]
+        new_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+        store.chunks = StringTable.from_arrays(self.chunks.blob.data[positions], new_offsets)
+        return store
+
+    def astype(self, dtype: str, segment_size: int = None) -> "VectorStore":
+        """
+        Returns the store with its embeddings converted to another storage type or segment size.
+
+        :param dtype: the embedding storage type: "float32", "float16" or "int8".
+        :param segment_size: the number of embeddings per segment. (default: None, keep the current layout)
+        """
+        segment_size = segment_size or self.segment_size
+        if dtype == self.dtype and segment_size == self.segment_size:
+            return self
+        store = VectorStore(dtype, segment_size)
+        if len(self):
+            if dtype == self.dtype:
+                store.embeddings.append(self.embeddings.data)
+                store.scale = self.scale
+            else:
+                store.append_embeddings(self.vectors())
+            store.text_index = self.text_index
+            store.metadata_index = self.metadata_index
+            store.chunks = self.chunks
+        return store
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the valid part of every column, for serialization. The embeddings of a segmented
+        store are a list of segments, and its segment size is included.
+        """
+        columns = {
+            "embeddings": self.embeddings.data if self.segment_size is None else self.embeddings.segments,
+            "embeddings_scale": self.scale.data,
+            "text_index": self.text_index.data,
+            "metadata_index": self.metadata_index.data,
+            "chunks_blob": self.chunks.blob.data,
+            "chunks_offsets": self.chunks.offsets.data,
+        }
+        if self.segment_size is not None:
+            columns["segment_size"] = self.segment_size
+        return columns
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "VectorStore":
+        """Creates a store from columns produced by to_dict."""
+        segmented = isinstance(data["embeddings"], list)
+        if segmented and not data["embeddings"]:
+            return cls(segment_size=data["segment_size"])
+        dtype = np.dtype((data["embeddings"][0] if segmented else data["embeddings"]).dtype).name
+        store = cls(dtype, data["segment_size"] if segmented else None)
+        if len(data["text_index"]) == 0:
+            return store
+        if "embeddings_scale" in data:
+            store.scale = GrowableArray.from_array(data["embeddings_scale"])
+        if segmented:
+            store.embeddings = SegmentedArray.from_arrays(data["embeddings"], data["segment_size"])
+        else:
+            store.embeddings = GrowableArray.from_array(data["embeddings"])
+        store.text_index = GrowableArray.from_array(data["text_index"])
+        store.metadata_index = GrowableArray.from_array(data["metadata_index"])
+        store.chunks = StringTable.from_arrays(data["chunks_blob"], data["chunks_offsets"])
+        return store
+
+    @classmethod
+    def from_entries(cls, entries: List[Dict[str, Any]]) -> "VectorStore":
+        """
+        Creates a store from the legacy list of per-chunk dictionaries with "chunk", "embedding",
+        "metadata_index" and "text_index" keys.
+        """
+        store = cls()
+        if entries:
+            store.append(
+                [entry["chunk"] for entry in entries],
+                np.array([entry["embedding"] for entry in entries], dtype=np.float32),
+                np.array([entry["text_index"] for entry in entries], dtype=np.int64),
+                np.array([entry["metadata_index"] for entry in entries], dtype=np.int64),
+            )
+        return store
+
+    def __len__(self) -> int:
+        return len(self.text_index)
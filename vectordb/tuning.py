@@ -0,0 +1,196 @@
+"""
+This module provides index auto-tuning: approximate backends are calibrated on a held-out sample
+of the stored vectors and the fastest configuration reaching a target recall is used.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+from typing import Any, Dict, List, Tuple
+import time
+
+import numpy as np
+
+from .vector_search import INDEX_BACKENDS, BaseIndex, FlatIndex, MRPTIndex, exact_search, mrpt
+
+
+# backend: (search parameter, values tried from the cheapest to the most accurate)
+SEARCH_PARAMETERS = {
+    "hnsw": ("ef_search", [16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512]),
+    "ivf": ("nprobe", [1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96, 128, 192, 256]),
+    "ivfpq": ("nprobe", [1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96, 128, 192, 256]),
+    "mrpt": ("target_recall", None),
+}
+
+
+def tunable_backends(index: str) -> List[str]:
+    """
+    Returns the backends tuned for an index name: a single backend, or every installed one for "auto".
+
+    :param index: "auto" or the name of a backend in SEARCH_PARAMETERS.
+    """
+    if index == "auto":
+        return ["hnsw", "ivf"] + (["mrpt"] if mrpt.available else [])
+    if index not in SEARCH_PARAMETERS:
+        raise ValueError(f"Index backend {index} cannot be tuned, use one of: auto, {', '.join(SEARCH_PARAMETERS)}")
+    return [index]
+
+
+def create_tuned_index(backend: str, params: Dict[str, Any]) -> BaseIndex:
+    """
+    Creates an empty index of a backend with the given constructor parameters.
+    """
+    if backend == "flat":
+        return FlatIndex()
+    return INDEX_BACKENDS[backend](**params)
+
+
+def measure(index: BaseIndex, queries: np.ndarray, truth: np.ndarray, k: int) -> Tuple[float, float]:
+    """
+    Returns the recall@k of an index over the queries and its mean single-query latency in milliseconds.
+    """
+    found, _ = index.search(queries, k)
+    recall = np.mean([len(np.intersect1d(row, expected)) for row, expected in zip(found, truth)]) / truth.shape[1]
+    timed = queries[:50]
+    start = time.perf_counter()
+    for query in timed:
+        index.search(query[None, :], k)
+    return float(recall), (time.perf_counter() - start) * 1e3 / len(timed)
+
+
+def tune(vectors: np.ndarray, backends: List[str], target_recall: float, k: int = 10, sample: int = 200, seed: int = 0) -> Dict[str, Any]:
+    """
+    Finds the fastest index configuration reaching a target recall.
+
+    Sample vectors are held out as queries, every backend is built on the remaining vectors and its
+    search parameter is raised until the recall@k against exact search reaches the target. Exact
+    search is the fallback, as it always reaches the target.
+
+    :param vectors: a 2D float32 array of stored vectors.
+    :param backends: the backends to try, see tunable_backends.
+    :param target_recall: the minimum recall@k, between 0 and 1.
+    :param k: the number of neighbours recall is measured at.
+    :param sample: the number of held-out query vectors.
+    :param seed: the seed used to pick the held-out vectors.
+    :return: the chosen configuration: "backend", constructor "params", measured "recall" and
+             "latency_ms", and the "target_recall", "k" and "size" it was tuned for.
+    """
+    rng = np.random.default_rng(seed)
+    held_out = np.zeros(len(vectors), dtype=bool)
+    held_out[rng.choice(len(vectors), min(sample, max(1, len(vectors) // 10)), replace=False)] = True
+    data, queries = np.ascontiguousarray(vectors[~held_out]), np.ascontiguousarray(vectors[held_out])
+    k = min(k, len(data))
+    truth, _ = exact_search(data, queries, k)
+
+    flat = FlatIndex()
+    flat.add(data)
+    recall, latency = measure(flat, queries, truth, k)
+    best = {"backend": "flat", "params": {}, "recall": recall, "latency_ms": latency}
+
+    for backend in backends:
+        param, values = SEARCH_PARAMETERS[backend]
+        params = {}
+        if backend in ("ivf", "ivfpq"):
+            # about 4 * sqrt(n) lists, with at least 39 training vectors per list
+            params["nlist"] = int(max(1, min(4 * np.sqrt(len(data)), len(data) // 39)))
+            values = [value for value in values if value <= params["nlist"]]
+        if backend == "mrpt":
+            values = sorted({min(0.999, target_recall + step) for step in (0, 0.01, 0.02, 0.05)})
+
+        index = None
+        for value in values:
+            if index is None or backend == "mrpt":
+                index = create_tuned_index(backend, {**params, param: value})
+                index.add(data)
+                index.search(queries[:1], k)  # builds lazily built indexes before timing
+            setattr(index, param, value)
+            recall, latency = measure(index, queries, truth, k)
+            if recall >= target_recall:
+                if latency < best["latency_ms"]:
+                    best = {"backend": backend, "params": {**params, param: value}, "recall": recall, "latency_ms": latency}
+                break
+
+    best.update({"target_recall": target_recall, "k": k, "size": len(vectors)})
+    return best
+
+
+class TunedIndex(BaseIndex):
+    """
+    An index that picks its backend and search parameters for a target recall.
+
+    Vectors are searched exactly until min_size of them have been added; the index is then tuned
+    on them (see tune) and rebuilt with the chosen configuration. The configuration is kept in a
+    dictionary that can be shared between indexes and persisted: an index created with a tuned
+    configuration uses it right away, and any index is tuned again once it holds four times more
+    vectors than the configuration was tuned on.
+    """
+
+    def __init__(self, backends: List[str], target_recall: float, config: Dict[str, Any] = None, min_size: int = 10000, k: int = 10):
+        """
+        :param backends: the backends to try, see tunable_backends.
+        :param target_recall: the minimum recall@k, between 0 and 1.
+        :param config: a dictionary holding the tuned configuration, updated in place (default: a new one).
+        :param min_size: the number of vectors from which the index is tuned.
+        :param k: the number of neighbours recall is measured at.
+        """
+        self.backends = backends
+        self.target_recall = target_recall
+        self.config = {} if config is None else config
+        self.min_size = min_size
+        self.k = k
+        self.flat = FlatIndex()
+        self.index = None
+
+    def add(self, vectors: np.ndarray):
+        if self.index is not None and len(self.index) + len(vectors) < 4 * self.config["size"]:
+            self.index.add(vectors)
+            return
+        if self.index is not None:
+            # tuned again once the index holds four times the vectors it was tuned on
+            self.flat.add(self._tuned_vectors())
+            self.index = None
+        self.flat.add(vectors)
+        count = len(self.flat)
+        stale = not self.config or count >= 4 * self.config["size"]
+        if count == 0 or (stale and count < self.min_size):
+            return
+
+        data = self.flat.index.reconstruct_n(0, count)
+        if stale:
+            config = tune(data, self.backends, self.target_recall, self.k)
+            self.config.clear()
+            self.config.update(config)
+        self.index = create_tuned_index(self.config["backend"], self.config["params"])
+        self.index.add(data)
+        self.flat.reset()
+
+    def _tuned_vectors(self) -> np.ndarray:
+        """
+        Returns the vectors of the tuned index, decoded from it (approximately for ivfpq).
+        """
+        if isinstance(self.index, MRPTIndex):
+            return np.concatenate(([] if self.index.vectors is None else [self.index.vectors]) + self.index.parts)
+        return self.index.index.reconstruct_n(0, len(self.index))
+
+    def rebuild_due(self, count: int) -> bool:
+        stale = not self.config or count >= 4 * self.config["size"]
+        return stale and (self.index is not None or count >= self.min_size)
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        return (self.flat if self.index is None else self.index).search(queries, k, mask)
+
+    def reset(self):
+        self.flat.reset()
+        self.index = None
+
+    def __len__(self) -> int:
+        return len(self.flat) if self.index is None else len(self.index)
+
+    def save(self, path: str) -> bool:
+        return (self.flat if self.index is None else self.index).save(path)
+
+    def load(self, path: str, mmap: bool = False) -> bool:
+        # the saved index was built with the configuration saved alongside it
+        if not self.config:
+            return self.flat.load(path, mmap)
+        self.index = create_tuned_index(self.config["backend"], self.config["params"])
+        return self.index.load(path, mmap)
@@ -1,23 +1,783 @@
 """
-This module provides the VectorSearch class for performing vector search using various algorithms.
+This module provides the VectorSearch class for performing vector search using various algorithms,
+and the persistent index backends used by Memory.
 """
 
 # pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
 
-from typing import List, Tuple
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from typing import Any, Callable, List, Tuple, Union
+import importlib
+import logging
+import os
+import threading
 import numpy as np
-import faiss
 
 
-MRPT_LOADED = True
-try:
-    import mrpt
-except ImportError:
-    print(
-        "Warning: mrpt could not be imported. Install with 'pip install git+https://github.com/vioshyvo/mrpt/'. "
-        "Falling back to Faiss."
+logger = logging.getLogger(__name__)
+
+
+class LazyModule:
+    """
+    A module that is only imported when one of its attributes is first used, so importing
+    vectordb does not pay for backends that are never searched with.
+    """
+
+    def __init__(self, name: str, warning: str = None):
+        """
+        :param name: the name of the module.
+        :param warning: logged once if the module turns out to be missing.
+        """
+        self.name = name
+        self.warning = warning
+        self.module = None
+        self.missing = None
+
+    def load(self) -> ModuleType:
+        """Imports the module, raising ImportError if it is not installed."""
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return self.module
+
+    @property
+    def available(self) -> bool:
+        """Returns True if the module can be imported."""
+        if self.missing is None:
+            try:
+                self.load()
+                self.missing = False
+            except ImportError:
+                self.missing = True
+                if self.warning:
+                    logger.warning(self.warning)
+        return not self.missing
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.load(), attr)
+
+
+faiss = LazyModule("faiss")
+mrpt = LazyModule(
+    "mrpt",
+    "mrpt could not be imported. Install with 'pip install git+https://github.com/vioshyvo/mrpt/'. "
+    "Falling back to Faiss.",
+)
+
+
+def __getattr__(name: str) -> Any:
+    # MRPT_LOADED used to be set at import time; it is now resolved on first access
+    if name == "MRPT_LOADED":
+        return mrpt.available
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class BaseIndex(ABC):
+    """
+    Base class for a long-lived vector index.
+
+    An index is appended to as vectors are saved and reused across searches. Vectors are
+    identified by their insertion position, starting at 0.
+    """
+
+    @abstractmethod
+    def add(self, vectors: np.ndarray):
+        """Appends a 2D float32 array of vectors to the index."""
+
+    @abstractmethod
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the index for the k nearest neighbours of every query.
+
+        :param queries: a 2D float32 array of query vectors.
+        :param k: the number of neighbours to return per query.
+        :param mask: an optional boolean array with one entry per vector; only vectors whose entry
+                     is True are considered, before the top k are selected.
+        :return: a tuple (indices, distances) of 2D arrays, padded with -1 indices when the
+                 index holds fewer than k (allowed) vectors.
+        """
+
+    @abstractmethod
+    def reset(self):
+        """Removes all vectors from the index."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Returns the number of vectors in the index."""
+
+    def save(self, path: str) -> bool:  # pylint: disable = unused-argument
+        """
+        Writes the index to a file, so it can be loaded instead of rebuilt.
+
+        :param path: the path of the file, or the prefix of the files of a composite index.
+        :return: False, without writing anything, if the index cannot be saved.
+        """
+        return False
+
+    def load(self, path: str, mmap: bool = False) -> bool:  # pylint: disable = unused-argument
+        """
+        Replaces the contents of the index with an index written by save.
+
+        :param path: the path passed to save.
+        :param mmap: whether to memory-map the vectors read-only where Faiss supports it, so that
+                     processes loading the same file share one copy. A mapped index cannot be added to.
+        :return: False if the index cannot be loaded.
+        """
+        return False
+
+    def close(self):
+        """
+        Releases the threads held by the index. The index stays usable and acquires them again when needed.
+        """
+
+    def rebuild_due(self, count: int) -> bool:  # pylint: disable = unused-argument
+        """
+        Returns True if growing the index to count vectors would train or tune it, so it is
+        better built anew from all the vectors, without blocking searches of the current index.
+
+        :param count: the number of vectors the index would hold.
+        """
+        return False
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int, ids: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Brute-force squared L2 search over vectors, used where an index cannot restrict its search.
+
+    :param vectors: a 2D float32 array of candidate vectors.
+    :param queries: a 2D float32 array of query vectors.
+    :param k: the number of neighbours to return per query.
+    :param ids: the identifiers of the candidate vectors (default: their positions).
+    :return: a tuple (indices, distances) of 2D arrays, padded with -1 indices.
+    """
+    if ids is None:
+        ids = np.arange(len(vectors))
+    n_neighbours = min(k, len(vectors))
+    indices = np.full((len(queries), k), -1, dtype=np.int64)
+    dis = np.full((len(queries), k), np.inf, dtype=np.float32)
+    if n_neighbours == 0:
+        return indices, dis
+
+    distances = (
+        np.sum(queries**2, axis=1)[:, None] - 2 * queries @ vectors.T + np.sum(vectors**2, axis=1)[None, :]
     )
-    MRPT_LOADED = False
+    top = np.argpartition(distances, n_neighbours - 1, axis=1)[:, :n_neighbours]
+    top_dis = np.take_along_axis(distances, top, axis=1)
+    order = np.argsort(top_dis, axis=1, kind="stable")
+    indices[:, :n_neighbours] = ids[np.take_along_axis(top, order, axis=1)]
+    dis[:, :n_neighbours] = np.maximum(np.take_along_axis(top_dis, order, axis=1), 0)
+    return indices, dis
+
+
+# approximate indexes search filters matching at most this many vectors per result exactly
+SELECTIVE_FILTER = 100
+# the number of vectors decoded at once by an exact search over an index
+EXACT_BLOCK = 1 << 16
+
+
+class FlatIndex(BaseIndex):
+    """
+    Exact search with a Faiss flat L2 index.
+
+    Subclasses with approximate search apply filters inside the graph beam or the visited lists,
+    where too few vectors may match: selective filters, and the queries the index returns fewer
+    matches for than exist, are searched exactly over the matching vectors instead.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.mapped = False
+
+    def _create(self, dim: int):
+        return faiss.IndexFlatL2(dim)
+
+    def _search_parameters(self, selector, k: int):  # pylint: disable = unused-argument
+        """Returns the Faiss search parameters restricting a search to the selected vectors."""
+        return faiss.SearchParameters(sel=selector)
+
+    def _approximate(self) -> bool:
+        """Returns True if a search may miss some of the nearest vectors."""
+        return False
+
+    def _exact_search(self, queries: np.ndarray, k: int, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the vectors with the given ids exactly, decoding them from the index in blocks.
+        """
+        if len(ids) == 0:
+            return exact_search(np.zeros((0, queries.shape[1]), dtype=np.float32), queries, k)
+        indices, dis = exact_search(self.index.reconstruct_batch(ids[:EXACT_BLOCK]), queries, k, ids[:EXACT_BLOCK])
+        for start in range(EXACT_BLOCK, len(ids), EXACT_BLOCK):
+            block = ids[start : start + EXACT_BLOCK]
+            block_indices, block_dis = exact_search(self.index.reconstruct_batch(block), queries, k, block)
+            indices, dis = np.concatenate([indices, block_indices], axis=1), np.concatenate([dis, block_dis], axis=1)
+            order = np.argsort(dis, axis=1, kind="stable")[:, :k]
+            indices, dis = np.take_along_axis(indices, order, axis=1), np.take_along_axis(dis, order, axis=1)
+        return indices, dis
+
+    def add(self, vectors: np.ndarray):
+        if len(vectors) == 0:
+            return
+        if self.mapped:
+            # Faiss aborts the process when a memory-mapped index is resized
+            raise ValueError("A memory-mapped index is read-only")
+        if self.index is None:
+            self.index = self._create(vectors.shape[1])
+        self.index.add(vectors)
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        if mask is None:
+            dis, indices = self.index.search(queries, k)
+            return indices, dis
+
+        ids = np.flatnonzero(mask[: len(self)]) if self._approximate() else None
+        if ids is not None and len(ids) <= SELECTIVE_FILTER * k:
+            return self._exact_search(queries, k, ids)
+        selector = faiss.IDSelectorBitmap(np.packbits(mask, bitorder="little"))
+        dis, indices = self.index.search(queries, k, params=self._search_parameters(selector, k))
+        if ids is not None:
+            short = np.count_nonzero(indices != -1, axis=1) < min(k, len(ids))
+            if short.any():
+                indices[short], dis[short] = self._exact_search(queries[short], k, ids)
+        return indices, dis
+
+    def reset(self):
+        self.index = None
+        self.mapped = False
+
+    def __len__(self) -> int:
+        return 0 if self.index is None else self.index.ntotal
+
+    def save(self, path: str) -> bool:
+        if self.index is None:
+            return False
+        faiss.write_index(self.index, path)
+        return True
+
+    def load(self, path: str, mmap: bool = False) -> bool:
+        flags = 0
+        if mmap:
+            # older Faiss versions can only map inverted lists
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        self.index = faiss.read_index(path, flags)
+        self.mapped = mmap
+        return True
+
+
+class HNSWIndex(FlatIndex):
+    """
+    Approximate search with a Faiss HNSW graph, which supports incremental additions.
+    """
+
+    def __init__(self, m: int = 32, ef_construction: int = 40, ef_search: int = 64):
+        """
+        :param m: the number of graph neighbours per vector.
+        :param ef_construction: the search depth used while adding vectors.
+        :param ef_search: the search depth used while querying.
+        """
+        super().__init__()
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+
+    def _create(self, dim: int):
+        index = faiss.IndexHNSWFlat(dim, self.m)
+        index.hnsw.efConstruction = self.ef_construction
+        index.hnsw.efSearch = self.ef_search
+        return index
+
+    def _search_parameters(self, selector, k: int):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(self.ef_search, k))
+
+    def _approximate(self) -> bool:
+        return True
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        self.index.hnsw.efSearch = max(self.ef_search, k)
+        return super().search(queries, k, mask)
+
+
+class TrainedIndex(FlatIndex):
+    """
+    Base class for Faiss indexes that have to be trained before vectors can be added.
+
+    Until enough vectors have been added to train the index, vectors are kept in an exact flat
+    index; the trained index is created and populated from it once the threshold is crossed.
+    """
+
+    def __init__(self, train_size: int):
+        """
+        :param train_size: the number of vectors required before training.
+        """
+        super().__init__()
+        self.train_size = train_size
+        self.trained = False
+
+    def _create_trained(self, dim: int):
+        """Creates the untrained Faiss index."""
+        raise NotImplementedError
+
+    def add(self, vectors: np.ndarray):
+        super().add(vectors)
+        if not self.trained and len(self) >= self.train_size:
+            data = self.index.reconstruct_n(0, self.index.ntotal)
+            index = self._create_trained(data.shape[1])
+            index.train(data)
+            index.add(data)
+            self.index = index
+            self.trained = True
+
+    def reset(self):
+        super().reset()
+        self.trained = False
+
+    def rebuild_due(self, count: int) -> bool:
+        return not self.trained and count >= self.train_size
+
+    def load(self, path: str, mmap: bool = False) -> bool:
+        super().load(path, mmap)
+        # an index saved before training holds the exact flat index
+        self.trained = not isinstance(self.index, faiss.IndexFlat)
+        ivf = faiss.try_extract_index_ivf(self.index) if self.trained else None
+        if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+        return True
+
+
+class IVFIndex(TrainedIndex):
+    """
+    Approximate search with a Faiss inverted file index.
+    """
+
+    def __init__(self, nlist: int = 100, nprobe: int = 8, train_size: int = None):
+        """
+        :param nlist: the number of inverted lists (clusters).
+        :param nprobe: the number of lists visited per query.
+        :param train_size: the number of vectors required before training (default: 39 * nlist).
+        """
+        super().__init__(train_size if train_size is not None else 39 * nlist)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        # the coarse quantizer of the trained index, which must outlive it
+        self.quantizer = None
+
+    def _create_trained(self, dim: int):
+        self.quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFFlat(self.quantizer, dim, self.nlist)
+        # maps ids to their list, so filtered searches can decode the matching vectors
+        index.make_direct_map()
+        return index
+
+    def _search_parameters(self, selector, k: int):
+        if self.trained:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        return super()._search_parameters(selector, k)
+
+    def _approximate(self) -> bool:
+        return self.trained
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.trained:
+            self.index.nprobe = self.nprobe
+        return super().search(queries, k, mask)
+
+
+class SQIndex(TrainedIndex):
+    """
+    Exact search over scalar-quantized vectors: "fp16" halves and "int8" quarters the memory of
+    the index compared to float32.
+    """
+
+    QTYPES = {"fp16": "QT_fp16", "int8": "QT_8bit"}
+
+    def __init__(self, qtype: str = "int8", train_size: int = None):
+        """
+        :param qtype: the scalar quantizer, "fp16" or "int8".
+        :param train_size: the number of vectors used to learn the value ranges (default: 1 for fp16, 1000 for int8).
+        """
+        if qtype not in self.QTYPES:
+            raise ValueError(f"Invalid scalar quantizer: {qtype}")
+        if train_size is None:
+            train_size = 1 if qtype == "fp16" else 1000
+        super().__init__(train_size)
+        self.qtype = qtype
+
+    def _create_trained(self, dim: int):
+        return faiss.IndexScalarQuantizer(dim, getattr(faiss.ScalarQuantizer, self.QTYPES[self.qtype]), faiss.METRIC_L2)
+
+
+def pq_subquantizers(dim: int, m: int) -> int:
+    """
+    Returns the largest number of PQ subquantizers not above m that divides the dimension.
+    """
+    return max(sub for sub in range(1, min(m, dim) + 1) if dim % sub == 0)
+
+
+class PQIndex(TrainedIndex):
+    """
+    Approximate search over product-quantized vectors, storing m * nbits bits per vector.
+    """
+
+    def __init__(self, m: int = 16, nbits: int = 8, train_size: int = None):
+        """
+        :param m: the number of subquantizers (reduced to a divisor of the dimension if needed).
+        :param nbits: the number of bits per subquantizer code.
+        :param train_size: the number of vectors required before training (default: 39 * 2 ** nbits).
+        """
+        super().__init__(train_size if train_size is not None else 39 * 2**nbits)
+        self.m = m
+        self.nbits = nbits
+
+    def _create_trained(self, dim: int):
+        return faiss.IndexPQ(dim, pq_subquantizers(dim, self.m), self.nbits)
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        if mask is None or not self.trained:
+            return super().search(queries, k, mask)
+        # IndexPQ cannot take an ID selector, so search the decoded allowed vectors instead
+        return self._exact_search(queries, k, np.flatnonzero(mask[: len(self)]))
+
+
+class IVFPQIndex(TrainedIndex):
+    """
+    Approximate search with a Faiss inverted file index over product-quantized vectors.
+    """
+
+    def __init__(self, nlist: int = 100, m: int = 16, nbits: int = 8, nprobe: int = 8, train_size: int = None):
+        """
+        :param nlist: the number of inverted lists (clusters).
+        :param m: the number of subquantizers (reduced to a divisor of the dimension if needed).
+        :param nbits: the number of bits per subquantizer code.
+        :param nprobe: the number of lists visited per query.
+        :param train_size: the number of vectors required before training (default: enough for both quantizers).
+        """
+        super().__init__(train_size if train_size is not None else 39 * max(nlist, 2**nbits))
+        self.nlist = nlist
+        self.m = m
+        self.nbits = nbits
+        self.nprobe = nprobe
+        # the coarse quantizer of the trained index, which must outlive it
+        self.quantizer = None
+
+    def _create_trained(self, dim: int):
+        self.quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(self.quantizer, dim, self.nlist, pq_subquantizers(dim, self.m), self.nbits)
+        index.make_direct_map()
+        return index
+
+    def _search_parameters(self, selector, k: int):
+        if self.trained:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        return super()._search_parameters(selector, k)
+
+    def _approximate(self) -> bool:
+        return self.trained
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.trained:
+            self.index.nprobe = self.nprobe
+        return super().search(queries, k, mask)
+
+
+class RerankIndex(BaseIndex):
+    """
+    Wraps an approximate or compressed index: it fetches factor * k candidates and re-ranks them
+    by their exact distance to the query, computed from the stored vectors.
+    """
+
+    def __init__(self, index: BaseIndex, lookup: Callable[[np.ndarray], np.ndarray], factor: int = 4):
+        """
+        :param index: the index producing candidates.
+        :param lookup: a function returning the float32 vectors at the given positions.
+        :param factor: the number of candidates fetched per result.
+        """
+        self.index = index
+        self.lookup = lookup
+        self.factor = factor
+
+    def add(self, vectors: np.ndarray):
+        self.index.add(vectors)
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        indices, _ = self.index.search(queries, k * self.factor, mask)
+        found = indices != -1
+        candidates = self.lookup(indices[found])
+
+        dis = np.full(indices.shape, np.inf, dtype=np.float32)
+        rows = np.nonzero(found)[0]
+        dis[found] = np.sum((candidates - queries[rows]) ** 2, axis=1)
+
+        order = np.argsort(dis, axis=1, kind="stable")[:, :k]
+        indices = np.take_along_axis(indices, order, axis=1)
+        dis = np.take_along_axis(dis, order, axis=1)
+        indices[np.isinf(dis)] = -1
+        return indices, dis
+
+    def reset(self):
+        self.index.reset()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def save(self, path: str) -> bool:
+        return self.index.save(path)
+
+    def load(self, path: str, mmap: bool = False) -> bool:
+        return self.index.load(path, mmap)
+
+    def close(self):
+        self.index.close()
+
+    def rebuild_due(self, count: int) -> bool:
+        return self.index.rebuild_due(count)
+
+
+class MRPTIndex(BaseIndex):
+    """
+    Search with an MRPT index. MRPT indexes cannot be appended to, so the index is rebuilt lazily
+    on the first search after new vectors have been added. Rebuilds are serialized by a lock, so
+    concurrent searches are safe.
+    """
+
+    def __init__(self, target_recall: float = None, k: int = 100):
+        """
+        :param target_recall: when set, the index is autotuned for this recall and queried
+                              approximately; otherwise exact search is used.
+        :param k: the number of neighbours the index is autotuned for. Searches for fewer
+                  neighbours keep the nearest of them; searches for more are exact. (default: 100)
+        """
+        if not mrpt.available:
+            raise ImportError("mrpt is required for the MRPT index backend.")
+        self.target_recall = target_recall
+        self.k = k
+        self.parts = []
+        self.vectors = None
+        self.index = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # copies rebuild the MRPT index on their first search
+        return dict(self.__dict__, index=None, lock=None)
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def add(self, vectors: np.ndarray):
+        if len(vectors) == 0:
+            return
+        self.parts.append(np.ascontiguousarray(vectors, dtype=np.float32))
+        self.index = None
+
+    def _merge_parts(self):
+        if self.parts:
+            parts = self.parts if self.vectors is None else [self.vectors] + self.parts
+            self.vectors = np.ascontiguousarray(np.concatenate(parts))
+            self.parts = []
+
+    def _build(self):
+        self._merge_parts()
+        self.index = mrpt.MRPTIndex(self.vectors)
+        if self.target_recall is not None:
+            # autotuning is done once per build, whatever k searches ask for
+            self.index.build_autotune_sample(self.target_recall, min(self.k, len(self.vectors)))
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        if mask is not None:
+            # MRPT cannot restrict its search, so search the allowed vectors exactly
+            with self.lock:
+                self._merge_parts()
+            ids = np.nonzero(mask)[0]
+            return exact_search(self.vectors[ids], queries, k, ids)
+
+        n_neighbours = min(k, len(self))
+        with self.lock:
+            if self.index is None:
+                self._build()
+            index = self.index
+        if self.target_recall is None or k > self.k:
+            indices, dis = index.exact_search(queries, n_neighbours, return_distances=True)
+        else:
+            indices, dis = index.ann(queries, return_distances=True)
+        indices, dis = np.atleast_2d(indices)[:, :k], np.atleast_2d(dis)[:, :k]
+        if indices.shape[1] < k:
+            pad = ((0, 0), (0, k - indices.shape[1]))
+            indices = np.pad(indices, pad, constant_values=-1)
+            dis = np.pad(dis, pad, constant_values=np.inf)
+        return indices, dis
+
+    def reset(self):
+        self.parts = []
+        self.vectors = None
+        self.index = None
+
+    def __len__(self) -> int:
+        return (0 if self.vectors is None else len(self.vectors)) + sum(len(part) for part in self.parts)
+
+
+class AutoIndex(BaseIndex):
+    """
+    Uses an exact Faiss flat index for small collections and switches to MRPT once the
+    collection grows past a threshold (when mrpt is installed).
+    """
+
+    def __init__(self, threshold: int = 3000):
+        """
+        :param threshold: the number of vectors from which MRPT is used.
+        """
+        self.threshold = threshold
+        self.flat = FlatIndex()
+        self.mrpt = None
+
+    def add(self, vectors: np.ndarray):
+        # mrpt is only looked up once there is something to index
+        if self.mrpt is None and len(vectors) and len(self.flat) == 0 and mrpt.available:
+            self.mrpt = MRPTIndex()
+        self.flat.add(vectors)
+        if self.mrpt is not None:
+            self.mrpt.add(vectors)
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.mrpt is not None and len(self) >= self.threshold and mask is None:
+            return self.mrpt.search(queries, k)
+        return self.flat.search(queries, k, mask)
+
+    def reset(self):
+        self.flat.reset()
+        if self.mrpt is not None:
+            self.mrpt.reset()
+
+    def __len__(self) -> int:
+        return len(self.flat)
+
+    def save(self, path: str) -> bool:
+        # MRPT indexes cannot be saved
+        return self.mrpt is None and self.flat.save(path)
+
+    def load(self, path: str, mmap: bool = False) -> bool:
+        return self.flat.load(path, mmap)
+
+
+class SegmentedIndex(BaseIndex):
+    """
+    Splits vectors into consecutive segments of segment_size, each with its own index. Segments
+    are searched in parallel on a thread pool (Faiss releases the GIL while searching) and their
+    results are merged into the overall top k.
+    """
+
+    def __init__(self, factory: Callable[[], BaseIndex], segment_size: int = 1 << 17, workers: int = None):
+        """
+        :param factory: a function creating the empty index of a new segment.
+        :param segment_size: the number of vectors per segment.
+        :param workers: the number of search threads (default: the number of CPUs).
+        """
+        self.factory = factory
+        self.segment_size = segment_size
+        self.workers = workers
+        self.segments = []
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        return dict(self.__dict__, pool=None, lock=None)
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def add(self, vectors: np.ndarray):
+        while len(vectors):
+            if not self.segments or len(self.segments[-1]) >= self.segment_size:
+                self.segments.append(self.factory())
+            room = self.segment_size - len(self.segments[-1])
+            self.segments[-1].add(vectors[:room])
+            vectors = vectors[room:]
+
+    def _search_segment(self, job: Tuple[int, BaseIndex, np.ndarray], queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, segment, mask = job
+        indices, dis = segment.search(queries, k, mask)
+        return np.where(indices == -1, -1, indices + start), dis
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        jobs = []
+        for i, segment in enumerate(self.segments):
+            start = i * self.segment_size
+            segment_mask = None if mask is None else mask[start : start + len(segment)]
+            if segment_mask is None or segment_mask.any():
+                jobs.append((start, segment, segment_mask))
+        if not jobs:
+            return np.full((len(queries), k), -1, dtype=np.int64), np.full((len(queries), k), np.inf, dtype=np.float32)
+
+        if len(jobs) > 1 and self.workers != 1:
+            with self.lock:
+                if self.pool is None:
+                    self.pool = ThreadPoolExecutor(self.workers)
+                pool = self.pool
+            results = list(pool.map(lambda job: self._search_segment(job, queries, k), jobs))
+        else:
+            results = [self._search_segment(job, queries, k) for job in jobs]
+
+        # merge the per-segment top k lists into the overall top k
+        indices = np.concatenate([result[0] for result in results], axis=1)
+        dis = np.concatenate([result[1] for result in results], axis=1).astype(np.float32)
+        dis[indices == -1] = np.inf
+        order = np.argsort(dis, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(dis, order, axis=1)
+
+    def reset(self):
+        self.segments = []
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self.segments)
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def save(self, path: str) -> bool:
+        """Writes every segment to its own file, path.000000, path.000001 and so on."""
+        return all(segment.save(f"{path}.{i:06d}") for i, segment in enumerate(self.segments))
+
+    def load(self, path: str, mmap: bool = False) -> bool:
+        segments = []
+        while os.path.exists(f"{path}.{len(segments):06d}"):
+            segment = self.factory()
+            if not segment.load(f"{path}.{len(segments):06d}", mmap):
+                return False
+            segments.append(segment)
+        self.segments = segments
+        return True
+
+
+INDEX_BACKENDS = {
+    "auto": AutoIndex,
+    "flat": FlatIndex,
+    "ivf": IVFIndex,
+    "hnsw": HNSWIndex,
+    "mrpt": MRPTIndex,
+    "fp16": lambda: SQIndex("fp16"),
+    "sq8": lambda: SQIndex("int8"),
+    "pq": PQIndex,
+    "ivfpq": IVFPQIndex,
+}
+
+
+def create_index(index: Union[BaseIndex, str] = "auto") -> BaseIndex:
+    """
+    Creates an index from a backend name, or returns the given index instance.
+
+    :param index: a BaseIndex instance or one of "auto", "flat", "ivf", "hnsw", "mrpt", "fp16", "sq8", "pq", "ivfpq".
+    :return: a BaseIndex instance.
+    """
+    if isinstance(index, BaseIndex):
+        return index
+    if isinstance(index, str):
+        if index not in INDEX_BACKENDS:
+            raise ValueError(f"Invalid index backend: {index}")
+        return INDEX_BACKENDS[index]()
+    raise TypeError("Index must be a BaseIndex instance or string")
 
 
 class VectorSearch:
@@ -26,78 +786,134 @@ class VectorSearch:
     """
 
     @staticmethod
-    def get_unique_k_elements(i, d, k=15, diverse=False):
+    def first_occurrences(indices: np.ndarray) -> np.ndarray:
         """
-        Return a tuple of arrays containing unique matching elements
+        Returns the positions of the first occurrence of every distinct value, in order.
+
+        :param indices: a 1D array of values.
+        :return: an ascending array of positions into indices.
         """
-        ii, dd = [], []
-        num_rows, num_cols = i.shape
+        _, first = np.unique(indices, return_index=True)
+        return np.sort(first)
 
-        if diverse:
-            for col in range(num_cols):
-                round_elements = [(i[row][col], d[row][col]) for row in range(num_rows)]
-                round_elements.sort(key=lambda x: x[1])
-                for idx, dist in round_elements:
-                    if idx not in ii:
-                        ii.append(idx)
-                        dd.append(dist)
-                        if len(ii) >= k:
-                            return np.array(ii), np.array(dd)
+    @staticmethod
+    def mmr(queries: np.ndarray, candidates: np.ndarray, k: int, diversity: float) -> np.ndarray:
+        """
+        Selects candidates by maximal marginal relevance: every pick maximizes
+        (1 - diversity) * similarity to the queries - diversity * similarity to the closest pick so far,
+        with cosine similarities and the most similar query counting for relevance.
 
+        :param queries: a 2D array of query vectors.
+        :param candidates: a 2D array of candidate vectors.
+        :param k: the number of candidates to select.
+        :param diversity: between 0 (rank by relevance only) and 1 (rank by novelty only).
+        :return: the positions of the selected candidates, in the order they were picked.
+        """
+        def normalize(vectors):
+            vectors = np.asarray(vectors, dtype=np.float32)
+            return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        candidates = normalize(candidates)
+        relevance = (normalize(queries) @ candidates.T).max(axis=0)
+        similarity = candidates @ candidates.T
+        k = min(k, len(candidates))
+        selected = np.empty(k, dtype=np.int64)
+        redundancy = np.zeros(len(candidates), dtype=np.float32)
+        taken = np.zeros(len(candidates), dtype=bool)
+        for step in range(k):
+            scores = (1 - diversity) * relevance - diversity * redundancy
+            scores[taken] = -np.inf
+            selected[step] = pick = int(np.argmax(scores))
+            taken[pick] = True
+            redundancy = similarity[pick] if step == 0 else np.maximum(redundancy, similarity[pick])
+        return selected
+
+    @staticmethod
+    def get_unique_k_elements(i, d, k=15, diverse=False):
+        """
+        Return a tuple of arrays containing unique matching elements.
+
+        With diverse=False the closest matches across all queries are taken. With diverse=True the
+        nearest match of every query is taken first, then the second nearest and so on.
+        """
+        i = np.asarray(i)
+        d = np.asarray(d)
+        if diverse:
+            # rank by neighbour position first and distance second
+            ranks = np.broadcast_to(np.arange(i.shape[1]), i.shape)
+            order = np.lexsort((d.ravel(), ranks.ravel()))
         else:
-            for idx, dist in sorted(zip(i.ravel(), d.ravel()), key=lambda x: x[1]):
-                if idx not in ii:
-                    ii.append(idx)
-                    dd.append(dist)
-                    if len(ii) >= k:
-                        break
-       
-        return np.array(ii), np.array(dd)
+            order = np.argsort(d.ravel(), kind="stable")
+
+        ii, dd = i.ravel()[order], d.ravel()[order]
+        found = ii != -1
+        ii, dd = ii[found], dd[found]
+
+        first = VectorSearch.first_occurrences(ii)[:k]
+        return ii[first], dd[first]
 
     @staticmethod
-    def run_mrpt(vector, vectors, k=15, batch_results="flatten"):
+    def search_arrays(
+        index: BaseIndex,
+        query_embedding,
+        top_n: int,
+        batch_results: str = "flatten",
+        mask: np.ndarray = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Search for the most similar vectors using MRPT method.
+        Searches an existing index for the most similar vectors to the query_embedding.
+
+        :param index: the BaseIndex to be searched.
+        :param query_embedding: a vector, or a list of vectors for a batch of queries.
+        :param top_n: the number of most similar vectors to return.
+        :param batch_results: when input is a list of vectors, output algo can be "flatten" or "diverse"
+        :param mask: an optional boolean array restricting the search to the vectors marked True.
+        :return: a tuple (indices, distances) of 1D arrays of the top_n most similar vectors.
         """
-        index = mrpt.MRPTIndex(vectors)
+        if len(index) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
 
-        if (
-            isinstance(vector, (list, np.ndarray)) and len(np.shape(vector)) > 1
-        ):  # If vector is a list of vectors
-            res = index.exact_search(
-                np.array(vector).astype(np.float32), k, return_distances=True
+        queries = np.asarray(query_embedding, dtype=np.float32)
+        if queries.ndim > 1:
+            indices, dis = index.search(np.ascontiguousarray(queries), top_n, mask)
+            return VectorSearch.get_unique_k_elements(
+                indices, dis, top_n, diverse=batch_results == "diverse"
             )
 
-            if batch_results == "diverse":
-                return VectorSearch.get_unique_k_elements(
-                    res[0], res[1], k, diverse=True
-                )
+        indices, dis = index.search(np.ascontiguousarray(queries[None, :]), top_n, mask)
+        found = indices[0] != -1
+        return indices[0][found], dis[0][found]
 
-            return VectorSearch.get_unique_k_elements(res[0], res[1], k, diverse=False)
-        res = index.exact_search(
-            np.array(vector).astype(np.float32), k, return_distances=True
-        )
-        return res[0].tolist(), res[1].tolist()
+    @staticmethod
+    def search_index(
+        index: BaseIndex,
+        query_embedding,
+        top_n: int,
+        batch_results: str = "flatten",
+    ) -> List[Tuple[int, float]]:
+        """
+        Searches an existing index, returning (index, distance) tuples as search_vectors does.
+        """
+        indices, dis = VectorSearch.search_arrays(index, query_embedding, top_n, batch_results)
+        return list(zip(indices.tolist(), dis.tolist()))
+
+    @staticmethod
+    def run_mrpt(vector, vectors, k=15, batch_results="flatten"):
+        """
+        Search for the most similar vectors using MRPT method.
+        """
+        index = MRPTIndex()
+        index.add(vectors)
+        return VectorSearch.search_arrays(index, vector, k, batch_results)
 
     @staticmethod
     def run_faiss(vector, vectors, k=15, batch_results="flatten"):
         """
         Search for the most similar vectors using Faiss method.
         """
-        index = faiss.IndexFlatL2(vectors.shape[1])
+        index = FlatIndex()
         index.add(vectors)
-
-        if (
-            isinstance(vector, (list, np.ndarray)) and len(np.shape(vector)) > 1
-        ):  # If vector is a list of vectors
-
-            dis, indices = index.search(np.array(vector), k)
-
-            if batch_results == "diverse":
-                return VectorSearch.get_unique_k_elements(indices, dis, k, diverse=True)
-            return VectorSearch.get_unique_k_elements(indices, dis, k, diverse=False)
-        dis, indices = index.search(np.array([vector]), k)
-        return indices[0], dis[0]
+        return VectorSearch.search_arrays(index, vector, k, batch_results)
 
     @staticmethod
     def search_vectors(
@@ -109,24 +925,19 @@ class VectorSearch:
         """
         Searches for the most similar vectors to the query_embedding in the given embeddings.
 
+        This builds a throwaway index on every call; Memory keeps a persistent index instead.
+
         :param query_embedding: a list of floats representing the query vector.
         :param embeddings: a list of vectors to be searched, where each vector is a list of floats.
         :param top_n: the number of most similar vectors to return.
         :param batch_results: when input is a list of vectors, output algo can be "flatten" or "diverse"
         :return: a list of indices of the top_n most similar vectors in the embeddings.
-        
-        """
-        if isinstance(query_embedding, list):
-            query_embedding = np.array(query_embedding).astype(np.float32)
 
+        """
         if isinstance(embeddings, list):
             embeddings = np.array(embeddings).astype(np.float32)
 
-        if len(embeddings) < 3000 or not MRPT_LOADED:
-            call_search = VectorSearch.run_faiss
-        else:
-            call_search = VectorSearch.run_mrpt
-
-        indices, dis = call_search(query_embedding, embeddings, top_n, batch_results)
+        index = AutoIndex()
+        index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
 
-        return list(zip(indices, dis))
+        return VectorSearch.search_index(index, query_embedding, top_n, batch_results)
@@ -0,0 +1,126 @@
+"""
+This module provides the WriteAheadLog class, an append-only log of memory updates that is
+replayed on top of the last snapshot when a memory directory is opened.
+"""
+
+# pylint: disable = line-too-long, trailing-whitespace, trailing-newlines, line-too-long, missing-module-docstring, import-error, too-few-public-methods, too-many-instance-attributes, too-many-locals
+
+from typing import Any, Dict, List
+import os
+import pickle
+import struct
+import zlib
+
+
+# every record is framed as: payload length, crc32 of the payload, pickled payload
+HEADER = struct.Struct("<II")
+FSYNC_POLICIES = {"always", "batch", "close"}
+
+
+def sync_directory(path: str):
+    """
+    Fsyncs a directory, so that files created, renamed or deleted in it stay so after a power
+    loss. Does nothing on platforms that cannot open directories.
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    descriptor = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class WriteAheadLog:
+    """
+    An append-only file of pickled records.
+
+    The fsync policy controls durability: "always" syncs after every record, "batch" syncs once
+    every batch_size records, and "close" only syncs when the log is synced explicitly or closed.
+    A torn or corrupt tail left by a crash is detected by its checksum and cut off on replay.
+    """
+
+    def __init__(self, path: str, fsync: str = "batch", batch_size: int = 32):
+        """
+        Initializes the log.
+
+        :param path: a string containing the path to the log file.
+        :param fsync: the fsync policy: "always", "batch" or "close" (default: "batch").
+        :param batch_size: the number of records between syncs for the "batch" policy.
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy: {fsync}")
+        self.path = path
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.file_handler = None
+        self.pending = 0
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+
+    def replay(self) -> List[Dict[str, Any]]:
+        """
+        Reads every intact record in the log and truncates anything after the last one.
+
+        :return: a list of the records in the order they were appended.
+        """
+        records = []
+        if not os.path.exists(self.path):
+            return records
+
+        valid_size = 0
+        with open(self.path, "rb") as file_handler:
+            while True:
+                header = file_handler.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                length, checksum = HEADER.unpack(header)
+                payload = file_handler.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    break
+                records.append(pickle.loads(payload))
+                valid_size += HEADER.size + length
+
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, "r+b") as file_handler:
+                file_handler.truncate(valid_size)
+        self.size = valid_size
+        return records
+
+    def append(self, record: Dict[str, Any]):
+        """
+        Appends a record to the log.
+
+        :param record: a picklable dictionary.
+        """
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.file_handler is None:
+            created = not os.path.exists(self.path)
+            self.file_handler = open(self.path, "ab")  # pylint: disable = consider-using-with
+            if created:
+                sync_directory(os.path.dirname(os.path.abspath(self.path)))
+        self.file_handler.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.size += HEADER.size + len(payload)
+        self.pending += 1
+
+        if self.fsync == "always" or (self.fsync == "batch" and self.pending >= self.batch_size):
+            self.sync()
+        else:
+            self.file_handler.flush()
+
+    def sync(self):
+        """
+        Flushes and fsyncs all appended records.
+        """
+        if self.file_handler is not None:
+            self.file_handler.flush()
+            os.fsync(self.file_handler.fileno())
+        self.pending = 0
+
+    def close(self):
+        """
+        Syncs and closes the log file.
+        """
+        if self.file_handler is not None:
+            self.sync()
+            self.file_handler.close()
+            self.file_handler = None